@@ -0,0 +1,202 @@
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
+from metrics import REGISTRY
+
+DEFAULT_USER_RATE = 20.0
+DEFAULT_USER_BURST = 40
+DEFAULT_READ_RATE = 10.0
+DEFAULT_READ_BURST = 30
+DEFAULT_WRITE_RATE = 4.0
+DEFAULT_WRITE_BURST = 10
+# Buckets of the least recently seen clients are dropped past this; a
+# dropped bucket comes back full, which only an idle client can notice.
+DEFAULT_MAX_BUCKETS = 10000
+DEFAULT_MAX_CONCURRENT = 8
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_QUEUE_TIMEOUT = 2.0
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "workstation_admission_rejections_total",
+    "Requests turned away by admission control, by reason.",
+    ("reason",),
+)
+FILE_OPS_ACTIVE = REGISTRY.gauge(
+    "workstation_file_ops_active",
+    "Expensive file operations currently running.",
+)
+FILE_OPS_QUEUED = REGISTRY.gauge(
+    "workstation_file_ops_queued",
+    "Expensive file operations waiting for a slot.",
+)
+FILE_OPS_WAIT_SECONDS = REGISTRY.histogram(
+    "workstation_file_ops_wait_seconds",
+    "Time expensive file operations waited for a slot.",
+)
+
+
+class RateLimitedError(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OverloadedError(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+# Holds up to ``burst`` tokens and gains ``rate`` per second; a request
+# takes one.
+class TokenBucket:
+    def __init__(self, rate: float, burst: int, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        # Seconds until a token is available, refilling up to ``now``.
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Token buckets per client, one for all of its requests and one per route,
+# with separate limits for reads and writes. A request only takes tokens
+# when every bucket it needs has one, so a rejected request costs nothing.
+class RateLimiter:
+    def __init__(
+        self,
+        user_rate: float = DEFAULT_USER_RATE,
+        user_burst: int = DEFAULT_USER_BURST,
+        read_rate: float = DEFAULT_READ_RATE,
+        read_burst: int = DEFAULT_READ_BURST,
+        write_rate: float = DEFAULT_WRITE_RATE,
+        write_burst: int = DEFAULT_WRITE_BURST,
+        max_buckets: int = DEFAULT_MAX_BUCKETS,
+    ) -> None:
+        self.user_limit = (user_rate, user_burst)
+        self.read_limit = (read_rate, read_burst)
+        self.write_limit = (write_rate, write_burst)
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(
+        self, key: Tuple[str, ...], limit: Tuple[float, int], now: float
+    ) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*limit, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def check(
+        self,
+        client: str,
+        method: str,
+        route: str,
+        kind: Optional[str] = None,
+    ) -> None:
+        # Raises RateLimitedError with the time until the request would be
+        # admitted. ``kind`` is "read" or "write", by default from the
+        # method.
+        if kind is None:
+            kind = "write" if method in WRITE_METHODS else "read"
+        route_limit = self.write_limit if kind == "write" else self.read_limit
+        now = time.monotonic()
+        with self._lock:
+            user = self._bucket((client,), self.user_limit, now)
+            per_route = self._bucket((client, method, route), route_limit, now)
+            user_wait = user.wait_time(now)
+            route_wait = per_route.wait_time(now)
+            if not user_wait and not route_wait:
+                user.tokens -= 1
+                per_route.tokens -= 1
+                return
+        if route_wait >= user_wait:
+            ADMISSION_REJECTIONS.inc("route_rate")
+            raise RateLimitedError(
+                f"Too many {method} {route} requests", route_wait
+            )
+        ADMISSION_REJECTIONS.inc("user_rate")
+        raise RateLimitedError("Too many requests", user_wait)
+
+
+# A cap on expensive file operations running at once across all clients.
+# Past it, up to ``max_queue`` requests wait up to ``queue_timeout`` seconds
+# for a slot, first come first served; the rest are turned away at once so
+# that request threads stay free for cheap requests.
+class ConcurrencyLimiter:
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiting: Deque[object] = deque()
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            if not self._waiting and self._active < self.max_concurrent:
+                self._take()
+                return
+            if len(self._waiting) >= self.max_queue:
+                ADMISSION_REJECTIONS.inc("queue_full")
+                raise OverloadedError("Server busy", self.queue_timeout)
+            waiter = object()
+            self._waiting.append(waiter)
+            FILE_OPS_QUEUED.set(value=len(self._waiting))
+            start = time.monotonic()
+            deadline = start + self.queue_timeout
+            try:
+                while not (
+                    self._waiting[0] is waiter
+                    and self._active < self.max_concurrent
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        ADMISSION_REJECTIONS.inc("queue_timeout")
+                        raise OverloadedError(
+                            "Server busy", self.queue_timeout
+                        )
+                    self._cond.wait(remaining)
+                self._take()
+                FILE_OPS_WAIT_SECONDS.observe(time.monotonic() - start)
+            finally:
+                self._waiting.remove(waiter)
+                FILE_OPS_QUEUED.set(value=len(self._waiting))
+                # The next in line may be able to go now, whether this one
+                # got a slot or gave up its place.
+                self._cond.notify_all()
+
+    def _take(self) -> None:
+        self._active += 1
+        FILE_OPS_ACTIVE.set(value=self._active)
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            FILE_OPS_ACTIVE.set(value=self._active)
+            self._cond.notify_all()
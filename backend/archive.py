@@ -0,0 +1,74 @@
+import os
+import zipfile
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+
+ARCHIVE_COMPRESSION = zipfile.ZIP_DEFLATED
+ARCHIVE_COMPRESSLEVEL = 6
+MAX_ARCHIVE_ENTRIES = 10000
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _ChunkSink:
+    # The unseekable file object a streaming ZipFile writes into; whatever
+    # has been written since the last drain() is handed to the response.
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    # Builds the archive while it is being sent: only the entry being
+    # compressed is held in memory, whatever the number of entries.
+    sink = _ChunkSink()
+    with zipfile.ZipFile(
+        sink,
+        "w",
+        compression=ARCHIVE_COMPRESSION,
+        compresslevel=ARCHIVE_COMPRESSLEVEL,
+    ) as archive:
+        for name, data in entries:
+            with archive.open(name, "w") as member:
+                member.write(data)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def iter_members(
+    fileobj: BinaryIO, max_entries: int = MAX_ARCHIVE_ENTRIES
+) -> Iterator[Tuple[str, BinaryIO]]:
+    # Yields (basename, open member) for the regular files of a zip archive.
+    # Directory structure is flattened.
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ArchiveError("Uploaded file is not a zip archive")
+    with archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if len(members) > max_entries:
+            raise ArchiveError(f"Archive has more than {max_entries} entries")
+        for info in members:
+            name = os.path.basename(info.filename.replace("\\", "/"))
+            if not name or name.startswith("."):
+                continue
+            with archive.open(info) as member:
+                yield name, member
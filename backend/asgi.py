@@ -0,0 +1,256 @@
+import io
+import os
+import sys
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from loguru import logger
+
+DEFAULT_MAX_THREADS = 32
+REQUEST_READ_SIZE = 64 * 1024
+
+
+def build_environ(scope: Dict, body) -> Dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "")
+        .encode("utf-8")
+        .decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # The body stream ends where the request does, so readers may read
+        # to EOF even without a Content-Length (chunked uploads).
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        if name in environ:
+            value = f"{environ[name]},{value}"
+        environ[name] = value
+    return environ
+
+
+# The request body as the app reads it. Each read on the worker thread pulls
+# the next chunk from the ASGI server, so nothing is buffered here ahead of
+# the app: an upload the app rejects by its Content-Length, or stops reading
+# past a size limit, is never received in full.
+class RequestBody(io.RawIOBase):
+    def __init__(
+        self,
+        receive: Callable,
+        loop: asyncio.AbstractEventLoop,
+        first: Dict,
+        disconnected: threading.Event,
+        on_complete: Callable[[], None],
+    ) -> None:
+        self._receive = receive
+        self._loop = loop
+        self._chunk = first.get("body", b"")
+        self._offset = 0
+        self._more = first.get("more_body", False)
+        self._disconnected = disconnected
+        self._on_complete = on_complete
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._chunk) and self._more:
+            message = asyncio.run_coroutine_threadsafe(
+                self._receive(), self._loop
+            ).result()
+            if message["type"] == "http.disconnect":
+                self._more = False
+                self._disconnected.set()
+                return 0
+            self._chunk = message.get("body", b"")
+            self._offset = 0
+            self._more = message.get("more_body", False)
+            if not self._more:
+                self._on_complete()
+        size = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:size] = self._chunk[self._offset : self._offset + size]
+        self._offset += size
+        return size
+
+
+# Serves a WSGI app (the Flask app in run.py) from an ASGI server. Each
+# request runs on a bounded thread pool, so a slow disk or identity provider
+# holds one worker thread instead of the event loop, and the pool size caps
+# how much blocking work runs at once. Response chunks are handed back to
+# the loop one at a time, which keeps streaming responses streaming.
+class WSGIToASGI:
+    def __init__(
+        self,
+        wsgi_app: Callable,
+        max_threads: int = DEFAULT_MAX_THREADS,
+        on_shutdown: Optional[List[Callable[[], None]]] = None,
+    ) -> None:
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix="wsgi"
+        )
+        self.on_shutdown = on_shutdown or []
+
+    async def __call__(self, scope: Dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope {scope['type']}")
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.shutdown
+                )
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+        for hook in self.on_shutdown:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Shutdown hook {hook} failed: {e}")
+
+    async def _http(self, scope: Dict, receive, send) -> None:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+        state: Dict = {"finished": False, "watcher": None}
+
+        def watch() -> None:
+            # Disconnects are only watched for once the body has been read;
+            # until then the body's reads are the ones receiving.
+            if not state["finished"] and state["watcher"] is None:
+                state["watcher"] = asyncio.ensure_future(
+                    self._watch_disconnect(receive, disconnected)
+                )
+
+        body = RequestBody(
+            receive,
+            loop,
+            message,
+            disconnected,
+            lambda: loop.call_soon_threadsafe(watch),
+        )
+        if not message.get("more_body", False):
+            watch()
+        environ = build_environ(
+            scope, io.BufferedReader(body, REQUEST_READ_SIZE)
+        )
+        try:
+            await loop.run_in_executor(
+                self.executor,
+                self._run_wsgi,
+                environ,
+                send,
+                loop,
+                disconnected,
+            )
+        finally:
+            state["finished"] = True
+            if state["watcher"] is not None:
+                state["watcher"].cancel()
+
+    async def _watch_disconnect(self, receive, disconnected) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                return
+
+    def _run_wsgi(self, environ, send, loop, disconnected) -> None:
+        state: Dict = {}
+
+        def call(message: Dict) -> None:
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def send_start() -> None:
+            if not state.get("started"):
+                state["started"] = True
+                call(
+                    {
+                        "type": "http.response.start",
+                        "status": state["status"],
+                        "headers": state["headers"],
+                    }
+                )
+
+        def write(data: bytes) -> None:
+            send_start()
+            call(
+                {"type": "http.response.body", "body": data, "more_body": True}
+            )
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info and state.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            state["status"] = int(status.split(" ", 1)[0])
+            state["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in response_headers
+            ]
+            return write
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if disconnected.is_set():
+                    return
+                if chunk:
+                    write(chunk)
+            if not disconnected.is_set():
+                send_start()
+                call({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+def create_application() -> WSGIToASGI:
+    from run import app, file_manager, guest_reaper, user_manager
+
+    # The reaper removes workspaces through the file manager, so it stops
+    # first, as it does under run.py's atexit hooks.
+    on_shutdown = [guest_reaper.close, file_manager.close]
+    if user_manager:
+        on_shutdown.append(user_manager.close)
+    return WSGIToASGI(
+        app,
+        max_threads=int(
+            os.environ.get("WORKSTATION_THREADS", DEFAULT_MAX_THREADS)
+        ),
+        on_shutdown=on_shutdown,
+    )
+
+
+application = create_application()
@@ -0,0 +1,80 @@
+"""Compare the old decode/re-encode flow I/O path with the raw-bytes path.
+
+Run from the backend directory:
+
+    python benchmarks/bench_codec.py [--nodes 100 1000 10000]
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+
+from common import make_flow
+from json_codec import CODECS
+
+
+def best_of(func, repeat: int = 5, number: int = 20) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def bench(nodes: int) -> None:
+    flow = make_flow(nodes)
+    payload = json.dumps(flow).encode("utf-8")
+    with tempfile.NamedTemporaryFile(suffix=".flow.json", delete=False) as f:
+        f.write(payload)
+        path = f.name
+
+    def read_parse_reencode():
+        with open(path, "r") as f:
+            content = json.loads(f.read().strip())
+        json.dumps({"filename": "flow", "content": content}, sort_keys=True)
+
+    def read_passthrough():
+        with open(path, "rb") as f:
+            content = f.read()
+        b"".join([b'{"filename":"flow","content":', content, b"}"])
+
+    def write_parse_reencode():
+        json.dumps(json.loads(payload))
+
+    results = {
+        "GET  parse+re-encode (json)": best_of(read_parse_reencode),
+        "GET  raw passthrough": best_of(read_passthrough),
+        "PUT  parse+re-encode (json)": best_of(write_parse_reencode),
+    }
+    for name, codec in CODECS.items():
+        results[f"PUT  validate only ({name})"] = best_of(
+            lambda: codec.validate(payload)
+        )
+    os.remove(path)
+
+    print(f"\n{nodes} nodes, {len(payload) / 1024:.1f} KiB")
+    baseline = results["GET  parse+re-encode (json)"]
+    for name, seconds in results.items():
+        print(
+            f"  {name:<32} {seconds * 1e3:9.3f} ms"
+            f"  ({baseline / seconds:5.1f}x vs GET baseline)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--nodes", type=int, nargs="+", default=[100, 1000, 10000]
+    )
+    args = parser.parse_args()
+    print(f"Available codecs: {', '.join(CODECS)}")
+    for nodes in args.nodes:
+        bench(nodes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Microbenchmark each FileManager operation against a synthetic workspace.
+
+Run from the backend directory:
+
+    python benchmarks/bench_file_manager.py [--flows 200] [--nodes 200]
+"""
+
+import io
+import json
+import argparse
+import tempfile
+from typing import Dict
+
+from common import (
+    generate_workspace,
+    make_flow,
+    flow_name,
+    user_id,
+    peak_rss_mb,
+    summarize_latencies,
+    timed_calls,
+    save_results,
+)
+from file_manager import FileManager
+from flow_cache import FlowCache
+from storage import create_storage
+from werkzeug.datastructures import FileStorage
+
+
+def run(
+    flows: int,
+    nodes: int,
+    number: int,
+    storage_backend: str = "filesystem",
+    cache_mb: float = 0,
+) -> Dict:
+    workspace_root = tempfile.mkdtemp(prefix="bench-fm-")
+    file_manager = FileManager(
+        workspace_root,
+        storage=create_storage(storage_backend, workspace_root),
+        cache=FlowCache(int(cache_mb * 1024 * 1024)) if cache_mb else None,
+    )
+    _, flow_size = generate_workspace(file_manager, 1, flows, nodes)
+    user = user_id(0)
+    target = flow_name(flows // 2)
+    payload = json.dumps(make_flow(nodes)).encode("utf-8")
+    document = make_flow(nodes)
+    counter = iter(range(10**9))
+
+    def patch():
+        version = file_manager.get_version(user, target)
+        file_manager.patch_file(
+            user,
+            target,
+            {"nodes": {"upsert": [{"id": "node-0", "data": {"name": "x"}}]}},
+            version,
+        )
+
+    def create_and_delete():
+        name = f"scratch-{next(counter)}"
+        file_manager.create_file(
+            user, FileStorage(io.BytesIO(payload), filename=name)
+        )
+        file_manager.delete_file(user, name)
+
+    operations = {
+        "list_files": lambda: file_manager.list_files(user),
+        "list_files_page": lambda: file_manager.list_files_page(
+            user, sort="last_edit", descending=True, limit=50
+        ),
+        "stat_file": lambda: file_manager.stat_file(user, target),
+        "read_file_bytes": lambda: file_manager.read_file_bytes(user, target),
+        "read_file": lambda: file_manager.read_file(user, target),
+        "update_file_bytes": lambda: file_manager.update_file_bytes(
+            user, target, payload
+        ),
+        "update_file": lambda: file_manager.update_file(
+            user, target, document
+        ),
+        "patch_file": patch,
+        "create_and_delete_file": create_and_delete,
+    }
+    results = {
+        name: summarize_latencies(timed_calls(func, number))
+        for name, func in operations.items()
+    }
+    file_manager.close()
+    return {
+        "config": {
+            "flows": flows,
+            "nodes": nodes,
+            "flow_bytes": flow_size,
+            "storage": storage_backend,
+            "cache_mb": cache_mb,
+        },
+        "operations": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_report(results: Dict) -> None:
+    config = results["config"]
+    print(
+        f"FileManager ({config['storage']}): {config['flows']} flows of "
+        f"{config['nodes']} nodes ({config['flow_bytes'] / 1024:.1f} KiB)"
+    )
+    print(f"  {'operation':<24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in results["operations"].items():
+        print(
+            f"  {name:<24} {stats['p50_ms']:9.3f} {stats['p95_ms']:9.3f}"
+            f" {stats['p99_ms']:9.3f}"
+        )
+    print(f"  peak RSS {results['peak_rss_mb']:.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flows", type=int, default=200)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument(
+        "--storage", choices=["filesystem", "sqlite"], default="filesystem"
+    )
+    parser.add_argument(
+        "--cache-mb", type=float, default=0, help="Flow cache size, 0 for none"
+    )
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+    results = run(
+        args.flows, args.nodes, args.number, args.storage, args.cache_mb
+    )
+    print_report(results)
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare bytes on disk and read/write latency of the flow storage
+encodings (FLOW_STORAGE_ENCODING).
+
+Run from the backend directory:
+
+    python benchmarks/bench_storage_encoding.py [--nodes 100 1000 10000]
+"""
+
+import io
+import json
+import argparse
+import tempfile
+from typing import Dict
+
+from common import make_flow, summarize_latencies, timed_calls, save_results
+from file_manager import FileManager
+from flow_encoding import ENCODINGS
+from werkzeug.datastructures import FileStorage
+
+
+def bench(nodes: int, number: int) -> Dict[str, Dict]:
+    payload = json.dumps(make_flow(nodes)).encode("utf-8")
+    results = {}
+    for encoding in ENCODINGS:
+        workspace_root = tempfile.mkdtemp(prefix=f"bench-{encoding}-")
+        file_manager = FileManager(workspace_root, storage_encoding=encoding)
+        file_manager.create_file(
+            "bench", FileStorage(io.BytesIO(payload), filename="flow")
+        )
+        read = summarize_latencies(
+            timed_calls(
+                lambda: file_manager.read_file_bytes("bench", "flow"), number
+            )
+        )
+        write = summarize_latencies(
+            timed_calls(
+                lambda: file_manager.update_file_bytes(
+                    "bench", "flow", payload
+                ),
+                number,
+            )
+        )
+        results[encoding] = {
+            "bytes_on_disk": file_manager.stat_file("bench", "flow").size,
+            "read_p50_ms": read["p50_ms"],
+            "write_p50_ms": write["p50_ms"],
+        }
+        file_manager.close()
+    return {"plain_bytes": len(payload), "encodings": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--nodes", type=int, nargs="+", default=[100, 1000, 10000]
+    )
+    parser.add_argument("--number", type=int, default=100)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+    all_results = {}
+    for nodes in args.nodes:
+        results = bench(nodes, args.number)
+        all_results[str(nodes)] = results
+        plain = results["plain_bytes"]
+        print(f"\n{nodes} nodes, {plain / 1024:.1f} KiB as plain JSON")
+        print(
+            f"  {'encoding':<8} {'on disk':>10} {'ratio':>7}"
+            f" {'read p50 ms':>12} {'write p50 ms':>13}"
+        )
+        for encoding, stats in results["encodings"].items():
+            print(
+                f"  {encoding:<8} {stats['bytes_on_disk']:10d}"
+                f" {plain / stats['bytes_on_disk']:6.1f}x"
+                f" {stats['read_p50_ms']:12.3f} {stats['write_p50_ms']:13.3f}"
+            )
+    if args.output:
+        save_results(all_results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Shared helpers for the benchmark scripts: synthetic flows and workspaces,
+a Flask app with a stubbed UserManager, latency statistics and baselines."""
+
+import io
+import os
+import sys
+import json
+import time
+import resource
+from typing import Dict, List, Optional, Tuple
+
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RESULTS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "results"
+)
+sys.path.insert(0, BACKEND_DIR)
+
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+
+BENCH_USER_HEADER = "X-Bench-User"
+
+
+def make_flow(nodes: int, edges: Optional[int] = None) -> dict:
+    edges = nodes - 1 if edges is None else edges
+    return {
+        "nodes": [
+            {
+                "id": f"node-{i}",
+                "type": "custom",
+                "position": {"x": i * 1.5, "y": i * 2.25},
+                "data": {"name": f"Agent {i}", "fields": [{"name": "model"}]},
+            }
+            for i in range(nodes)
+        ],
+        "edges": [
+            {
+                "id": f"edge-{i}",
+                "source": f"node-{i % max(nodes, 1)}",
+                "target": f"node-{(i + 1) % max(nodes, 1)}",
+            }
+            for i in range(max(edges, 0))
+        ],
+    }
+
+
+def user_id(index: int) -> str:
+    return f"bench_{index}"
+
+
+def flow_name(index: int) -> str:
+    return f"flow-{index:05d}"
+
+
+def generate_workspace(
+    file_manager, users: int, flows: int, nodes: int
+) -> Tuple[int, int]:
+    # Creates ``users`` x ``flows`` flows of ``nodes`` nodes through the
+    # FileManager, so metadata and versions are set up as in production.
+    payload = json.dumps(make_flow(nodes)).encode("utf-8")
+    for u in range(users):
+        for f in range(flows):
+            file_manager.create_file(
+                user_id(u),
+                FileStorage(io.BytesIO(payload), filename=flow_name(f)),
+            )
+    return users * flows, len(payload)
+
+
+def create_app(workspace_root: str, storage_backend: str = "filesystem"):
+    # Imports run.py against ``workspace_root`` with quiet logging and a
+    # UserManager whose session user comes from the X-Bench-User header.
+    os.environ["WORKSPACE_ROOT"] = workspace_root
+    os.environ["STORAGE_BACKEND"] = storage_backend
+    os.environ.setdefault("WORKSTATION_SECRET_KEY", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # The load generators are a handful of users hammering the API; admission
+    # control would measure its own rejections instead of the handlers.
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    os.environ["FILE_OPS_MAX_CONCURRENT"] = "0"
+    for name in ("GITHUB_CLIENT_ID", "GOOGLE_CLIENT_ID"):
+        os.environ.pop(name, None)
+    import run
+    from flask import request
+
+    class BenchUserManager:
+        def initialize_session(self) -> str:
+            return self.get_user_id()
+
+        def get_user_id(self) -> str:
+            return request.headers.get(BENCH_USER_HEADER, user_id(0))
+
+        def get_user_info(self) -> dict:
+            return {"user_id": self.get_user_id(), "user_type": "bench"}
+
+    run.user_manager = BenchUserManager()
+    return run.app, run.file_manager
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1,
+        max(0, int(round(fraction * len(sorted_values))) - 1),
+    )
+    return sorted_values[index]
+
+
+def summarize_latencies(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": (sum(ordered) / len(ordered) * 1e3) if ordered else 0.0,
+        "p50_ms": percentile(ordered, 0.50) * 1e3,
+        "p95_ms": percentile(ordered, 0.95) * 1e3,
+        "p99_ms": percentile(ordered, 0.99) * 1e3,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def timed_calls(func, number: int) -> List[float]:
+    samples = []
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def save_results(results: Dict, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def find_regressions(
+    current: Dict,
+    baseline: Dict,
+    threshold: float,
+    min_delta_ms: float = 0.1,
+) -> List[Tuple[str, float, float]]:
+    # Median and p95 latencies regress when they grow and throughput when
+    # it drops, by more than ``threshold`` (0.25 = 25%). Latency changes
+    # under ``min_delta_ms`` are timer noise on sub-millisecond operations.
+    # p99 is too noisy on a shared machine to gate on and, like the rest,
+    # is context.
+    regressions = []
+    now, before = flatten(current), flatten(baseline)
+    for name, old in before.items():
+        new = now.get(name)
+        if new is None or old <= 0:
+            continue
+        if name.endswith(("p50_ms", "p95_ms")):
+            if new > old * (1 + threshold) and new - old >= min_delta_ms:
+                regressions.append((name, old, new))
+        elif name.endswith("throughput_rps"):
+            if new < old * (1 - threshold):
+                regressions.append((name, old, new))
+    return regressions
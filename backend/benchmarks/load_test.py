@@ -0,0 +1,233 @@
+"""Closed-loop load test of the /api/files routes through the Flask app.
+
+Each client thread has its own stubbed session user and issues its next
+request as soon as the previous one completes. Run from the backend
+directory:
+
+    python benchmarks/load_test.py [--clients 8] [--duration 10]
+"""
+
+import json
+import random
+import argparse
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from common import (
+    BENCH_USER_HEADER,
+    create_app,
+    generate_workspace,
+    make_flow,
+    flow_name,
+    user_id,
+    peak_rss_mb,
+    summarize_latencies,
+    save_results,
+)
+
+
+# Relative weights of the request mix.
+MIX = {
+    "list": 15,
+    "list_page": 10,
+    "read": 45,
+    "put": 15,
+    "patch": 15,
+}
+
+
+class Client(threading.Thread):
+    def __init__(
+        self,
+        app,
+        index: int,
+        flows: int,
+        payload: bytes,
+        deadline: float,
+        seed: int,
+    ) -> None:
+        super().__init__(name=f"client-{index}", daemon=True)
+        self.client = app.test_client()
+        self.headers = {BENCH_USER_HEADER: user_id(index)}
+        self.flows = flows
+        self.payload = payload
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        # Generated flows all start at version 1.
+        self.versions: Dict[str, int] = {flow_name(i): 1 for i in range(flows)}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+
+    def request(self, operation: str):
+        name = flow_name(self.random.randrange(self.flows))
+        url = f"/api/files/{name}"
+        if operation == "list":
+            return self.client.get("/api/files", headers=self.headers)
+        if operation == "list_page":
+            return self.client.get(
+                "/api/files?limit=50&sort=last_edit&order=desc",
+                headers=self.headers,
+            )
+        if operation == "read":
+            response = self.client.get(url, headers=self.headers)
+            if response.status_code == 200:
+                self.versions[name] = response.get_json()["version"]
+            return response
+        if operation == "put":
+            response = self.client.put(
+                url,
+                data=self.payload,
+                content_type="application/json",
+                headers=self.headers,
+            )
+            if response.status_code == 200:
+                self.versions[name] = response.get_json()["version"]
+            return response
+        version = self.versions.get(name)
+        if version is None:
+            response = self.client.get(url, headers=self.headers)
+            if response.status_code != 200:
+                return response
+            version = response.get_json()["version"]
+        response = self.client.patch(
+            url,
+            json={
+                "version": version,
+                "diff": {"set": {"touched": self.random.random()}},
+            },
+            headers=self.headers,
+        )
+        if response.status_code == 200:
+            self.versions[name] = response.get_json()["version"]
+        else:
+            self.versions.pop(name, None)
+        return response
+
+    def run(self) -> None:
+        operations = list(MIX)
+        weights = [MIX[operation] for operation in operations]
+        while time.perf_counter() < self.deadline:
+            operation = self.random.choices(operations, weights)[0]
+            start = time.perf_counter()
+            response = self.request(operation)
+            self.latencies[operation].append(time.perf_counter() - start)
+            self.statuses[operation][response.status_code] += 1
+
+
+def run(
+    clients: int,
+    duration: float,
+    flows: int,
+    nodes: int,
+    storage_backend: str = "filesystem",
+    seed: int = 0,
+) -> Dict:
+    workspace_root = tempfile.mkdtemp(prefix="bench-load-")
+    app, file_manager = create_app(workspace_root, storage_backend)
+    _, flow_size = generate_workspace(file_manager, clients, flows, nodes)
+    payload = json.dumps(make_flow(nodes)).encode("utf-8")
+
+    deadline = time.perf_counter() + duration
+    threads = [
+        Client(app, index, flows, payload, deadline, seed + index)
+        for index in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for thread in threads:
+        for operation, samples in thread.latencies.items():
+            latencies[operation].extend(samples)
+        for operation, counts in thread.statuses.items():
+            for status, count in counts.items():
+                statuses[operation][str(status)] += count
+    everything = [
+        sample for samples in latencies.values() for sample in samples
+    ]
+    operations = {}
+    for operation, samples in latencies.items():
+        operations[operation] = summarize_latencies(samples)
+        operations[operation]["statuses"] = dict(statuses[operation])
+    file_manager.close()
+    return {
+        "config": {
+            "clients": clients,
+            "duration_s": duration,
+            "flows_per_user": flows,
+            "nodes": nodes,
+            "flow_bytes": flow_size,
+            "storage": storage_backend,
+        },
+        "total": dict(
+            summarize_latencies(everything),
+            throughput_rps=len(everything) / elapsed,
+        ),
+        "operations": operations,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_report(results: Dict) -> None:
+    config = results["config"]
+    total = results["total"]
+    print(
+        f"Load test ({config['storage']}): {config['clients']} clients for "
+        f"{config['duration_s']}s, {config['flows_per_user']} flows of "
+        f"{config['nodes']} nodes per user"
+    )
+    print(
+        f"  {total['count']} requests, {total['throughput_rps']:.1f} req/s, "
+        f"p50 {total['p50_ms']:.2f} ms, p95 {total['p95_ms']:.2f} ms, "
+        f"p99 {total['p99_ms']:.2f} ms"
+    )
+    print(
+        f"  {'operation':<12} {'count':>7} {'p50 ms':>9} {'p95 ms':>9}"
+        f" {'p99 ms':>9}  statuses"
+    )
+    for name, stats in sorted(results["operations"].items()):
+        print(
+            f"  {name:<12} {stats['count']:7d} {stats['p50_ms']:9.3f}"
+            f" {stats['p95_ms']:9.3f} {stats['p99_ms']:9.3f}"
+            f"  {stats['statuses']}"
+        )
+    print(f"  peak RSS {results['peak_rss_mb']:.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--flows", type=int, default=50)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument(
+        "--storage", choices=["filesystem", "sqlite"], default="filesystem"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+    results = run(
+        args.clients,
+        args.duration,
+        args.flows,
+        args.nodes,
+        args.storage,
+        args.seed,
+    )
+    print_report(results)
+    if args.output:
+        save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Run the FileManager microbenchmarks and the load test, compare the results
+with a saved baseline and exit non-zero on a regression.
+
+Run from the backend directory:
+
+    python benchmarks/suite.py --save-baseline     # record a baseline
+    python benchmarks/suite.py                     # compare against it
+"""
+
+import os
+import sys
+import argparse
+import time
+
+import bench_file_manager
+import load_test
+from common import (
+    RESULTS_DIR,
+    find_regressions,
+    load_results,
+    save_results,
+)
+
+
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flows", type=int, default=200)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--storage", choices=["filesystem", "sqlite"], default="filesystem"
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed slowdown before failing (0.25 = 25%%)",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=0.1,
+        help="Ignore latency changes smaller than this",
+    )
+    args = parser.parse_args()
+
+    micro = bench_file_manager.run(
+        args.flows, args.nodes, args.number, args.storage
+    )
+    bench_file_manager.print_report(micro)
+    print()
+    load = load_test.run(
+        args.clients,
+        args.duration,
+        min(args.flows, 50),
+        args.nodes,
+        args.storage,
+    )
+    load_test.print_report(load)
+    results = {"file_manager": micro, "load": load}
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    save_results(results, os.path.join(RESULTS_DIR, f"run-{stamp}.json"))
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline")
+        return 0
+    regressions = find_regressions(
+        results,
+        load_results(args.baseline),
+        args.threshold,
+        args.min_delta_ms,
+    )
+    if not regressions:
+        print(f"\nNo regressions beyond {args.threshold:.0%} of the baseline")
+        return 0
+    print(f"\nRegressions beyond {args.threshold:.0%} of the baseline:")
+    for name, old, new in regressions:
+        print(f"  {name:<56} {old:10.3f} -> {new:10.3f}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+import time
+import uuid
+import threading
+from collections import deque
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from listing import display_name
+from metrics import REGISTRY
+
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_MAX_USER_CONNECTIONS = 4
+DEFAULT_BUFFER_SIZE = 256
+DEFAULT_BACKLOG = 256
+DEFAULT_HEARTBEAT = 15.0
+# Streams end after this long and the client reconnects with the id of the
+# last event it saw, so no connection holds a request thread for good.
+DEFAULT_STREAM_DURATION = 300.0
+RECONNECT_DELAY_MS = 3000
+
+EVENTS_PUBLISHED = REGISTRY.counter(
+    "workstation_events_published_total",
+    "Flow change events published, by type.",
+    ("type",),
+)
+EVENT_CONNECTIONS = REGISTRY.gauge(
+    "workstation_event_connections",
+    "Open change feed connections (streams and long polls).",
+)
+EVENT_RESETS = REGISTRY.counter(
+    "workstation_event_resets_total",
+    "Subscribers told to reload the listing, by cause.",
+    ("cause",),
+)
+EVENT_REJECTIONS = REGISTRY.counter(
+    "workstation_event_rejections_total",
+    "Change feed connections refused by the connection caps.",
+)
+
+
+class TooManyConnectionsError(Exception):
+    def __init__(self, message: str, per_user: bool = False):
+        super().__init__(message)
+        self.per_user = per_user
+
+
+# One open stream or long poll. Events are buffered up to ``buffer_size``;
+# a subscriber that falls further behind loses the buffer and is told to
+# reload the listing instead, so a stalled client costs bounded memory.
+class Subscription:
+    def __init__(
+        self, feed: "ChangeFeed", user_id: str, buffer_size: int
+    ) -> None:
+        self.feed = feed
+        self.user_id = user_id
+        self.buffer_size = buffer_size
+        self.reset = False
+        self.closed = False
+        # The id of the last event published when the subscription opened.
+        self.start_id = ""
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._wakeup = threading.Event()
+
+    def _push(self, event: Dict[str, Any]) -> None:
+        # Called with the feed lock held.
+        if self.reset:
+            return
+        if len(self._events) >= self.buffer_size:
+            self._events.clear()
+            self.reset = True
+            EVENT_RESETS.inc("overflow")
+        else:
+            self._events.append(event)
+        self._wakeup.set()
+
+    def next(self, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        # Waits up to ``timeout`` seconds for events; returns them and
+        # whether the subscriber has to reload the listing.
+        self._wakeup.wait(timeout)
+        with self.feed._lock:
+            events = list(self._events)
+            self._events.clear()
+            reset, self.reset = self.reset, False
+            self._wakeup.clear()
+        return events, reset
+
+    def close(self) -> None:
+        self.feed._unsubscribe(self)
+
+
+# Per-user feed of flow changes, published by FileManager as they happen
+# and fanned out in process to open subscriptions: no broker, so a client
+# only sees changes made through the worker process it is connected to.
+# The last ``backlog`` events of each user are kept, so a client that
+# reconnects with the id of the last event it saw gets what it missed.
+# Event ids start with a per-process epoch; an id from another process or
+# from before a restart, or one older than the backlog, asks for a reset.
+class ChangeFeed:
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_user_connections: int = DEFAULT_MAX_USER_CONNECTIONS,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        backlog: int = DEFAULT_BACKLOG,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_user_connections = max_user_connections
+        self.buffer_size = buffer_size
+        self.backlog = backlog
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._backlogs: Dict[str, Deque[Tuple[int, Dict[str, Any]]]] = {}
+        # The highest sequence number each user has lost from the backlog.
+        self._trimmed: Dict[str, int] = {}
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._connections = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def last_id(self) -> str:
+        with self._lock:
+            return f"{self.epoch}-{self._seq}"
+
+    def _parse_id(self, event_id: str) -> Optional[int]:
+        epoch, _, seq = event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(
+        self,
+        user_id: str,
+        change: str,
+        filename: str,
+        version: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            self._seq += 1
+            event = {
+                "id": f"{self.epoch}-{self._seq}",
+                "type": change,
+                "name": display_name(filename),
+                "version": version,
+                "last_edit": datetime.now().isoformat(),
+            }
+            backlog = self._backlogs.get(user_id)
+            if backlog is None:
+                backlog = self._backlogs[user_id] = deque()
+            if len(backlog) >= self.backlog:
+                self._trimmed[user_id] = backlog.popleft()[0]
+            backlog.append((self._seq, event))
+            for subscription in self._subscribers.get(user_id, ()):
+                subscription._push(event)
+        EVENTS_PUBLISHED.inc(change)
+
+    def forget(self, user_id: str) -> None:
+        # Drops the backlog of a user whose workspace is gone.
+        with self._lock:
+            self._backlogs.pop(user_id, None)
+            self._trimmed.pop(user_id, None)
+
+    def subscribe(
+        self, user_id: str, after: Optional[str] = None
+    ) -> Subscription:
+        # Opens a subscription; with ``after``, the events that followed it
+        # are queued first, or a reset if they can no longer be replayed.
+        with self._lock:
+            if self._closed or self._connections >= self.max_connections:
+                EVENT_REJECTIONS.inc()
+                raise TooManyConnectionsError(
+                    "Too many open change feed connections"
+                )
+            subscribers = self._subscribers.setdefault(user_id, set())
+            if len(subscribers) >= self.max_user_connections:
+                EVENT_REJECTIONS.inc()
+                raise TooManyConnectionsError(
+                    f"At most {self.max_user_connections} change feed "
+                    f"connections per user",
+                    per_user=True,
+                )
+            subscription = Subscription(self, user_id, self.buffer_size)
+            subscription.start_id = f"{self.epoch}-{self._seq}"
+            if after is not None:
+                seq = self._parse_id(after)
+                if seq is None or seq < self._trimmed.get(user_id, 0):
+                    subscription.reset = True
+                    subscription._wakeup.set()
+                    EVENT_RESETS.inc("stale")
+                else:
+                    for event_seq, event in self._backlogs.get(user_id, ()):
+                        if event_seq > seq:
+                            subscription._push(event)
+            subscribers.add(subscription)
+            self._connections += 1
+            EVENT_CONNECTIONS.set(value=self._connections)
+        return subscription
+
+    def poll(
+        self, user_id: str, after: Optional[str], timeout: float
+    ) -> Tuple[List[Dict[str, Any]], bool, str]:
+        # Long-poll counterpart of a stream: waits up to ``timeout`` for
+        # events after ``after`` and returns them, whether to reload the
+        # listing, and the id to poll after next. Without ``after`` it only
+        # returns the current id.
+        subscription = self.subscribe(user_id, after)
+        try:
+            if after is None:
+                return [], False, subscription.start_id
+            events, reset = subscription.next(timeout)
+        finally:
+            subscription.close()
+        if reset:
+            return [], True, self.last_id()
+        if events:
+            return events, False, events[-1]["id"]
+        return [], False, subscription.start_id
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+            self._connections -= 1
+            EVENT_CONNECTIONS.set(value=self._connections)
+
+    def close(self) -> None:
+        # Wakes every subscriber so that open streams can end.
+        with self._lock:
+            self._closed = True
+            for subscribers in self._subscribers.values():
+                for subscription in subscribers:
+                    subscription.closed = True
+                    subscription._wakeup.set()
+
+
+def _format(event: str, data: bytes, event_id: Optional[str] = None) -> bytes:
+    lines = [f"id: {event_id}\n".encode()] if event_id else []
+    lines += [f"event: {event}\n".encode(), b"data: ", data, b"\n\n"]
+    return b"".join(lines)
+
+
+def stream_events(
+    subscription: Subscription,
+    dumps: Callable[[Any], bytes],
+    resumed: bool = False,
+    heartbeat: float = DEFAULT_HEARTBEAT,
+    duration: float = DEFAULT_STREAM_DURATION,
+) -> Iterator[bytes]:
+    # Server-sent events for one subscription: a "ready" event, then a
+    # "change" per event and a "reset" when the client has to reload the
+    # listing. Comments go out every ``heartbeat`` seconds so that proxies
+    # keep the connection and a gone client is noticed.
+    try:
+        yield f"retry: {RECONNECT_DELAY_MS}\n\n".encode()
+        # A fresh stream starts at the current id; a resumed one keeps the
+        # client's, so the replayed events are not skipped on reconnect.
+        yield _format(
+            "ready",
+            dumps({"id": subscription.start_id, "resumed": resumed}),
+            None if resumed else subscription.start_id,
+        )
+        deadline = time.monotonic() + duration
+        while not subscription.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            events, reset = subscription.next(min(heartbeat, remaining))
+            if reset:
+                # The reloaded listing covers everything up to now.
+                yield _format("reset", b"{}", subscription.feed.last_id())
+            for event in events:
+                yield _format("change", dumps(event), event["id"])
+            if not events and not reset:
+                yield b": keepalive\n\n"
+    finally:
+        subscription.close()
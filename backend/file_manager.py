@@ -1,21 +1,139 @@
+import io
 import os
-import json
+import tempfile
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
-from typing import List, Dict
+from typing import (
+    List,
+    Dict,
+    BinaryIO,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from metadata_index import DEFAULT_FLUSH_INTERVAL
+from json_stream import IncrementalJSONValidator
+from flow_patch import apply_json_patch, apply_flow_diff
+from json_codec import JSONCodec, get_codec
+from listing import (
+    SORT_KEYS,
+    MAX_PAGE_SIZE,
+    display_name,
+    encode_cursor,
+    decode_cursor,
+)
+from storage import (
+    StorageBackend,
+    FilesystemStorage,
+    FlowEntry,
+    FileExistsError,
+    VersionConflictError,
+    FLOW_FILE_EXTENSION,
+    create_storage,
+)
+from metrics import timed, timer, record_bytes
+from archive import stream_zip, iter_members
+from flow_encoding import decode, detect, encode, encode_file, get_encoding
+from flow_cache import FlowCache
+from flow_history import FlowHistory
+from search_index import SearchIndex, DEFAULT_LIMIT, MAX_LIMIT
+from guest_workspaces import is_guest_id
+from change_feed import ChangeFeed
+from write_coalescing import CoalescingStorage
+from spatial_index import (
+    FlowGrid,
+    GridCache,
+    MAX_SUBGRAPH_NODES,
+    MAX_VIEWPORT_NODES,
+)
 
 
-FLOW_FILE_EXTENSION = ".flow.json"
+EMPTY_FLOW = b'{"nodes": [], "edges": []}'
+UPLOAD_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_UPLOAD_SIZE = 32 * 1024 * 1024
+# What an import may stage in all, however small the archive it came in.
+DEFAULT_MAX_IMPORT_BYTES = 1024 * 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+MAX_BATCH_SIZE = 200
 
 
-class FileExistsError(Exception):
+class FileTooLargeError(Exception):
     pass
 
 
+class QuotaExceededError(Exception):
+    pass
+
+
+# Per-workspace limits on stored bytes (as stored, i.e. compressed) and on
+# the number of flows; 0 means no limit.
+class Quota(NamedTuple):
+    max_bytes: int = 0
+    max_files: int = 0
+
+
 class FileManager:
-    def __init__(self, workspace_root: str):
+    def __init__(
+        self,
+        workspace_root: str,
+        metadata_flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_upload_size: int = DEFAULT_MAX_UPLOAD_SIZE,
+        codec: Optional[JSONCodec] = None,
+        storage: Optional[StorageBackend] = None,
+        storage_encoding: Optional[str] = None,
+        cache: Optional[FlowCache] = None,
+        history: Optional[FlowHistory] = None,
+        search_index: Optional[SearchIndex] = None,
+        quota: Quota = Quota(),
+        guest_quota: Quota = Quota(),
+        change_feed: Optional[ChangeFeed] = None,
+        grid_cache: Optional[GridCache] = None,
+        max_import_bytes: int = DEFAULT_MAX_IMPORT_BYTES,
+    ):
         self.workspace_root = workspace_root
+        self.max_upload_size = max_upload_size
+        self.max_import_bytes = max_import_bytes
+        self.codec = codec or get_codec()
+        # Flows are written in this encoding and read in whichever one they
+        # were stored with.
+        self.storage_encoding = get_encoding(storage_encoding)
+        self.storage = storage or FilesystemStorage(
+            workspace_root, metadata_flush_interval
+        )
+        # Acknowledged writes the coalescer could not flush are reported to
+        # open clients, which reload instead of trusting what they saved.
+        if (
+            isinstance(self.storage, CoalescingStorage)
+            and self.storage.on_lost is None
+        ):
+            self.storage.on_lost = self._write_lost
+        # Decoded bytes of hot flows; reads skip storage and decompression
+        # while the flow's stat is unchanged.
+        self.cache = cache
+        # Every version written through the file manager is recorded here.
+        self.history = history
+        if history is not None and history.exists is None:
+            history.exists = self._flow_exists
+        # Checked on every write that can grow a workspace; guests get their
+        # own, usually tighter, limits.
+        self.quota = quota
+        self.guest_quota = guest_quota
+        # Told about every create, update and delete, for open clients.
+        self.change_feed = change_feed
+        # Spatial indexes of recently viewed flows, for viewport reads.
+        self.grid_cache = grid_cache
+        # Kept current with every change, and able to catch up from storage.
+        self.search_index = search_index
+        if search_index is not None:
+            search_index.attach(
+                self.storage.list_entries,
+                self.storage.listing_stamp,
+                self._load,
+            )
 
     def get_user_workspace(self, user_id: str) -> str:
         user_workspace = os.path.join(self.workspace_root, user_id)
@@ -23,110 +141,728 @@ class FileManager:
             os.makedirs(user_workspace)
         return user_workspace
 
-    def get_metadata_path(self, user_id: str) -> str:
-        return os.path.join(self.get_user_workspace(user_id), "metadata.json")
+    def load_metadata(self, user_id: str) -> Dict[str, Dict]:
+        return {
+            entry.filename: {
+                "last_edit": entry.last_edit,
+                "version": entry.version,
+            }
+            for entry in self.storage.list_entries(user_id)
+        }
 
-    def load_metadata(self, user_id: str) -> Dict[str, str]:
-        metadata_path = self.get_metadata_path(user_id)
-        if not os.path.exists(metadata_path):
-            return {}
-        with open(metadata_path, "r") as f:
-            return json.load(f)
+    def update_last_edit_time(self, user_id: str, filename: str) -> None:
+        self.storage.touch(user_id, self._resolve_name(filename))
 
-    def save_metadata(self, user_id: str, metadata: dict) -> None:
-        metadata_path = self.get_metadata_path(user_id)
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f)
+    def close(self) -> None:
+        if self.change_feed is not None:
+            self.change_feed.close()
+        if self.history is not None:
+            self.history.close()
+        if self.search_index is not None:
+            self.search_index.close()
+        self.storage.close()
 
-    def update_last_edit_time(self, user_id: str, filename: str) -> None:
-        metadata = self.load_metadata(user_id)
-        metadata[filename] = datetime.now().isoformat()
-        self.save_metadata(user_id, metadata)
-
-    def list_files(self, user_id: str) -> List[Dict[str, str]]:
-        user_workspace = self.get_user_workspace(user_id)
-        files = os.listdir(user_workspace)
-        files = [
-            f
-            for f in files
-            if f.endswith(FLOW_FILE_EXTENSION) and f != "metadata.json"
-        ]
+    def _flow_exists(self, user_id: str, filename: str) -> bool:
+        try:
+            self.storage.stat(user_id, filename)
+        except FileNotFoundError:
+            return False
+        return True
 
-        metadata = self.load_metadata(user_id)
+    def _quota(self, user_id: str) -> Quota:
+        return self.guest_quota if is_guest_id(user_id) else self.quota
+
+    def _import_budget(
+        self, user_id: str, overwrite: bool
+    ) -> Tuple[Optional[int], Optional[int], Set[str]]:
+        # Upper bounds on the bytes and new flows an import can stage without
+        # failing the quota check that follows (None where unlimited), and
+        # the flows that exist. Bytes are bounded as if, with ``overwrite``,
+        # every existing flow were replaced.
+        existing = self.storage.list_entries(user_id)
+        names = {entry.filename for entry in existing}
+        quota = self._quota(user_id)
+        used = 0 if overwrite else sum(entry.size for entry in existing)
+        return (
+            quota.max_bytes - used if quota.max_bytes else None,
+            quota.max_files - len(existing) if quota.max_files else None,
+            names,
+        )
+
+    def _check_quota(
+        self,
+        user_id: str,
+        added_bytes: int,
+        added_files: int = 0,
+        replaced: Optional[List[str]] = None,
+    ) -> None:
+        # Raises if storing ``added_bytes`` more (in place of ``replaced``)
+        # would take the workspace past its quota. Writes that do not grow
+        # the workspace always pass, so a full workspace can still shrink.
+        quota = self._quota(user_id)
+        if not quota.max_bytes and not quota.max_files:
+            return
+        entries = self.storage.list_entries(user_id)
+        used = sum(entry.size for entry in entries)
+        replaced_names = set(replaced or ())
+        growth = added_bytes - sum(
+            entry.size for entry in entries if entry.filename in replaced_names
+        )
+        if quota.max_files and added_files > 0:
+            if len(entries) + added_files > quota.max_files:
+                raise QuotaExceededError(
+                    f"Workspace quota of {quota.max_files} files reached"
+                )
+        if quota.max_bytes and growth > 0:
+            if used + growth > quota.max_bytes:
+                raise QuotaExceededError(
+                    f"Workspace quota of {quota.max_bytes} bytes exceeded"
+                )
+
+    def _describe(self, entry: FlowEntry) -> Dict:
+        return {
+            "name": display_name(entry.filename),
+            "last_edit": entry.last_edit or "Never",
+            "version": entry.version,
+        }
+
+    @timed("list")
+    def list_files(self, user_id: str) -> List[Dict]:
         return [
-            {"name": f.split(".")[0], "last_edit": metadata.get(f, "Never")}
-            for f in files
+            self._describe(entry)
+            for entry in self.storage.list_entries(user_id)
         ]
 
+    @timed("list_page")
+    def list_files_page(
+        self,
+        user_id: str,
+        sort: str = "name",
+        descending: bool = False,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Cannot sort by {sort}")
+        if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        after = decode_cursor(cursor, sort) if cursor else None
+        entries, last_key = self.storage.list_page(
+            user_id, sort, descending, after, limit, prefix, query
+        )
+        next_cursor = encode_cursor(sort, last_key) if last_key else None
+        return [self._describe(entry) for entry in entries], next_cursor
+
+    def listing_stamp(self, user_id: str) -> Tuple:
+        # Identifies the current listing without building it.
+        return self.storage.listing_stamp(user_id)
+
+    @timed("create")
     def create_file(self, user_id: str, file: FileStorage) -> str:
-        user_workspace = self.get_user_workspace(user_id)
         if file.filename == "" or file.filename is None:
             raise ValueError("No selected file")
         else:
             filename = secure_filename(file.filename)
             if not filename.endswith(FLOW_FILE_EXTENSION):
                 filename += FLOW_FILE_EXTENSION
-        file_path = os.path.join(user_workspace, filename)
-        if os.path.exists(file_path):
+        try:
+            self.storage.stat(user_id, filename)
             raise FileExistsError(f"File {filename} already exists")
+        except FileNotFoundError:
+            pass
+
+        # Stream the upload into a staging file, validating the JSON as it
+        # arrives, then hand it to the storage backend.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.storage.staging_dir(user_id),
+            prefix=".upload-",
+            suffix=".tmp",
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self._write_upload(file.stream, f)
+                record_bytes("create", f.tell())
+            encode_file(tmp_path, self.storage_encoding)
+            self._check_quota(user_id, os.path.getsize(tmp_path), 1)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        version = self.storage.create(user_id, filename, tmp_path)
+        self._record_stored(user_id, filename)
+        self._publish(user_id, "created", filename, version)
+        return filename
 
+    def _write_upload(self, stream: BinaryIO, out: BinaryIO) -> None:
+        validator = IncrementalJSONValidator()
+        size = 0
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > self.max_upload_size:
+                raise FileTooLargeError(
+                    f"File exceeds the maximum size of "
+                    f"{self.max_upload_size} bytes"
+                )
+            validator.feed(chunk)
+            out.write(chunk)
+        validator.close()
         # Create an empty valid JSON object if the file is empty
-        content = file.read().decode('utf-8').strip()
-        if not content:
-            content = json.dumps({"nodes": [], "edges": []})
-        else:
-            # Validate JSON content
-            try:
-                json.loads(content)
-            except json.JSONDecodeError:
-                raise ValueError("Invalid JSON content")
+        if validator.is_empty:
+            out.seek(0)
+            out.truncate()
+            out.write(EMPTY_FLOW)
 
-        with open(file_path, 'w') as f:
-            f.write(content)
+    def _from_storage(self, content: bytes) -> bytes:
+        if detect(content) == "json":
+            return content
+        with timer("decompress"):
+            return decode(content)
 
-        self.update_last_edit_time(user_id, filename)
-        return filename
+    def _to_storage(self, data: bytes) -> bytes:
+        if self.storage_encoding == "json":
+            return data
+        with timer("compress"):
+            return encode(data, self.storage_encoding)
 
-    def read_file(self, user_id: str, filename: str) -> Dict:
-        user_workspace = self.get_user_workspace(user_id)
+    def _resolve_name(self, filename: str) -> str:
         if not filename.endswith(FLOW_FILE_EXTENSION):
             filename += FLOW_FILE_EXTENSION
-        file_path = os.path.join(user_workspace, secure_filename(filename))
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File {filename} not found")
-        with open(file_path, "r") as f:
-            content = f.read().strip()
-            self.update_last_edit_time(user_id, filename)
-            if not content:
-                return {"nodes": [], "edges": []}
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                raise ValueError(f"Invalid JSON content in file {filename}")
+        return secure_filename(filename)
 
-    def update_file(self, user_id: str, filename: str, content: Dict) -> None:
-        user_workspace = self.get_user_workspace(user_id)
-        if not filename.endswith(FLOW_FILE_EXTENSION):
-            filename += FLOW_FILE_EXTENSION
-        file_path = os.path.join(user_workspace, secure_filename(filename))
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File {filename} not found")
+    def _decode(self, content: bytes, filename: str) -> Dict:
+        try:
+            with timer("json_decode"):
+                return self.codec.loads(content)
+        except ValueError:
+            raise ValueError(f"Invalid JSON content in file {filename}")
+
+    @timed("stat")
+    def stat_file(self, user_id: str, filename: str) -> FlowEntry:
+        return self.storage.stat(user_id, self._resolve_name(filename))
+
+    def get_version(self, user_id: str, filename: str) -> int:
+        return self.stat_file(user_id, filename).version
+
+    def read_file(self, user_id: str, filename: str) -> Dict:
+        return self.read_file_with_version(user_id, filename)[0]
+
+    def _load(self, user_id: str, filename: str) -> Tuple[bytes, int]:
+        # Decoded content and version of a resolved flow name.
+        entry = None
+        if self.cache is not None:
+            entry = self.storage.stat(user_id, filename)
+            content = self.cache.get(user_id, filename, entry)
+            if content is not None:
+                return content, entry.version
+        content, version = self.storage.read(user_id, filename)
+        content = self._from_storage(content)
+        # An empty file is treated as an empty flow.
+        if not content or content.isspace():
+            content = EMPTY_FLOW
+        # A write between the stat and the read shows as a newer version;
+        # that content is not cached under the older stat.
+        if entry is not None and entry.version == version:
+            self.cache.put(user_id, filename, entry, content)
+        return content, version
+
+    def _cache_written(
+        self, user_id: str, filename: str, data: bytes, version: int
+    ) -> None:
+        # Only cached if no other write landed since ours: versions only
+        # go up, so a matching one means the stored flow is ``data``.
+        if self.cache is None:
+            return
+        self.cache.invalidate(user_id, filename)
         try:
-            json_content = json.dumps(content)
+            entry = self.storage.stat(user_id, filename)
+        except FileNotFoundError:
+            return
+        if entry.version == version:
+            self.cache.put(user_id, filename, entry, data)
+
+    def _record(
+        self, user_id: str, filename: str, data: bytes, version: int
+    ) -> None:
+        # Hands a new version's plain content to history and search.
+        if self.history is not None:
+            self.history.record(user_id, filename, version, data)
+        if self.search_index is not None:
+            self.search_index.update(user_id, filename, version, data)
+
+    def _record_stored(self, user_id: str, filename: str) -> None:
+        # For flows that arrived as staged files rather than bytes.
+        if self.history is not None or self.search_index is not None:
+            content, version = self._load(user_id, filename)
+            self._record(user_id, filename, content, version)
+
+    def _publish(
+        self,
+        user_id: str,
+        change: str,
+        filename: str,
+        version: Optional[int] = None,
+    ) -> None:
+        if self.change_feed is not None:
+            self.change_feed.publish(user_id, change, filename, version)
+
+    def _write_lost(
+        self, user_id: str, filename: str, version: Optional[int]
+    ) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(user_id, filename)
+        if self.grid_cache is not None:
+            self.grid_cache.invalidate(user_id, filename)
+        self._publish(user_id, "conflict", filename, version)
+
+    @timed("read")
+    def read_file_bytes(
+        self, user_id: str, filename: str
+    ) -> Tuple[bytes, int]:
+        # Stored flows were validated on the way in, so the bytes can be
+        # handed to the response as they are, without a parse/serialize pass.
+        filename = self._resolve_name(filename)
+        content, version = self._load(user_id, filename)
+        self.storage.touch(user_id, filename)
+        record_bytes("read", len(content))
+        return content, version
+
+    def read_file_with_version(
+        self, user_id: str, filename: str
+    ) -> Tuple[Dict, int]:
+        content, version = self.read_file_bytes(user_id, filename)
+        return self._decode(content, filename), version
+
+    def update_file(
+        self,
+        user_id: str,
+        filename: str,
+        content: Dict,
+        expected_version: Optional[int] = None,
+    ) -> int:
+        try:
+            with timer("json_encode"):
+                data = self.codec.dumps(content)
         except TypeError:
             raise ValueError(f"Invalid JSON content for file {filename}")
-        with open(file_path, "w") as f:
-            f.write(json_content)
-        self.update_last_edit_time(user_id, filename)
+        return self.update_file_bytes(
+            user_id, filename, data, expected_version, validate=False
+        )
 
+    @timed("write")
+    def update_file_bytes(
+        self,
+        user_id: str,
+        filename: str,
+        data: bytes,
+        expected_version: Optional[int] = None,
+        validate: bool = True,
+    ) -> int:
+        if validate:
+            with timer("json_validate"):
+                self.codec.validate(data)
+        record_bytes("write", len(data))
+        filename = self._resolve_name(filename)
+        stored = self._to_storage(data)
+        self._check_quota(user_id, len(stored), replaced=[filename])
+        version = self.storage.write(
+            user_id, filename, stored, expected_version
+        )
+        self._cache_written(user_id, filename, data, version)
+        self._record(user_id, filename, data, version)
+        self._publish(user_id, "updated", filename, version)
+        return version
+
+    @timed("patch")
+    def patch_file(
+        self,
+        user_id: str,
+        filename: str,
+        patch: Union[List, Dict],
+        expected_version: int,
+    ) -> int:
+        filename = self._resolve_name(filename)
+        content, version = self._load(user_id, filename)
+        if version != expected_version:
+            raise VersionConflictError(version)
+        document = self._decode(content, filename)
+        if isinstance(patch, list):
+            document = apply_json_patch(document, patch)
+        else:
+            document = apply_flow_diff(document, patch)
+        with timer("json_encode"):
+            data = self.codec.dumps(document)
+        record_bytes("patch", len(data))
+        stored = self._to_storage(data)
+        self._check_quota(user_id, len(stored), replaced=[filename])
+        # The write re-checks the version, so a save that lands between the
+        # read above and here turns into a conflict instead of being lost.
+        version = self.storage.write(
+            user_id, filename, stored, expected_version
+        )
+        self._cache_written(user_id, filename, data, version)
+        self._record(user_id, filename, data, version)
+        self._publish(user_id, "updated", filename, version)
+        return version
+
+    @timed("delete")
     def delete_file(self, user_id: str, filename: str) -> None:
-        user_workspace = self.get_user_workspace(user_id)
-        if not filename.endswith(FLOW_FILE_EXTENSION):
-            filename += FLOW_FILE_EXTENSION
-        file_path = os.path.join(user_workspace, secure_filename(filename))
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"File {filename} not found")
-        os.remove(file_path)
-        metadata = self.load_metadata(user_id)
-        metadata.pop(filename, None)
-        self.save_metadata(user_id, metadata)
+        filename = self._resolve_name(filename)
+        if self.cache is not None:
+            self.cache.invalidate(user_id, filename)
+        if self.grid_cache is not None:
+            self.grid_cache.invalidate(user_id, filename)
+        self.storage.delete(user_id, filename)
+        if self.search_index is not None:
+            self.search_index.remove(user_id, filename)
+        self._publish(user_id, "deleted", filename)
+
+    def delete_workspace(self, user_id: str) -> None:
+        # Removes every flow of the user along with what was derived from
+        # them: cached content, version history and the search index.
+        self.storage.delete_user(user_id)
+        if self.cache is not None:
+            self.cache.invalidate_user(user_id)
+        if self.grid_cache is not None:
+            self.grid_cache.invalidate_user(user_id)
+        if self.history is not None:
+            self.history.delete_user(user_id)
+        if self.search_index is not None:
+            self.search_index.delete_user(user_id)
+        if self.change_feed is not None:
+            self.change_feed.forget(user_id)
+
+    def _grid(self, user_id: str, filename: str) -> Tuple[FlowGrid, int]:
+        # The spatial index of a flow and the version it was built from.
+        filename = self._resolve_name(filename)
+        entry = None
+        if self.grid_cache is not None:
+            entry = self.storage.stat(user_id, filename)
+            grid = self.grid_cache.get(user_id, filename, entry)
+            if grid is not None:
+                return grid, entry.version
+        content, version = self._load(user_id, filename)
+        document = self._decode(content, filename)
+        with timer("spatial_index"):
+            grid = FlowGrid(document)
+        if entry is not None and entry.version == version:
+            self.grid_cache.put(user_id, filename, entry, grid, len(content))
+        return grid, version
+
+    def read_viewport(
+        self,
+        user_id: str,
+        filename: str,
+        box: Tuple[float, float, float, float],
+        limit: int = MAX_VIEWPORT_NODES,
+    ) -> Dict:
+        # The nodes intersecting ``box`` and every edge touching one of
+        # them, which may lead to nodes outside it.
+        if not 0 < limit <= MAX_VIEWPORT_NODES:
+            raise ValueError(
+                f"limit must be between 1 and {MAX_VIEWPORT_NODES}"
+            )
+        grid, version = self._grid(user_id, filename)
+        indexes, truncated = grid.query(box, limit)
+        return {
+            "version": version,
+            "bbox": list(box),
+            "nodes": [grid.nodes[i] for i in indexes],
+            "edges": [grid.edges[i] for i in grid.edges_touching(indexes)],
+            "truncated": truncated,
+        }
+
+    def read_subgraph(
+        self, user_id: str, filename: str, node_ids: List[str]
+    ) -> Dict:
+        # The given nodes and the edges touching them; unknown ids are
+        # reported rather than failing the read.
+        if not node_ids:
+            raise ValueError("At least one node id is required")
+        if len(node_ids) > MAX_SUBGRAPH_NODES:
+            raise ValueError(f"At most {MAX_SUBGRAPH_NODES} node ids")
+        grid, version = self._grid(user_id, filename)
+        indexes = sorted({grid.by_id[i] for i in node_ids if i in grid.by_id})
+        return {
+            "version": version,
+            "nodes": [grid.nodes[i] for i in indexes],
+            "edges": [grid.edges[i] for i in grid.edges_touching(indexes)],
+            "missing": [i for i in node_ids if i not in grid.by_id],
+        }
+
+    def read_outline(self, user_id: str, filename: str) -> Dict:
+        grid, version = self._grid(user_id, filename)
+        return {"version": version, **grid.outline()}
+
+    def search(
+        self, user_id: str, query: str, limit: int = DEFAULT_LIMIT
+    ) -> Tuple[List[Dict], int]:
+        if self.search_index is None:
+            raise ValueError("Search is disabled")
+        if not query.strip():
+            raise ValueError("A search query is required")
+        if not 0 < limit <= MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+        return self.search_index.search(user_id, query, limit)
+
+    def list_versions(self, user_id: str, filename: str) -> List[Dict]:
+        if self.history is None:
+            return []
+        return self.history.list_versions(
+            user_id, self._resolve_name(filename)
+        )
+
+    def read_version(self, user_id: str, filename: str, version: int) -> bytes:
+        if self.history is None:
+            raise FileNotFoundError("Version history is disabled")
+        document = self.history.read_version(
+            user_id, self._resolve_name(filename), version
+        )
+        with timer("json_encode"):
+            return self.codec.dumps(document)
+
+    def restore_version(
+        self,
+        user_id: str,
+        filename: str,
+        version: int,
+        expected_version: Optional[int] = None,
+    ) -> int:
+        # Saves the content of ``version`` as a new version. A deleted flow
+        # is recreated from it.
+        data = self.read_version(user_id, filename, version)
+        try:
+            return self.update_file_bytes(
+                user_id, filename, data, expected_version, validate=False
+            )
+        except FileNotFoundError:
+            if expected_version is not None:
+                raise
+        self.create_file(
+            user_id,
+            FileStorage(
+                io.BytesIO(data), filename=self._resolve_name(filename)
+            ),
+        )
+        return self.get_version(user_id, filename)
+
+    def recompress(
+        self, user_id: str, encoding: Optional[str] = None
+    ) -> Dict[str, int]:
+        # Re-encodes a user's flows in ``encoding`` (default: the configured
+        # storage encoding) without changing their versions. Flows edited
+        # meanwhile are left for the next run.
+        encoding = get_encoding(encoding or self.storage_encoding)
+        stats = dict.fromkeys(
+            ["rewritten", "unchanged", "busy", "bytes_before", "bytes_after"],
+            0,
+        )
+        for entry in self.storage.list_entries(user_id):
+            try:
+                content, _ = self.storage.read(user_id, entry.filename)
+            except FileNotFoundError:
+                continue
+            stats["bytes_before"] += len(content)
+            data = content
+            if detect(content) != encoding:
+                data = encode(decode(content), encoding)
+            if data == content:
+                stats["unchanged"] += 1
+                stats["bytes_after"] += len(content)
+                continue
+            if self.storage.rewrite(user_id, entry.filename, data, entry):
+                if self.cache is not None:
+                    self.cache.invalidate(user_id, entry.filename)
+                stats["rewritten"] += 1
+                stats["bytes_after"] += len(data)
+            else:
+                stats["busy"] += 1
+                stats["bytes_after"] += len(content)
+        return stats
+
+    @timed("read_many")
+    def read_files(
+        self, user_id: str, filenames: List[str]
+    ) -> Tuple[List[Tuple[str, bytes, int]], List[str]]:
+        # Returns (name, content, version) for each flow found, in request
+        # order, and the names that were not found.
+        if len(filenames) > MAX_BATCH_SIZE:
+            raise ValueError(
+                f"At most {MAX_BATCH_SIZE} files can be read at once"
+            )
+        found = []
+        missing = []
+        for filename in dict.fromkeys(filenames):
+            try:
+                content, version = self.read_file_bytes(user_id, filename)
+            except FileNotFoundError:
+                missing.append(filename)
+                continue
+            found.append((filename, content, version))
+        return found, missing
+
+    def export_workspace(
+        self, user_id: str, filenames: Optional[List[str]] = None
+    ) -> Iterator[bytes]:
+        # Resolves the selection up front, so a missing flow is reported
+        # before the response starts, then streams a zip of the flows plus
+        # a manifest of their versions and last-edit times.
+        if filenames is None:
+            entries = sorted(
+                self.storage.list_entries(user_id), key=lambda e: e.filename
+            )
+        else:
+            entries = [
+                self.stat_file(user_id, filename)
+                for filename in dict.fromkeys(filenames)
+            ]
+        return stream_zip(self._export_entries(user_id, entries))
+
+    def _export_entries(
+        self, user_id: str, entries: List[FlowEntry]
+    ) -> Iterator[Tuple[str, bytes]]:
+        manifest = {}
+        for entry in entries:
+            try:
+                content, version = self.storage.read(user_id, entry.filename)
+            except FileNotFoundError:
+                continue
+            content = self._from_storage(content)
+            record_bytes("export", len(content))
+            manifest[entry.filename] = {
+                "version": version,
+                "last_edit": entry.last_edit,
+            }
+            yield entry.filename, content or EMPTY_FLOW
+        yield MANIFEST_NAME, self.codec.dumps(
+            {"exported_at": datetime.now().isoformat(), "flows": manifest}
+        )
+
+    def _archive_name(self, name: str) -> Optional[str]:
+        # Both "a.flow.json" and "a.json" entries are imported as a flow "a".
+        if name == MANIFEST_NAME or not name.endswith(".json"):
+            return None
+        stem = name.removesuffix(FLOW_FILE_EXTENSION).removesuffix(".json")
+        if not secure_filename(stem):
+            return None
+        return self._resolve_name(stem)
+
+    @timed("import")
+    def import_workspace(
+        self, user_id: str, archive: BinaryIO, overwrite: bool = False
+    ) -> Dict[str, List]:
+        # Validates every flow while staging it, then creates them in one
+        # storage call. Invalid entries are reported and left out; existing
+        # flows are skipped unless ``overwrite`` is set.
+        staging_dir = self.storage.staging_dir(user_id)
+        staged: Dict[str, str] = {}
+        errors = []
+        # A small archive can expand to far more than the quota, so staging
+        # stops as soon as it outgrows what the import could ever store.
+        max_bytes, max_files, existing_names = self._import_budget(
+            user_id, overwrite
+        )
+        expanded = stored = new_files = 0
+        try:
+            for name, member in iter_members(archive):
+                filename = self._archive_name(name)
+                if filename is None:
+                    if name != MANIFEST_NAME:
+                        errors.append({"name": name, "error": "Not a flow"})
+                    continue
+                if filename in staged:
+                    errors.append({"name": name, "error": "Duplicate entry"})
+                    continue
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=staging_dir, prefix=".upload-", suffix=".tmp"
+                )
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        self._write_upload(member, f)
+                        record_bytes("import", f.tell())
+                        expanded += f.tell()
+                    encode_file(tmp_path, self.storage_encoding)
+                except (ValueError, FileTooLargeError) as e:
+                    os.remove(tmp_path)
+                    errors.append({"name": name, "error": str(e)})
+                    continue
+                staged[filename] = tmp_path
+                if filename not in existing_names:
+                    new_files += 1
+                # Flows that exist are skipped unless they are replaced.
+                if overwrite or filename not in existing_names:
+                    stored += os.path.getsize(tmp_path)
+                if expanded > self.max_import_bytes:
+                    raise FileTooLargeError(
+                        f"Archive expands to more than "
+                        f"{self.max_import_bytes} bytes"
+                    )
+                if max_bytes is not None and stored > max_bytes:
+                    raise QuotaExceededError(
+                        "Workspace quota of "
+                        f"{self._quota(user_id).max_bytes} bytes exceeded"
+                    )
+                if max_files is not None and new_files > max_files:
+                    raise QuotaExceededError(
+                        "Workspace quota of "
+                        f"{self._quota(user_id).max_files} files reached"
+                    )
+        except BaseException:
+            for tmp_path in staged.values():
+                os.remove(tmp_path)
+            raise
+
+        existing_names = {
+            entry.filename for entry in self.storage.list_entries(user_id)
+        }
+        # Checked as a whole, before anything is stored; flows that exist
+        # are skipped or, with ``overwrite``, replaced.
+        counted = [
+            filename
+            for filename in staged
+            if overwrite or filename not in existing_names
+        ]
+        try:
+            self._check_quota(
+                user_id,
+                sum(os.path.getsize(staged[name]) for name in counted),
+                len([name for name in counted if name not in existing_names]),
+                replaced=counted,
+            )
+        except QuotaExceededError:
+            for tmp_path in staged.values():
+                os.remove(tmp_path)
+            raise
+
+        updated: Dict[str, int] = {}
+        if overwrite:
+            for filename in list(staged):
+                if filename not in existing_names:
+                    continue
+                tmp_path = staged.pop(filename)
+                try:
+                    with open(tmp_path, "rb") as f:
+                        updated[filename] = self.storage.write(
+                            user_id, filename, f.read()
+                        )
+                finally:
+                    os.remove(tmp_path)
+                if self.cache is not None:
+                    self.cache.invalidate(user_id, filename)
+        created, existing = self.storage.create_many(
+            user_id, list(staged.items())
+        )
+        for filename in sorted(created):
+            self._record_stored(user_id, filename)
+            self._publish(user_id, "created", filename, created[filename])
+        for filename, version in updated.items():
+            self._record_stored(user_id, filename)
+            self._publish(user_id, "updated", filename, version)
+        return {
+            "imported": sorted(created) + list(updated),
+            "skipped": existing,
+            "errors": errors,
+        }
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from storage import FlowEntry
+from metrics import REGISTRY
+
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Rough per-entry cost of the key, stamp and OrderedDict node, so that a
+# cache full of tiny flows is still bounded.
+ENTRY_OVERHEAD = 256
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "workstation_flow_cache_lookups_total",
+    "Flow cache lookups, by result.",
+    ("result",),
+)
+CACHE_EVICTIONS = REGISTRY.counter(
+    "workstation_flow_cache_evictions_total",
+    "Flows evicted from the flow cache to stay under its size bound.",
+)
+CACHE_BYTES = REGISTRY.gauge(
+    "workstation_flow_cache_bytes",
+    "Approximate memory held by the flow cache.",
+)
+
+
+def _stamp(entry: FlowEntry) -> Tuple[int, int, int]:
+    return entry.version, entry.size, entry.mtime_ns
+
+
+# Decoded flow bytes of recently read or written flows, least recently used
+# first. An entry is only served while the flow's current stat still matches
+# the one it was cached under, so edits made around the cache (another
+# process, a restore, a hand-edited file) are never masked; FileManager also
+# drops entries on its own mutations.
+class FlowCache:
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_CACHE_BYTES,
+        max_entry_bytes: Optional[int] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        # One huge flow should not flush everything else out.
+        self.max_entry_bytes = (
+            max_bytes // 8 if max_entry_bytes is None else max_entry_bytes
+        )
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(
+        self, user_id: str, filename: str, entry: FlowEntry
+    ) -> Optional[bytes]:
+        key = (user_id, filename)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == _stamp(entry):
+                self._entries.move_to_end(key)
+                CACHE_LOOKUPS.inc("hit")
+                return cached[1]
+            if cached is not None:
+                self._discard(key)
+        CACHE_LOOKUPS.inc("miss")
+        return None
+
+    def put(
+        self, user_id: str, filename: str, entry: FlowEntry, content: bytes
+    ) -> None:
+        key = (user_id, filename)
+        cost = len(content) + ENTRY_OVERHEAD
+        with self._lock:
+            self._discard(key)
+            if cost <= self.max_entry_bytes:
+                self._entries[key] = (_stamp(entry), content)
+                self._size += cost
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted) + ENTRY_OVERHEAD
+                CACHE_EVICTIONS.inc()
+            CACHE_BYTES.set(value=self._size)
+
+    def invalidate(self, user_id: str, filename: str) -> None:
+        with self._lock:
+            self._discard((user_id, filename))
+            CACHE_BYTES.set(value=self._size)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._discard(key)
+            CACHE_BYTES.set(value=self._size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            CACHE_BYTES.set(value=0)
+
+    def _discard(self, key: Tuple[str, str]) -> None:
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self._size -= len(cached[1]) + ENTRY_OVERHEAD
@@ -0,0 +1,97 @@
+import os
+import gzip
+import zlib
+import shutil
+import tempfile
+from typing import Optional
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+# How flow bytes are kept at rest. Plain JSON always starts with "{", "[" or
+# whitespace, so a compressed flow is told apart by its magic bytes and the
+# three encodings can live side by side in one workspace.
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Below this, the frame overhead outweighs the savings; such flows are
+# kept as plain JSON whatever the configured encoding.
+MIN_COMPRESS_SIZE = 512
+COPY_CHUNK_SIZE = 64 * 1024
+
+ENCODINGS = ["json", "gzip"]
+if zstandard is not None:
+    ENCODINGS.append("zstd")
+
+
+def detect(data: bytes) -> str:
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    if data.startswith(GZIP_MAGIC):
+        return "gzip"
+    return "json"
+
+
+def get_encoding(name: Optional[str] = None) -> str:
+    # FLOW_STORAGE_ENCODING selects the encoding for new writes.
+    name = name or os.environ.get("FLOW_STORAGE_ENCODING") or "json"
+    if name not in ENCODINGS:
+        raise ValueError(f"Flow storage encoding {name!r} is not available")
+    return name
+
+
+def encode(data: bytes, encoding: str) -> bytes:
+    if len(data) < MIN_COMPRESS_SIZE:
+        return data
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return data
+
+
+def decode(data: bytes) -> bytes:
+    encoding = detect(data)
+    if encoding == "json":
+        return data
+    if encoding == "zstd" and zstandard is None:
+        raise ValueError("Flow is zstd-compressed but zstandard is missing")
+    try:
+        if encoding == "zstd":
+            # A decompressobj, since streamed frames do not record a size.
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            return decompressor.decompress(data)
+        return gzip.decompress(data)
+    except (OSError, EOFError, zlib.error) as e:
+        raise ValueError(f"Corrupt {encoding} flow: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise ValueError(f"Corrupt {encoding} flow: {e}")
+        raise
+
+
+def encode_file(path: str, encoding: str) -> None:
+    # Re-encodes the plain JSON file at ``path`` in place, chunk by chunk.
+    if encoding == "json" or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+        return
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=".encode-", suffix=".tmp"
+    )
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if encoding == "zstd":
+                compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+                compressor.copy_stream(src, dst)
+            else:
+                with gzip.GzipFile(
+                    fileobj=dst, mode="wb", compresslevel=GZIP_LEVEL, mtime=0
+                ) as out:
+                    shutil.copyfileobj(src, out, COPY_CHUNK_SIZE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
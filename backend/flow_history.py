@@ -0,0 +1,534 @@
+import os
+import json
+import time
+import queue
+import shutil
+import struct
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from loguru import logger
+from json_codec import JSONCodec, get_codec
+from metrics import REGISTRY, timed
+
+
+HISTORY_DIRNAME = ".history"
+PACK_FILENAME = "objects.pack"
+VERSIONS_DIRNAME = "versions"
+VERSIONS_SUFFIX = ".versions"
+# Top-level lists stored item by item, so that a snapshot only adds the
+# items that changed. Item hashes are grouped in pages of PAGE_SIZE, which
+# keeps manifests small and lets unchanged pages dedupe as well.
+CHUNKED_KEYS = ("nodes", "edges")
+PAGE_SIZE = 64
+DEFAULT_KEEP_VERSIONS = 100
+DEFAULT_MAX_AGE_DAYS = 90
+DEFAULT_GC_INTERVAL = 3600.0
+# Snapshots waiting for the worker hold the full bytes of a flow each, so
+# the queue is bounded by their total size.
+DEFAULT_MAX_QUEUED_BYTES = 64 * 1024 * 1024
+# A pack is only rewritten once this share of it is unreachable.
+COMPACT_THRESHOLD = 0.25
+RECORD_HEADER = struct.Struct(">32sI")
+
+SNAPSHOTS = REGISTRY.counter(
+    "workstation_history_snapshots_total",
+    "Flow versions recorded in the history, by outcome.",
+    ("outcome",),
+)
+SNAPSHOT_BYTES = REGISTRY.counter(
+    "workstation_history_bytes_written_total",
+    "New object bytes appended to history packs.",
+)
+QUEUED_BYTES = REGISTRY.gauge(
+    "workstation_history_queued_bytes",
+    "Bytes of flow versions waiting to be recorded in the history.",
+)
+
+
+def _digest(payload: bytes) -> bytes:
+    return hashlib.sha256(payload).digest()
+
+
+# Content-addressed objects of one user, appended to a single file as
+# (sha256, length, payload) records. The index of offsets is rebuilt from
+# the record headers when the pack is first opened.
+class ObjectPack:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._index: Optional[Dict[bytes, Tuple[int, int]]] = None
+
+    @property
+    def index(self) -> Dict[bytes, Tuple[int, int]]:
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    @timed("history_index")
+    def _load_index(self) -> Dict[bytes, Tuple[int, int]]:
+        index: Dict[bytes, Tuple[int, int]] = {}
+        if not os.path.exists(self.path):
+            return index
+        with open(self.path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + RECORD_HEADER.size <= size:
+                f.seek(offset)
+                digest, length = RECORD_HEADER.unpack(
+                    f.read(RECORD_HEADER.size)
+                )
+                start = offset + RECORD_HEADER.size
+                if start + length > size:
+                    break
+                index[digest] = (start, length)
+                offset = start + length
+            if offset < size:
+                # A record cut short by a crash mid-append; nothing refers
+                # to it yet, since version logs are written afterwards.
+                logger.warning(f"Truncating partial record in {self.path}")
+                f.truncate(offset)
+        return index
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.index
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def get(self, digest: bytes) -> bytes:
+        with self.reader() as read:
+            return read(digest)
+
+    @contextmanager
+    def reader(self) -> Iterator[Callable[[bytes], bytes]]:
+        # Reads any number of objects through one handle, opened on the
+        # first read.
+        handle: List[BinaryIO] = []
+
+        def read(digest: bytes) -> bytes:
+            location = self.index.get(digest)
+            if location is None:
+                raise ValueError(f"History object {digest.hex()} is missing")
+            if not handle:
+                handle.append(open(self.path, "rb"))
+            offset, length = location
+            handle[0].seek(offset)
+            return handle[0].read(length)
+
+        try:
+            yield read
+        finally:
+            if handle:
+                handle[0].close()
+
+    def put_many(self, objects: Dict[bytes, bytes]) -> int:
+        # Appends the objects not stored yet; returns the bytes written.
+        index = self.index
+        new = [(d, p) for d, p in objects.items() if d not in index]
+        if not new:
+            return 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            chunks = []
+            for digest, payload in new:
+                chunks.append(RECORD_HEADER.pack(digest, len(payload)))
+                chunks.append(payload)
+                index[digest] = (offset + RECORD_HEADER.size, len(payload))
+                offset += RECORD_HEADER.size + len(payload)
+            data = b"".join(chunks)
+            f.write(data)
+        return len(data)
+
+    def compact(self, live: Set[bytes]) -> int:
+        # Rewrites the pack with only ``live`` objects; returns bytes freed.
+        before = self.size()
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path), prefix=".pack-", suffix=".tmp"
+        )
+        index: Dict[bytes, Tuple[int, int]] = {}
+        try:
+            with os.fdopen(fd, "wb") as out, open(self.path, "rb") as src:
+                offset = 0
+                for digest, (start, length) in self.index.items():
+                    if digest not in live:
+                        continue
+                    src.seek(start)
+                    out.write(RECORD_HEADER.pack(digest, length))
+                    out.write(src.read(length))
+                    index[digest] = (offset + RECORD_HEADER.size, length)
+                    offset += RECORD_HEADER.size + length
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._index = index
+        return before - self.size()
+
+
+# Per-flow version history under <history_root>/<user_id>/: every recorded
+# version is a manifest object in the user's pack plus a line in the
+# flow's version log. Snapshots are taken and old versions pruned on a
+# background thread, so saves only pay for queueing the bytes.
+class FlowHistory:
+    def __init__(
+        self,
+        history_root: str,
+        codec: Optional[JSONCodec] = None,
+        keep_versions: int = DEFAULT_KEEP_VERSIONS,
+        max_age: timedelta = timedelta(days=DEFAULT_MAX_AGE_DAYS),
+        gc_interval: float = DEFAULT_GC_INTERVAL,
+        exists: Optional[Callable[[str, str], bool]] = None,
+        max_queued_bytes: int = DEFAULT_MAX_QUEUED_BYTES,
+    ) -> None:
+        self.history_root = history_root
+        self.codec = codec or get_codec()
+        self.keep_versions = keep_versions
+        self.max_age = max_age
+        self.gc_interval = gc_interval
+        # Tells whether a flow still exists; a deleted flow keeps no version
+        # beyond ``max_age``.
+        self.exists = exists
+        self.max_queued_bytes = max_queued_bytes
+        self._packs: Dict[str, ObjectPack] = {}
+        self._last_versions: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+        self._queue: queue.Queue = queue.Queue()
+        self._queued_bytes = 0
+        self._queued_lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._run, name="flow-history", daemon=True
+        )
+        self._worker.start()
+
+    def _user_dir(self, user_id: str) -> str:
+        return os.path.join(self.history_root, user_id)
+
+    def _log_path(self, user_id: str, filename: str) -> str:
+        return os.path.join(
+            self._user_dir(user_id),
+            VERSIONS_DIRNAME,
+            filename + VERSIONS_SUFFIX,
+        )
+
+    def _pack(self, user_id: str) -> ObjectPack:
+        pack = self._packs.get(user_id)
+        if pack is None:
+            pack = ObjectPack(
+                os.path.join(self._user_dir(user_id), PACK_FILENAME)
+            )
+            self._packs[user_id] = pack
+        return pack
+
+    def record(
+        self, user_id: str, filename: str, version: int, data: bytes
+    ) -> None:
+        # Queues ``data`` (plain flow JSON) as ``version`` of the flow. A
+        # flow larger than the whole budget is still taken when nothing else
+        # is queued, so big flows get a history too.
+        item = (user_id, filename, version, data, datetime.now().isoformat())
+        with self._queued_lock:
+            if (
+                self._queued_bytes
+                and self._queued_bytes + len(data) > self.max_queued_bytes
+            ):
+                SNAPSHOTS.inc("dropped")
+                logger.warning(
+                    f"History queue full; version {version} of {filename} "
+                    f"for {user_id} is not recorded"
+                )
+                return
+            self._queued_bytes += len(data)
+            QUEUED_BYTES.set(value=self._queued_bytes)
+        self._queue.put(item)
+
+    def flush(self) -> None:
+        # Waits until every queued snapshot is recorded.
+        self._queue.join()
+
+    def _store(self, payload: bytes, objects: Dict[bytes, bytes]) -> bytes:
+        digest = _digest(payload)
+        objects.setdefault(digest, payload)
+        return digest
+
+    def _encode(self, value: Any, objects: Dict[bytes, bytes]) -> str:
+        return self._store(self.codec.dumps(value), objects).hex()
+
+    @timed("history_snapshot")
+    def _snapshot(
+        self,
+        user_id: str,
+        filename: str,
+        version: int,
+        data: bytes,
+        saved_at: str,
+    ) -> None:
+        key = (user_id, filename)
+        if self._last_versions.get(key) == version:
+            return
+        document = self.codec.loads(data)
+        objects: Dict[bytes, bytes] = {}
+        manifest: Dict[str, Any] = {"chunked": {}}
+        rest = document
+        if isinstance(document, dict):
+            rest = dict(document)
+            for name in CHUNKED_KEYS:
+                items = document.get(name)
+                if not isinstance(items, list):
+                    continue
+                del rest[name]
+                # A page is the concatenated raw digests of its items.
+                manifest["chunked"][name] = [
+                    self._store(
+                        b"".join(
+                            self._store(self.codec.dumps(item), objects)
+                            for item in items[start : start + PAGE_SIZE]
+                        ),
+                        objects,
+                    ).hex()
+                    for start in range(0, len(items), PAGE_SIZE)
+                ]
+        manifest["rest"] = self._encode(rest, objects)
+        line = {
+            "version": version,
+            "saved_at": saved_at,
+            "size": len(data),
+            "manifest": self._encode(manifest, objects),
+        }
+        with self._lock:
+            written = self._pack(user_id).put_many(objects)
+            log_path = self._log_path(user_id, filename)
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            with open(log_path, "a") as f:
+                f.write(json.dumps(line) + "\n")
+        self._last_versions[key] = version
+        SNAPSHOTS.inc("recorded")
+        SNAPSHOT_BYTES.inc(amount=written)
+
+    def _read_log(self, user_id: str, filename: str) -> List[Dict[str, Any]]:
+        # Oldest first.
+        try:
+            with open(self._log_path(user_id, filename), "r") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def list_versions(
+        self, user_id: str, filename: str
+    ) -> List[Dict[str, Any]]:
+        # Newest first.
+        with self._lock:
+            entries = self._read_log(user_id, filename)
+        return [
+            {
+                "version": entry["version"],
+                "saved_at": entry["saved_at"],
+                "size": entry["size"],
+            }
+            for entry in reversed(entries)
+        ]
+
+    def delete_user(self, user_id: str) -> None:
+        # Snapshots still queued for the user would bring the directory
+        # back, so they are recorded first; once closed, the worker is gone
+        # and nothing is queued anymore.
+        if not self._closed:
+            self.flush()
+        with self._lock:
+            self._packs.pop(user_id, None)
+            for key in [k for k in self._last_versions if k[0] == user_id]:
+                del self._last_versions[key]
+            shutil.rmtree(self._user_dir(user_id), ignore_errors=True)
+
+    def _load(self, read: Callable[[bytes], bytes], digest: str) -> Any:
+        return self.codec.loads(read(bytes.fromhex(digest)))
+
+    def _page(self, read: Callable[[bytes], bytes], page: str) -> List[bytes]:
+        data = read(bytes.fromhex(page))
+        size = hashlib.sha256().digest_size
+        return [data[i : i + size] for i in range(0, len(data), size)]
+
+    def read_version(self, user_id: str, filename: str, version: int) -> Any:
+        with self._lock:
+            for entry in reversed(self._read_log(user_id, filename)):
+                if entry["version"] == version:
+                    break
+            else:
+                raise FileNotFoundError(
+                    f"Version {version} of {filename} is not in the history"
+                )
+            with self._pack(user_id).reader() as read:
+                manifest = self._load(read, entry["manifest"])
+                document = self._load(read, manifest["rest"])
+                for name, pages in manifest["chunked"].items():
+                    document[name] = [
+                        self.codec.loads(read(digest))
+                        for page in pages
+                        for digest in self._page(read, page)
+                    ]
+        return document
+
+    def _retain(
+        self, entries: List[Dict[str, Any]], alive: bool, now: datetime
+    ) -> List[Dict[str, Any]]:
+        # Keeps the newest ``keep_versions`` versions and, of those, the ones
+        # younger than ``max_age``; the newest version of a live flow is
+        # kept whatever its age.
+        cutoff = (now - self.max_age).isoformat()
+        kept = entries[-self.keep_versions :] if self.keep_versions else []
+        newest = kept[-1:] if alive else []
+        return [
+            entry
+            for entry in kept
+            if entry["saved_at"] >= cutoff or entry in newest
+        ]
+
+    def _reachable(self, pack: ObjectPack, entries: List[Dict]) -> Set[bytes]:
+        live: Set[bytes] = set()
+
+        def mark(digest: str) -> bool:
+            raw = bytes.fromhex(digest)
+            if raw in live:
+                return False
+            live.add(raw)
+            return True
+
+        with pack.reader() as read:
+            for entry in entries:
+                if not mark(entry["manifest"]):
+                    continue
+                manifest = self._load(read, entry["manifest"])
+                mark(manifest["rest"])
+                for pages in manifest["chunked"].values():
+                    for page in pages:
+                        if mark(page):
+                            live.update(self._page(read, page))
+        return live
+
+    @timed("history_gc")
+    def collect(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        # Applies the retention policy to every flow's log, then compacts
+        # packs whose unreachable share passed COMPACT_THRESHOLD.
+        now = now or datetime.now()
+        stats = dict.fromkeys(["versions_removed", "bytes_freed"], 0)
+        try:
+            users = [
+                name
+                for name in os.listdir(self.history_root)
+                if not name.startswith(".")
+            ]
+        except FileNotFoundError:
+            return stats
+        for user_id in users:
+            try:
+                self._collect_user(user_id, now, stats)
+            except (OSError, ValueError) as e:
+                logger.error(f"History GC failed for {user_id}: {e}")
+        return stats
+
+    def _collect_user(
+        self, user_id: str, now: datetime, stats: Dict[str, int]
+    ) -> None:
+        versions_dir = os.path.join(self._user_dir(user_id), VERSIONS_DIRNAME)
+        try:
+            names = os.listdir(versions_dir)
+        except FileNotFoundError:
+            names = []
+        with self._lock:
+            pack = self._pack(user_id)
+            live: Set[bytes] = set()
+            for name in names:
+                if not name.endswith(VERSIONS_SUFFIX):
+                    continue
+                filename = name[: -len(VERSIONS_SUFFIX)]
+                entries = self._read_log(user_id, filename)
+                alive = self.exists is None or self.exists(user_id, filename)
+                kept = self._retain(entries, alive, now)
+                if len(kept) != len(entries):
+                    stats["versions_removed"] += len(entries) - len(kept)
+                    self._write_log(user_id, filename, kept)
+                live |= self._reachable(pack, kept)
+            size = pack.size()
+            live_size = sum(
+                RECORD_HEADER.size + length
+                for digest, (_, length) in pack.index.items()
+                if digest in live
+            )
+            if size and size - live_size >= size * COMPACT_THRESHOLD:
+                stats["bytes_freed"] += pack.compact(live)
+
+    def _write_log(
+        self, user_id: str, filename: str, entries: List[Dict[str, Any]]
+    ) -> None:
+        log_path = self._log_path(user_id, filename)
+        if not entries:
+            os.remove(log_path)
+            self._last_versions.pop((user_id, filename), None)
+            return
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(log_path), prefix=".versions-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            os.replace(tmp_path, log_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _run(self) -> None:
+        next_gc = time.monotonic() + self.gc_interval
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(0, next_gc - time.monotonic())
+                )
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                if item:
+                    self._snapshot(*item)
+            except Exception as e:
+                SNAPSHOTS.inc("failed")
+                logger.error(f"Could not record {item[1]} for {item[0]}: {e}")
+            finally:
+                if item:
+                    with self._queued_lock:
+                        self._queued_bytes -= len(item[3])
+                        QUEUED_BYTES.set(value=self._queued_bytes)
+                    self._queue.task_done()
+            if time.monotonic() >= next_gc:
+                stats = self.collect()
+                logger.info(
+                    f"History GC removed {stats['versions_removed']} "
+                    f"versions and freed {stats['bytes_freed']} bytes"
+                )
+                next_gc = time.monotonic() + self.gc_interval
+
+    def close(self) -> None:
+        # Records everything still queued before returning.
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
@@ -0,0 +1,167 @@
+import copy
+from typing import Any, Dict, List
+
+
+class PatchError(ValueError):
+    pass
+
+
+# RFC 6901 / 6902 JSON Patch.
+
+
+def _parse_pointer(pointer: str) -> List[str]:
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {pointer}")
+    return [
+        token.replace("~1", "/").replace("~0", "~")
+        for token in pointer[1:].split("/")
+    ]
+
+
+def _array_index(container: list, token: str, allow_end: bool) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise PatchError(f"Invalid array index: {token}")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise PatchError(f"Array index out of range: {token}")
+    return index
+
+
+def _resolve(document: Any, tokens: List[str]) -> Any:
+    for token in tokens:
+        if isinstance(document, dict):
+            if token not in document:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[_array_index(document, token, False)]
+        else:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+    return document
+
+
+def _add(document: Any, tokens: List[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, tokens[-1], True), value)
+    else:
+        raise PatchError(f"Cannot add to /{'/'.join(tokens)}")
+    return document
+
+
+def _remove(document: Any, tokens: List[str]) -> Any:
+    if not tokens:
+        raise PatchError("Cannot remove the document root")
+    parent = _resolve(document, tokens[:-1])
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+        return parent.pop(tokens[-1])
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, tokens[-1], False))
+    raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def apply_json_patch(document: Any, operations: List[Dict]) -> Any:
+    for operation in operations:
+        if not isinstance(operation, dict) or "path" not in operation:
+            raise PatchError("Invalid patch operation")
+        op = operation.get("op")
+        tokens = _parse_pointer(operation["path"])
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"'{op}' operation requires a value")
+        if op == "add":
+            document = _add(
+                document, tokens, copy.deepcopy(operation["value"])
+            )
+        elif op == "remove":
+            _remove(document, tokens)
+        elif op == "replace":
+            if tokens:
+                _remove(document, tokens)
+            document = _add(
+                document, tokens, copy.deepcopy(operation["value"])
+            )
+        elif op in ("move", "copy"):
+            from_tokens = _parse_pointer(operation.get("from", ""))
+            if op == "move":
+                inside = tokens[: len(from_tokens)] == from_tokens
+                if inside and tokens != from_tokens:
+                    raise PatchError("Cannot move a value into itself")
+                value = _remove(document, from_tokens)
+            else:
+                value = copy.deepcopy(_resolve(document, from_tokens))
+            document = _add(document, tokens, value)
+        elif op == "test":
+            if _resolve(document, tokens) != operation["value"]:
+                raise PatchError(f"Test failed at {operation['path']}")
+        else:
+            raise PatchError(f"Unknown patch operation: {op}")
+    return document
+
+
+# Node/edge diffs as produced by the editor:
+#
+#     {"nodes": {"upsert": [...], "remove": ["id", ...]},
+#      "edges": {"upsert": [...], "remove": [...]},
+#      "set": {"viewport": {...}}}
+#
+# Upserted items replace the existing item with the same id in place, or are
+# appended when the id is new.
+
+
+def _apply_item_diff(items: List[Dict], diff: Dict, kind: str) -> List[Dict]:
+    if not isinstance(diff, dict):
+        raise PatchError(f"Invalid {kind} diff")
+    removed = diff.get("remove", [])
+    upserts = diff.get("upsert", [])
+    if not isinstance(removed, list) or any(
+        not isinstance(item_id, str) for item_id in removed
+    ):
+        raise PatchError(f"Removed {kind} ids must be strings")
+    removed = set(removed)
+    if not isinstance(upserts, list) or any(
+        not isinstance(item, dict) or "id" not in item for item in upserts
+    ):
+        raise PatchError(f"Every upserted {kind} item needs an id")
+    if any(not isinstance(item["id"], str) for item in upserts):
+        raise PatchError(f"Upserted {kind} ids must be strings")
+    pending = {item["id"]: item for item in upserts}
+    result = []
+    for item in items:
+        item_id = item.get("id") if isinstance(item, dict) else None
+        # Stored items with ids no diff can name are kept as they are.
+        if not isinstance(item_id, str):
+            result.append(item)
+            continue
+        if item_id in removed:
+            continue
+        result.append(pending.pop(item_id, item))
+    for item in upserts:
+        if item["id"] in pending:
+            result.append(pending.pop(item["id"]))
+    return result
+
+
+def apply_flow_diff(document: Dict, diff: Dict) -> Dict:
+    if not isinstance(document, dict) or not isinstance(diff, dict):
+        raise PatchError("Invalid flow diff")
+    for kind in ("nodes", "edges"):
+        if kind in diff:
+            document[kind] = _apply_item_diff(
+                document.get(kind, []), diff[kind], kind
+            )
+    values = diff.get("set", {})
+    if not isinstance(values, dict) or {"nodes", "edges"} & values.keys():
+        raise PatchError("Invalid 'set' section in flow diff")
+    document.update(values)
+    return document
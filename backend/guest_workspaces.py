@@ -0,0 +1,207 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+from loguru import logger
+from storage import TRASH_DIRNAME
+from metrics import REGISTRY, timed
+
+GUEST_PREFIX = "guest_"
+# The workspace every guest shared before guests got their own. No session
+# uses it anymore, so the reaper removes it once it has been idle for the
+# guest TTL, like any abandoned guest workspace.
+LEGACY_GUEST_ID = "guest"
+# Touched inside a guest's workspace while the guest is active, so that
+# idle time survives restarts and is shared between worker processes.
+LAST_SEEN_FILENAME = ".last_seen"
+DEFAULT_GUEST_TTL = 7 * 24 * 3600.0
+DEFAULT_MAX_GUEST_WORKSPACES = 1000
+DEFAULT_MIN_IDLE = 3600.0
+DEFAULT_SWEEP_INTERVAL = 600.0
+DEFAULT_REAPER_THREADS = 2
+# How often an active guest's activity reaches the disk.
+TOUCH_INTERVAL = 60.0
+
+GUESTS_REAPED = REGISTRY.counter(
+    "workstation_guest_workspaces_reaped_total",
+    "Guest workspaces removed by the reaper, by policy.",
+    ("reason",),
+)
+GUEST_WORKSPACES = REGISTRY.gauge(
+    "workstation_guest_workspaces",
+    "Guest workspaces found by the last reaper sweep.",
+)
+
+
+def new_guest_id() -> str:
+    return GUEST_PREFIX + uuid.uuid4().hex
+
+
+def is_guest_id(user_id: str) -> bool:
+    return user_id.startswith(GUEST_PREFIX)
+
+
+# Every guest session gets its own workspace, which nobody can reach once
+# the session cookie is gone. The reaper sweeps them every ``interval``
+# seconds on a thread pool: a workspace idle for ``ttl`` is removed, and
+# past ``max_workspaces`` the least recently active ones idle for at least
+# ``min_idle`` go too. ``remove`` deletes a user's flows together with
+# their cache, history and search entries.
+class GuestReaper:
+    def __init__(
+        self,
+        workspace_root: str,
+        remove: Callable[[str], None],
+        list_users: Callable[[], List[str]],
+        ttl: float = DEFAULT_GUEST_TTL,
+        max_workspaces: int = DEFAULT_MAX_GUEST_WORKSPACES,
+        min_idle: float = DEFAULT_MIN_IDLE,
+        interval: float = DEFAULT_SWEEP_INTERVAL,
+        workers: int = DEFAULT_REAPER_THREADS,
+    ) -> None:
+        self.workspace_root = workspace_root
+        self.ttl = ttl
+        self.max_workspaces = max_workspaces
+        self.min_idle = min_idle
+        self.interval = interval
+        self._remove = remove
+        self._list_users = list_users
+        self._last_seen: Dict[str, float] = {}
+        self._reaping: Set[str] = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="guest-reaper"
+        )
+        self._stopped = threading.Event()
+        self._scheduler = threading.Thread(
+            target=self._run, name="guest-reaper", daemon=True
+        )
+        self._scheduler.start()
+
+    def touch(self, user_id: str) -> None:
+        # Called on every guest request; the disk sees one touch a minute.
+        now = time.time()
+        with self._lock:
+            previous = self._last_seen.get(user_id, 0.0)
+            self._last_seen[user_id] = now
+        if now - previous < TOUCH_INTERVAL:
+            return
+        workspace = os.path.join(self.workspace_root, user_id)
+        if not os.path.isdir(workspace):
+            # Nothing stored yet, so nothing to keep alive.
+            return
+        path = os.path.join(workspace, LAST_SEEN_FILENAME)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            try:
+                open(path, "a").close()
+            except OSError:
+                pass
+        except OSError as e:
+            logger.warning(f"Could not record activity of {user_id}: {e}")
+
+    def last_seen(self, user_id: str) -> float:
+        with self._lock:
+            seen = self._last_seen.get(user_id, 0.0)
+        workspace = os.path.join(self.workspace_root, user_id)
+        for path in (os.path.join(workspace, LAST_SEEN_FILENAME), workspace):
+            try:
+                seen = max(seen, os.stat(path).st_mtime)
+            except OSError:
+                pass
+        return seen
+
+    def _guests(self) -> Set[str]:
+        # Workspace directories cover both backends: the SQLite one still
+        # stages uploads there.
+        try:
+            with os.scandir(self.workspace_root) as entries:
+                names = {entry.name for entry in entries if entry.is_dir()}
+        except FileNotFoundError:
+            names = set()
+        names.update(self._list_users())
+        return {
+            name
+            for name in names
+            if is_guest_id(name) or name == LEGACY_GUEST_ID
+        }
+
+    @timed("guest_sweep")
+    def sweep(self, now: Optional[float] = None) -> Dict[str, List[str]]:
+        # Picks expired and surplus workspaces and queues their removal.
+        now = time.time() if now is None else now
+        seen = {user_id: self.last_seen(user_id) for user_id in self._guests()}
+        GUEST_WORKSPACES.set(value=len(seen))
+        expired = [u for u, t in seen.items() if now - t >= self.ttl]
+        live = sorted((t, u) for u, t in seen.items() if now - t < self.ttl)
+        surplus = max(0, len(live) - self.max_workspaces)
+        evicted = [u for t, u in live[:surplus] if now - t >= self.min_idle]
+        with self._lock:
+            for user_id in list(self._last_seen):
+                if now - self._last_seen[user_id] >= self.ttl:
+                    del self._last_seen[user_id]
+        for reason, victims in (("expired", expired), ("lru", evicted)):
+            for user_id in victims:
+                self._submit(user_id, reason, seen[user_id])
+        return {"expired": expired, "lru": evicted}
+
+    def _submit(self, user_id: str, reason: str, seen: float) -> None:
+        with self._lock:
+            if user_id in self._reaping:
+                return
+            self._reaping.add(user_id)
+        try:
+            self._pool.submit(self._reap, user_id, reason, seen)
+        except RuntimeError:
+            # Shutting down.
+            with self._lock:
+                self._reaping.discard(user_id)
+
+    def _reap(self, user_id: str, reason: str, seen: float) -> None:
+        try:
+            # A guest who came back since the sweep keeps the workspace.
+            if self.last_seen(user_id) > seen:
+                return
+            self._remove(user_id)
+            with self._lock:
+                self._last_seen.pop(user_id, None)
+            GUESTS_REAPED.inc(reason)
+            logger.info(f"Removed guest workspace {user_id} ({reason})")
+        except Exception as e:
+            logger.error(f"Could not remove guest workspace {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._reaping.discard(user_id)
+
+    def _purge_trash(self) -> None:
+        # Trees left behind by a removal that was interrupted.
+        trash = os.path.join(self.workspace_root, TRASH_DIRNAME)
+        try:
+            names = os.listdir(trash)
+        except FileNotFoundError:
+            return
+        for name in names:
+            self._pool.submit(
+                shutil.rmtree, os.path.join(trash, name), ignore_errors=True
+            )
+
+    def _run(self) -> None:
+        self._purge_trash()
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Guest workspace sweep failed: {e}")
+            if self._stopped.wait(self.interval):
+                return
+
+    def close(self) -> None:
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._scheduler.join()
+        self._pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union
+import requests  # type: ignore
+from requests.adapters import HTTPAdapter  # type: ignore
+from urllib3.util.retry import Retry  # type: ignore
+from authlib.integrations.flask_client import FlaskOAuth2App  # type: ignore
+from loguru import logger
+
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_SIZE = 32
+DEFAULT_METADATA_TTL = 3600.0
+DEFAULT_PROFILE_TTL = 60.0
+
+
+class TTLCache:
+    def __init__(self, ttl: float, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# The adapter owns the connection pool. authlib opens and closes a session
+# per call, so the shared adapter ignores close() and is only torn down by
+# shutdown().
+class SharedHTTPAdapter(HTTPAdapter):
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        super().close()
+
+
+class HTTPClient:
+    def __init__(
+        self,
+        timeout: Union[float, Tuple[float, float]] = (
+            DEFAULT_CONNECT_TIMEOUT,
+            DEFAULT_READ_TIMEOUT,
+        ),
+        retries: int = DEFAULT_RETRIES,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ) -> None:
+        self.timeout = timeout
+        # Only idempotent requests are retried; an authorization code must
+        # never be exchanged twice.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=0.2,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        self.adapter = SharedHTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.mount(self.session)
+
+    def mount(self, session: requests.Session) -> None:
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+        self.adapter.shutdown()
+
+
+def client_from_env() -> HTTPClient:
+    return HTTPClient(
+        timeout=(
+            float(
+                os.environ.get(
+                    "OAUTH_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT
+                )
+            ),
+            float(os.environ.get("OAUTH_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+        ),
+        retries=int(os.environ.get("OAUTH_HTTP_RETRIES", DEFAULT_RETRIES)),
+        pool_size=int(
+            os.environ.get("OAUTH_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+        ),
+    )
+
+
+# Provider documents (OIDC discovery, JWKS) cached in memory and, when
+# ``cache_dir`` is set, on disk so a restart does not refetch them. A stale
+# copy is served if the provider cannot be reached.
+class ProviderMetadataCache:
+    def __init__(
+        self,
+        http_client: HTTPClient,
+        ttl: float = DEFAULT_METADATA_TTL,
+        cache_dir: Optional[str] = None,
+    ) -> None:
+        self.http_client = http_client
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._documents: Dict[str, Tuple[float, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, url: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _read_disk(self, url: str) -> Optional[Tuple[float, Dict]]:
+        path = self._cache_path(url)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return os.path.getmtime(path), json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, url: str, document: Dict) -> None:
+        path = self._cache_path(url)
+        if path is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir, prefix=".write-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache provider metadata: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get(self, url: str, force: bool = False) -> Tuple[Dict, float]:
+        # Returns the document and the wall-clock time it was fetched.
+        with self._lock:
+            cached = self._documents.get(url)
+            if cached is None:
+                cached = self._read_disk(url)
+            if (
+                cached is not None
+                and not force
+                and time.time() - cached[0] < self.ttl
+            ):
+                self._documents[url] = cached
+                return cached[1], cached[0]
+            try:
+                resp = self.http_client.get(url)
+                resp.raise_for_status()
+                document = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                if cached is None:
+                    raise
+                logger.warning(f"Serving stale metadata for {url}: {e}")
+                return cached[1], cached[0]
+            fetched_at = time.time()
+            self._documents[url] = (fetched_at, document)
+            self._write_disk(url, document)
+            return document, fetched_at
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents.clear()
+
+
+def metadata_cache_from_env(http_client: HTTPClient) -> ProviderMetadataCache:
+    return ProviderMetadataCache(
+        http_client,
+        ttl=float(os.environ.get("OAUTH_METADATA_TTL", DEFAULT_METADATA_TTL)),
+        cache_dir=os.environ.get("OAUTH_CACHE_DIR") or None,
+    )
+
+
+def token_cache_key(provider: str, access_token: str) -> Tuple[str, str]:
+    # Tokens are never kept as cache keys in the clear.
+    return provider, hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+
+# An authlib client whose sessions share one connection pool, carry default
+# timeouts and read provider metadata through a ProviderMetadataCache.
+# Register with ``client_cls=PooledOAuth2App`` and call configure().
+class PooledOAuth2App(FlaskOAuth2App):
+    http_client: Optional[HTTPClient] = None
+    metadata_cache: Optional[ProviderMetadataCache] = None
+
+    def configure(
+        self,
+        http_client: HTTPClient,
+        metadata_cache: Optional[ProviderMetadataCache] = None,
+    ) -> None:
+        self.http_client = http_client
+        self.metadata_cache = metadata_cache
+
+    def _pooled(self, session):
+        if self.http_client is not None:
+            self.http_client.mount(session)
+            session.default_timeout = self.http_client.timeout
+        return session
+
+    def _get_session(self):
+        return self._pooled(super()._get_session())
+
+    def _get_oauth_client(self, **metadata):
+        return self._pooled(super()._get_oauth_client(**metadata))
+
+    def load_server_metadata(self):
+        if self._server_metadata_url is None or self.metadata_cache is None:
+            return super().load_server_metadata()
+        loaded_at = self.server_metadata.get("_loaded_at")
+        if (
+            loaded_at is None
+            or time.time() - loaded_at >= self.metadata_cache.ttl
+        ):
+            document, fetched_at = self.metadata_cache.get(
+                self._server_metadata_url
+            )
+            self.server_metadata.pop("jwks", None)
+            self.server_metadata.update(document)
+            self.server_metadata["_loaded_at"] = fetched_at
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False):
+        if self.metadata_cache is None:
+            return super().fetch_jwk_set(force=force)
+        metadata = self.load_server_metadata()
+        if metadata.get("jwks") and not force:
+            return metadata["jwks"]
+        uri = metadata.get("jwks_uri")
+        if not uri:
+            raise RuntimeError('Missing "jwks_uri" in metadata')
+        jwk_set, _ = self.metadata_cache.get(uri, force=force)
+        self.server_metadata["jwks"] = jwk_set
+        return jwk_set
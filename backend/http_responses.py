@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from flask import Flask, Response, request
+from werkzeug.http import http_date, parse_date
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/plain", "text/html")
+
+
+def _compress_gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=6)
+
+
+def _compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=5)
+
+
+def _compress_zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+# Ordered by preference when the client accepts several equally.
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _compress_zstd
+if brotli is not None:
+    COMPRESSORS["br"] = _compress_brotli
+COMPRESSORS["gzip"] = _compress_gzip
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b(
+        "|".join(str(part) for part in parts).encode("utf-8"), digest_size=12
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+def _strip_encoding_suffix(etag: str) -> str:
+    # Compressed representations carry the coding in their ETag
+    # ("<hash>-gzip"), but they still validate the same resource.
+    etag = etag.strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    for encoding in COMPRESSORS:
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[: -len(suffix)] + '"'
+    return etag
+
+
+def is_not_modified(etag: str, last_modified: Optional[float] = None) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        return any(
+            _strip_encoding_suffix(candidate) == etag
+            for candidate in if_none_match.split(",")
+        )
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if last_modified is not None and if_modified_since:
+        since = parse_date(if_modified_since)
+        if since is not None:
+            return int(last_modified) <= since.timestamp()
+    return False
+
+
+def conditional_response(
+    etag: str,
+    build: Callable[[], Response],
+    last_modified: Optional[float] = None,
+) -> Response:
+    if request.method in ("GET", "HEAD") and is_not_modified(
+        etag, last_modified
+    ):
+        response = Response(status=304)
+    else:
+        response = build()
+    response.headers["ETag"] = etag
+    if last_modified is not None:
+        response.headers["Last-Modified"] = http_date(
+            datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+        )
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates: List[str] = [
+        encoding
+        for encoding in COMPRESSORS
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    return max(
+        candidates,
+        key=lambda encoding: accepted.get(encoding, accepted.get("*", 0.0)),
+    )
+
+
+def init_compression(
+    app: Flask, min_size: int = DEFAULT_MIN_COMPRESS_SIZE
+) -> None:
+    @app.after_request
+    def compress_response(response: Response) -> Response:
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        if (response.content_length or 0) < min_size:
+            return response
+        encoding = negotiate_encoding(
+            request.headers.get("Accept-Encoding", "")
+        )
+        if encoding is None:
+            return response
+        response.set_data(COMPRESSORS[encoding](response.get_data()))
+        response.headers["Content-Encoding"] = encoding
+        etag = response.headers.get("ETag")
+        if etag and etag.endswith('"'):
+            response.headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+        return response
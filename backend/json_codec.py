@@ -0,0 +1,67 @@
+import os
+import json
+from typing import Any, Callable, Dict, Optional, Union
+from flask import Flask
+from flask.json.provider import JSONProvider, _default
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+class JSONCodec:
+    name = "json"
+
+    def dumps(self, obj: Any, default: Optional[Callable] = None) -> bytes:
+        return json.dumps(
+            obj, default=default, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def validate(self, data: Union[bytes, str]) -> None:
+        try:
+            self.loads(data)
+        except (ValueError, RecursionError) as e:
+            raise ValueError(f"Invalid JSON content: {e}")
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def dumps(self, obj: Any, default: Optional[Callable] = None) -> bytes:
+        return orjson.dumps(
+            obj, default=default, option=orjson.OPT_NON_STR_KEYS
+        )
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+
+CODECS: Dict[str, JSONCodec] = {"json": JSONCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+
+
+def get_codec(name: Optional[str] = None) -> JSONCodec:
+    # Defaults to the fastest available codec; JSON_CODEC pins one.
+    name = name or os.environ.get("JSON_CODEC")
+    if not name:
+        return CODECS.get("orjson", CODECS["json"])
+    if name not in CODECS:
+        raise ValueError(f"JSON codec {name!r} is not available")
+    return CODECS[name]
+
+
+class CodecJSONProvider(JSONProvider):
+    def __init__(self, app: Flask, codec: Optional[JSONCodec] = None) -> None:
+        super().__init__(app)
+        self.codec = codec or get_codec()
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self.codec.dumps(obj, default=_default).decode("utf-8")
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return self.codec.loads(s)
@@ -0,0 +1,158 @@
+import re
+import codecs
+from typing import List
+
+
+class JSONValidationError(ValueError):
+    pass
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRING_BODY = re.compile(
+    r'(?:[^"\\\x00-\x1f]+|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*'
+)
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?")
+_NUMBER_CHARS = re.compile(r"[-+0-9.eE]*")
+_LITERAL_CHARS = re.compile(r"[a-z]*")
+_LITERALS = ("true", "false", "null")
+
+# Parser states: what the next significant character has to be.
+_VALUE = 0
+_VALUE_OR_END = 1  # first element of an array, or "]"
+_KEY = 2
+_KEY_OR_END = 3  # first key of an object, or "}"
+_COLON = 4
+_COMMA_OR_END = 5
+_DONE = 6
+
+
+# Checks that a byte stream is one well-formed JSON document without building
+# it. Only the unconsumed tail of the current chunk is kept, so memory stays
+# bounded by nesting depth rather than document size.
+class IncrementalJSONValidator:
+    def __init__(self, max_depth: int = 1000) -> None:
+        self.max_depth = max_depth
+        self.is_empty = True
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._stack: List[str] = []
+        self._state = _VALUE
+        self._in_string = False
+        self._string_is_key = False
+
+    def feed(self, chunk: bytes) -> None:
+        try:
+            text = self._decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise JSONValidationError("Invalid JSON content: not UTF-8")
+        self._consume(self._buffer + text, final=False)
+
+    def close(self) -> None:
+        try:
+            text = self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise JSONValidationError("Invalid JSON content: not UTF-8")
+        self._consume(self._buffer + text, final=True)
+        if self.is_empty:
+            return
+        if self._in_string or self._state != _DONE:
+            raise JSONValidationError(
+                "Invalid JSON content: unexpected end of document"
+            )
+
+    def _fail(self, message: str) -> None:
+        raise JSONValidationError(f"Invalid JSON content: {message}")
+
+    def _end_value(self) -> None:
+        self._state = _COMMA_OR_END if self._stack else _DONE
+
+    def _open(self, container: str) -> None:
+        if len(self._stack) >= self.max_depth:
+            self._fail("nesting too deep")
+        self._stack.append(container)
+        self._state = _KEY_OR_END if container == "{" else _VALUE_OR_END
+
+    def _consume(self, buffer: str, final: bool) -> None:
+        pos = 0
+        end = len(buffer)
+        while True:
+            if self._in_string:
+                pos = _STRING_BODY.match(buffer, pos).end()
+                if pos == end:
+                    break
+                char = buffer[pos]
+                if char == '"':
+                    pos += 1
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._state = _COLON
+                    else:
+                        self._end_value()
+                    continue
+                if char == "\\" and not final and end - pos < 6:
+                    # Escape sequence split across chunks.
+                    break
+                self._fail("invalid string")
+
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == end:
+                break
+            char = buffer[pos]
+            state = self._state
+            self.is_empty = False
+
+            if state == _DONE:
+                self._fail("extra data after document")
+            elif state == _COLON:
+                if char != ":":
+                    self._fail("expected ':'")
+                self._state = _VALUE
+                pos += 1
+            elif state == _COMMA_OR_END:
+                container = self._stack[-1]
+                if char == ",":
+                    self._state = _KEY if container == "{" else _VALUE
+                elif char == ("}" if container == "{" else "]"):
+                    self._stack.pop()
+                    self._end_value()
+                else:
+                    self._fail("expected ',' or end of container")
+                pos += 1
+            elif state in (_KEY, _KEY_OR_END):
+                if char == '"':
+                    self._in_string = True
+                    self._string_is_key = True
+                elif char == "}" and state == _KEY_OR_END:
+                    self._stack.pop()
+                    self._end_value()
+                else:
+                    self._fail("expected object key")
+                pos += 1
+            elif char == "]" and state == _VALUE_OR_END:
+                self._stack.pop()
+                self._end_value()
+                pos += 1
+            elif char in "{[":
+                self._open(char)
+                pos += 1
+            elif char == '"':
+                self._in_string = True
+                self._string_is_key = False
+                pos += 1
+            elif char == "-" or char.isdigit():
+                token_end = _NUMBER_CHARS.match(buffer, pos).end()
+                if token_end == end and not final:
+                    break
+                if not _NUMBER.fullmatch(buffer, pos, token_end):
+                    self._fail("invalid number")
+                self._end_value()
+                pos = token_end
+            else:
+                token_end = _LITERAL_CHARS.match(buffer, pos).end()
+                if token_end == end and not final and end - pos < 5:
+                    break
+                if buffer[pos:token_end] not in _LITERALS:
+                    self._fail("unexpected character")
+                self._end_value()
+                pos = token_end
+        self._buffer = buffer[pos:]
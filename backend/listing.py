@@ -0,0 +1,138 @@
+import json
+import base64
+import binascii
+from bisect import bisect_left, bisect_right, insort
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+
+if TYPE_CHECKING:
+    from storage import FlowEntry
+
+
+SORT_KEYS = ("name", "last_edit")
+MAX_PAGE_SIZE = 500
+
+
+def display_name(filename: str) -> str:
+    return filename.split(".")[0]
+
+
+def sort_key(entry: "FlowEntry", sort: str) -> Tuple[str, ...]:
+    if sort == "last_edit":
+        return (entry.last_edit or "", entry.filename)
+    return (entry.filename,)
+
+
+def encode_cursor(sort: str, key: Tuple[str, ...]) -> str:
+    raw = json.dumps([sort, *key]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[str, ...]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or not values or values[0] != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+    if not all(isinstance(value, str) for value in values[1:]):
+        raise ValueError("Invalid cursor")
+    return tuple(values[1:])
+
+
+def matches(
+    entry: "FlowEntry", prefix: Optional[str], query: Optional[str]
+) -> bool:
+    name = display_name(entry.filename)
+    if prefix and not name.startswith(prefix):
+        return False
+    return not query or query.lower() in name.lower()
+
+
+# A user's flows kept sorted both by name and by last edit, so a page is a
+# bisect plus ``limit`` steps instead of a directory scan and a full sort.
+class SortedListing:
+    def __init__(self, entries: Iterable["FlowEntry"], stamp: int) -> None:
+        # ``stamp`` is the directory mtime the listing was built against.
+        self.stamp = stamp
+        self.entries: Dict[str, "FlowEntry"] = {}
+        self._keys: Dict[str, List[Tuple[str, ...]]] = {
+            sort: [] for sort in SORT_KEYS
+        }
+        for entry in entries:
+            self.entries[entry.filename] = entry
+        for sort, keys in self._keys.items():
+            keys.extend(
+                sorted(sort_key(e, sort) for e in self.entries.values())
+            )
+
+    def put(self, entry: "FlowEntry") -> None:
+        self.remove(entry.filename)
+        self.entries[entry.filename] = entry
+        for sort, keys in self._keys.items():
+            insort(keys, sort_key(entry, sort))
+
+    def remove(self, filename: str) -> None:
+        entry = self.entries.pop(filename, None)
+        if entry is None:
+            return
+        for sort, keys in self._keys.items():
+            key = sort_key(entry, sort)
+            index = bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+
+    def page(
+        self,
+        sort: str,
+        descending: bool,
+        after: Optional[Tuple[str, ...]],
+        limit: Optional[int],
+        prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List["FlowEntry"], Optional[Tuple[str, ...]]]:
+        keys = self._keys[sort]
+        # Name-sorted listings can jump straight to the prefix range.
+        bounded = sort == "name" and prefix
+        if descending:
+            if after is not None:
+                index = bisect_left(keys, after) - 1
+            elif bounded:
+                index = bisect_left(keys, (prefix + "\U0010ffff",)) - 1
+            else:
+                index = len(keys) - 1
+            step = -1
+        else:
+            if after is not None:
+                index = bisect_right(keys, after)
+            elif bounded:
+                index = bisect_left(keys, (prefix,))
+            else:
+                index = 0
+            step = 1
+        result: List["FlowEntry"] = []
+        while 0 <= index < len(keys):
+            key = keys[index]
+            entry = self.entries[key[-1]]
+            if matches(entry, prefix, query):
+                if limit is not None and len(result) == limit:
+                    return result, sort_key(result[-1], sort)
+                result.append(entry)
+            elif bounded and not key[0].startswith(prefix):
+                break
+            index += step
+        return result, None
+
+
+def page_entries(
+    entries: Iterable["FlowEntry"],
+    sort: str,
+    descending: bool,
+    after: Optional[Tuple[str, ...]],
+    limit: Optional[int],
+    prefix: Optional[str] = None,
+    query: Optional[str] = None,
+) -> Tuple[List["FlowEntry"], Optional[Tuple[str, ...]]]:
+    return SortedListing(entries, 0).page(
+        sort, descending, after, limit, prefix, query
+    )
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import random
+import threading
+from typing import Any, Dict, Optional
+from flask import Flask, Response, g, has_request_context, request, session
+from loguru import logger
+
+DEFAULT_LEVEL = "INFO"
+DEFAULT_RATE_LIMIT = 50.0
+DEFAULT_MAX_FIELD_CHARS = 200
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+    "<level>{level: <8}</level> | "
+    "{extra[endpoint]} {extra[user]} | "
+    "<level>{message}</level>"
+)
+
+
+def summarize(value: Any, limit: int = DEFAULT_MAX_FIELD_CHARS) -> str:
+    # A short description of ``value`` for log lines: containers are
+    # described by size, long strings and bytes are truncated.
+    if isinstance(value, dict):
+        keys = ", ".join(str(key) for key in list(value)[:10])
+        more = ", ..." if len(value) > 10 else ""
+        return f"<dict with {len(value)} keys: {keys}{more}>"
+    if isinstance(value, (list, tuple, set)):
+        return f"<{type(value).__name__} of {len(value)} items>"
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    text = str(value)
+    if len(text) > limit:
+        return f"{text[:limit]}... ({len(text)} chars)"
+    return text
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    # "read_file=0.1,list_files=0.01" -> {"read_file": 0.1, ...}
+    rates = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        endpoint, _, rate = item.partition("=")
+        try:
+            rates[endpoint.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            raise ValueError(f"Invalid LOG_SAMPLE_RATES entry: {item!r}")
+    return rates
+
+
+# Decides, before any formatting, whether an INFO-or-lower line is kept:
+# first by the endpoint's sample rate, then by a per-endpoint token bucket.
+# Warnings and errors always pass. The number of lines dropped by the rate
+# limit is attached to the next kept line. Loguru runs filters in the
+# thread that logs, even with ``enqueue``, so request threads call this
+# concurrently: the sampling draw and the buckets are only touched under
+# the lock, and the rates are copied so callers cannot change them midway.
+class LogSampler:
+    def __init__(
+        self,
+        sample_rates: Optional[Dict[str, float]] = None,
+        rate_limit: float = DEFAULT_RATE_LIMIT,
+    ) -> None:
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limit = rate_limit
+        self._buckets: Dict[str, list] = {}
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def __call__(self, record: Dict) -> bool:
+        if record["level"].no >= 30:
+            return True
+        endpoint = record["extra"].get("endpoint", "-")
+        rate = self.sample_rates.get(endpoint, 1.0)
+        if rate <= 0:
+            return False
+        if rate >= 1.0 and self.rate_limit <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if rate < 1.0 and self._random.random() >= rate:
+                return False
+            if self.rate_limit <= 0:
+                return True
+            bucket = self._buckets.get(endpoint)
+            if bucket is None:
+                # [tokens, last refill, dropped]
+                bucket = [self.rate_limit, now, 0]
+                self._buckets[endpoint] = bucket
+            bucket[0] = min(
+                self.rate_limit,
+                bucket[0] + (now - bucket[1]) * self.rate_limit,
+            )
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record["extra"]["suppressed"] = dropped
+        return True
+
+
+def _add_request_context(record: Dict) -> None:
+    extra = record["extra"]
+    if has_request_context():
+        extra.setdefault("endpoint", request.endpoint or "-")
+        extra.setdefault("user", session.get("user_id") or "-")
+    else:
+        extra.setdefault("endpoint", "-")
+        extra.setdefault("user", "-")
+
+
+def configure_logging() -> LogSampler:
+    # LOG_LEVEL, LOG_FORMAT (text or json), LOG_FILE, LOG_ENQUEUE,
+    # LOG_SAMPLE_RATES and LOG_RATE_LIMIT (INFO lines/s per endpoint).
+    level = os.environ.get("LOG_LEVEL", DEFAULT_LEVEL).upper()
+    serialize = os.environ.get("LOG_FORMAT", "text").lower() == "json"
+    enqueue = os.environ.get("LOG_ENQUEUE", "1").lower() not in (
+        "0",
+        "false",
+        "no",
+    )
+    sampler = LogSampler(
+        parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")),
+        float(os.environ.get("LOG_RATE_LIMIT", DEFAULT_RATE_LIMIT)),
+    )
+    sink = os.environ.get("LOG_FILE") or sys.stderr
+    logger.remove()
+    logger.configure(patcher=_add_request_context)
+    # With enqueue the sink is written by loguru's worker thread, so request
+    # threads only filter, format and hand the line off.
+    logger.add(
+        sink,
+        level=level,
+        format=TEXT_FORMAT,
+        serialize=serialize,
+        enqueue=enqueue,
+        filter=sampler,
+        backtrace=False,
+        diagnose=False,
+    )
+    return sampler
+
+
+def init_request_logging(app: Flask) -> None:
+    # One structured access line per request: endpoint, user, status,
+    # duration and response size. 5xx responses are logged as errors.
+    @app.before_request
+    def start_request_log():
+        g.log_start = time.perf_counter()
+
+    @app.after_request
+    def log_request(response: Response) -> Response:
+        start = g.pop("log_start", None)
+        if start is None:
+            return response
+        duration_ms = round((time.perf_counter() - start) * 1000, 2)
+        level = "ERROR" if response.status_code >= 500 else "INFO"
+        logger.bind(
+            method=request.method,
+            status=response.status_code,
+            duration_ms=duration_ms,
+            # The header, not calculate_content_length(), which would
+            # buffer a streamed body (exports, the change feed) to count it.
+            bytes=response.content_length,
+        ).log(
+            level,
+            f"{request.method} {request.path} {response.status_code} "
+            f"{duration_ms}ms",
+        )
+        return response
@@ -0,0 +1,173 @@
+import os
+import argparse
+from dotenv import load_dotenv
+from loguru import logger
+from storage import FilesystemStorage, FileExistsError, create_storage
+from file_manager import FileManager
+from flow_encoding import ENCODINGS
+from search_index import SearchIndex, SEARCH_DIRNAME
+
+
+def migrate_sqlite(args: argparse.Namespace) -> None:
+    from sqlite_storage import SQLiteStorage
+
+    db_path = args.db or os.path.join(args.workspace_root, "workstation.db")
+    source = FilesystemStorage(args.workspace_root)
+    target = SQLiteStorage(db_path, args.workspace_root)
+    imported = skipped = 0
+    try:
+        for user_id in source.list_users():
+            for entry in source.list_entries(user_id):
+                try:
+                    target.import_flow(
+                        user_id,
+                        entry.filename,
+                        os.path.join(
+                            args.workspace_root, user_id, entry.filename
+                        ),
+                        version=max(entry.version, 1),
+                        last_edit=entry.last_edit,
+                    )
+                    imported += 1
+                except FileExistsError:
+                    skipped += 1
+    finally:
+        source.close()
+        target.close()
+    logger.info(
+        f"Imported {imported} flows into {db_path} "
+        f"({skipped} already present)"
+    )
+
+
+def recompress(args: argparse.Namespace) -> None:
+    storage = create_storage(
+        args.backend, args.workspace_root, sqlite_path=args.db
+    )
+    file_manager = FileManager(
+        args.workspace_root, storage=storage, storage_encoding=args.encoding
+    )
+    totals = dict.fromkeys(["rewritten", "unchanged", "busy"], 0)
+    before = after = 0
+    try:
+        users = args.user or storage.list_users()
+        for user_id in users:
+            stats = file_manager.recompress(user_id)
+            for key in totals:
+                totals[key] += stats[key]
+            before += stats["bytes_before"]
+            after += stats["bytes_after"]
+            logger.info(
+                f"{user_id}: {stats['rewritten']} rewritten, "
+                f"{stats['busy']} changed while running"
+            )
+    finally:
+        file_manager.close()
+    logger.info(
+        f"Re-encoded {totals['rewritten']} flows as "
+        f"{file_manager.storage_encoding}, left {totals['unchanged']} as they "
+        f"were and skipped {totals['busy']}; {before} -> {after} bytes"
+    )
+
+
+def rebuild_search_index(args: argparse.Namespace) -> None:
+    storage = create_storage(
+        args.backend, args.workspace_root, sqlite_path=args.db
+    )
+    search_index = SearchIndex(
+        os.path.join(args.workspace_root, SEARCH_DIRNAME)
+    )
+    file_manager = FileManager(
+        args.workspace_root, storage=storage, search_index=search_index
+    )
+    total = 0
+    try:
+        for user_id in args.user or storage.list_users():
+            indexed = search_index.rebuild(user_id)
+            total += indexed
+            logger.info(f"{user_id}: indexed {indexed} flows")
+    finally:
+        file_manager.close()
+    logger.info(f"Rebuilt the search index over {total} flows")
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Workstation maintenance")
+    parser.add_argument(
+        "--workspace-root",
+        default=os.environ.get("WORKSPACE_ROOT"),
+        help="defaults to $WORKSPACE_ROOT",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser(
+        "migrate-sqlite",
+        help="import the user_workspaces/ tree into the SQLite backend",
+    )
+    migrate.add_argument(
+        "--db",
+        default=os.environ.get("SQLITE_PATH"),
+        help="defaults to $SQLITE_PATH or <workspace root>/workstation.db",
+    )
+    migrate.set_defaults(handler=migrate_sqlite)
+
+    recompress_parser = commands.add_parser(
+        "recompress",
+        help="re-encode stored flows, e.g. after changing "
+        "FLOW_STORAGE_ENCODING; versions are kept",
+    )
+    recompress_parser.add_argument(
+        "--encoding",
+        choices=ENCODINGS,
+        default=os.environ.get("FLOW_STORAGE_ENCODING") or "json",
+        help="defaults to $FLOW_STORAGE_ENCODING",
+    )
+    recompress_parser.add_argument(
+        "--backend",
+        choices=["filesystem", "sqlite"],
+        default=os.environ.get("STORAGE_BACKEND", "filesystem"),
+        help="defaults to $STORAGE_BACKEND",
+    )
+    recompress_parser.add_argument(
+        "--db",
+        default=os.environ.get("SQLITE_PATH"),
+        help="SQLite database, for --backend sqlite",
+    )
+    recompress_parser.add_argument(
+        "--user",
+        action="append",
+        help="only this user's workspace (repeatable)",
+    )
+    recompress_parser.set_defaults(handler=recompress)
+
+    rebuild_parser = commands.add_parser(
+        "rebuild-search-index",
+        help="index the contents of existing flows for /api/search",
+    )
+    rebuild_parser.add_argument(
+        "--backend",
+        choices=["filesystem", "sqlite"],
+        default=os.environ.get("STORAGE_BACKEND", "filesystem"),
+        help="defaults to $STORAGE_BACKEND",
+    )
+    rebuild_parser.add_argument(
+        "--db",
+        default=os.environ.get("SQLITE_PATH"),
+        help="SQLite database, for --backend sqlite",
+    )
+    rebuild_parser.add_argument(
+        "--user",
+        action="append",
+        help="only this user's workspace (repeatable)",
+    )
+    rebuild_parser.set_defaults(handler=rebuild_search_index)
+
+    args = parser.parse_args()
+    if not args.workspace_root:
+        parser.error("--workspace-root or WORKSPACE_ROOT is required")
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
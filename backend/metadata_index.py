@@ -0,0 +1,204 @@
+import os
+import json
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Set
+from loguru import logger
+from metrics import timed
+
+METADATA_FILENAME = "metadata.json"
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+
+# metadata.json maps each flow file to {"last_edit": <iso time>, "version": n}.
+# Older workspaces stored only the timestamp string; those entries are read
+# as version 1.
+def _normalize_entry(entry: Any) -> Dict[str, Any]:
+    if isinstance(entry, str):
+        return {"last_edit": entry, "version": 1}
+    return entry
+
+
+# Keeps each user's metadata.json in memory. Mutations only mark the user
+# dirty; a background thread writes dirty users back (atomically) at most
+# ``flush_interval`` seconds later, and ``close`` flushes whatever is left.
+class MetadataIndex:
+    def __init__(
+        self,
+        workspace_root: str,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        fsync: bool = False,
+        on_write: Optional[Callable[[str, int], None]] = None,
+    ) -> None:
+        self.workspace_root = workspace_root
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        # Called with the user and the workspace directory's mtime from
+        # before each metadata.json write, which moves it.
+        self.on_write = on_write
+        self._entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._dirty: Set[str] = set()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._pending = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._run, name="metadata-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def get_metadata_path(self, user_id: str) -> str:
+        return os.path.join(self.workspace_root, user_id, METADATA_FILENAME)
+
+    def _load(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        entries = self._entries.get(user_id)
+        if entries is None:
+            entries = self._read(user_id)
+            self._entries[user_id] = entries
+        return entries
+
+    @timed("metadata_load")
+    def _read(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        metadata_path = self.get_metadata_path(user_id)
+        if not os.path.exists(metadata_path):
+            return {}
+        try:
+            with open(metadata_path, "r") as f:
+                return {
+                    filename: _normalize_entry(entry)
+                    for filename, entry in json.load(f).items()
+                }
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load {metadata_path}: {e}")
+            return {}
+
+    def _mark_dirty(self, user_id: str) -> None:
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        self._dirty.add(user_id)
+        self._pending.set()
+
+    def generation(self, user_id: str) -> int:
+        # Changes whenever the user's metadata does; cheap cache validator.
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get_all(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                filename: dict(entry)
+                for filename, entry in self._load(user_id).items()
+            }
+
+    def get(self, user_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._load(user_id).get(filename)
+            return dict(entry) if entry is not None else None
+
+    def get_version(self, user_id: str, filename: str) -> int:
+        with self._lock:
+            entry = self._load(user_id).get(filename)
+            return entry["version"] if entry is not None else 0
+
+    def touch(
+        self, user_id: str, filename: str, when: Optional[datetime] = None
+    ) -> None:
+        timestamp = (when or datetime.now()).isoformat()
+        with self._lock:
+            entry = self._load(user_id).setdefault(filename, {"version": 0})
+            entry["last_edit"] = timestamp
+            self._mark_dirty(user_id)
+
+    def bump_version(
+        self,
+        user_id: str,
+        filename: str,
+        when: Optional[datetime] = None,
+        version: Optional[int] = None,
+    ) -> int:
+        # Moves to ``version`` when given, to the next version otherwise.
+        timestamp = (when or datetime.now()).isoformat()
+        with self._lock:
+            entry = self._load(user_id).setdefault(filename, {"version": 0})
+            entry["last_edit"] = timestamp
+            entry["version"] = (
+                entry["version"] + 1 if version is None else version
+            )
+            self._mark_dirty(user_id)
+            return entry["version"]
+
+    def remove(self, user_id: str, filename: str) -> None:
+        with self._lock:
+            if self._load(user_id).pop(filename, None) is not None:
+                self._mark_dirty(user_id)
+
+    def forget(self, user_id: str) -> None:
+        # Drops a user whose workspace is going away. Taking the flush lock
+        # keeps an in-flight flush from writing metadata.json back into it.
+        with self._flush_lock:
+            with self._lock:
+                self._entries.pop(user_id, None)
+                self._dirty.discard(user_id)
+                self._generations[user_id] = (
+                    self._generations.get(user_id, 0) + 1
+                )
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                self._pending.clear()
+                snapshots = {
+                    user_id: {
+                        filename: dict(entry)
+                        for filename, entry in self._entries[user_id].items()
+                    }
+                    for user_id in dirty
+                }
+            for user_id, entries in snapshots.items():
+                try:
+                    self._write(user_id, entries)
+                except OSError as e:
+                    logger.error(
+                        f"Could not flush metadata for {user_id}: {e}"
+                    )
+                    with self._lock:
+                        self._mark_dirty(user_id)
+
+    @timed("metadata_save")
+    def _write(self, user_id: str, entries: Dict[str, Dict[str, Any]]) -> None:
+        metadata_path = self.get_metadata_path(user_id)
+        directory = os.path.dirname(metadata_path)
+        os.makedirs(directory, exist_ok=True)
+        before = os.stat(directory).st_mtime_ns
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, prefix=".metadata-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, metadata_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if self.on_write is not None:
+            self.on_write(user_id, before)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._pending.wait()
+            # Give a burst of mutations a chance to land in the same write.
+            self._stopped.wait(self.flush_interval)
+            self.flush()
+
+    def close(self) -> None:
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._pending.set()
+        self._flusher.join()
+        self.flush()
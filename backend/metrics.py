@@ -0,0 +1,431 @@
+import os
+import sys
+import hmac
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from flask import Flask, Response, g, request
+from loguru import logger
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+PROFILE_HEADER = "X-Profile"
+DEFAULT_PROFILE_INTERVAL = 0.005
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _check(self, labels: Tuple[str, ...]) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {labels}"
+            )
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            (self.name, _format_labels(self.labelnames, labels), value)
+            for labels, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        # An unlabelled gauge may be read from ``function`` at scrape time.
+        self.function = function
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.function is not None:
+            return [(self.name, "", self.function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        self._check(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[labels] = state
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = sorted(
+                (labels, (list(state[0]), state[1]))
+                for labels, state in self._values.items()
+            )
+        result = []
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                result.append(
+                    (
+                        f"{self.name}_bucket",
+                        _format_labels(
+                            names, labels + (_format_value(bound),)
+                        ),
+                        cumulative,
+                    )
+                )
+            plain = _format_labels(self.labelnames, labels)
+            result.append((f"{self.name}_sum", plain, total))
+            result.append((f"{self.name}_count", plain, cumulative))
+        return result
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(
+        self, name: str, help: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+    ) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, function))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+PROCESS_START = time.time()
+REGISTRY.gauge(
+    "process_start_time_seconds",
+    "Start time of the process since the epoch in seconds.",
+    function=lambda: PROCESS_START,
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "workstation_http_request_duration_seconds",
+    "Time spent handling a request, by route.",
+    ("method", "route"),
+)
+REQUESTS_TOTAL = REGISTRY.counter(
+    "workstation_http_requests_total",
+    "Requests handled, by route and status code.",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "workstation_http_requests_in_flight",
+    "Requests currently being handled.",
+)
+FILE_OPERATION_SECONDS = REGISTRY.histogram(
+    "workstation_file_operation_duration_seconds",
+    "Time spent in file manager and storage operations.",
+    ("operation",),
+)
+FILE_OPERATION_BYTES = REGISTRY.counter(
+    "workstation_file_operation_bytes_total",
+    "Flow payload bytes read or written, by operation.",
+    ("operation",),
+)
+FILE_OPERATION_ERRORS = REGISTRY.counter(
+    "workstation_file_operation_errors_total",
+    "File operations that raised, by operation and exception type.",
+    ("operation", "error"),
+)
+
+
+@contextmanager
+def timer(operation: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        FILE_OPERATION_ERRORS.inc(operation, type(e).__name__)
+        raise
+    finally:
+        FILE_OPERATION_SECONDS.observe(time.perf_counter() - start, operation)
+
+
+def timed(operation: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(operation):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_bytes(operation: str, size: int) -> None:
+    FILE_OPERATION_BYTES.inc(operation, amount=size)
+
+
+# Samples one thread's stack at a fixed interval and counts the folded
+# stacks ("outer;inner;leaf count" lines, as flamegraph.pl reads them).
+class SamplingProfiler:
+    def __init__(
+        self, thread_id: int, interval: float = DEFAULT_PROFILE_INTERVAL
+    ) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: StackCounter = StackCounter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                )
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+def _route() -> str:
+    # The URL rule, not the path, so label cardinality stays bounded.
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def _finish_profile(profile_dir: str) -> Optional[str]:
+    profiler = g.pop("metrics_profiler", None)
+    if profiler is None:
+        return None
+    profiler.stop()
+    profile_id = f"{int(time.time() * 1000)}-{threading.get_ident()}"
+    path = os.path.join(profile_dir, f"{profile_id}.folded")
+    try:
+        with open(path, "w") as f:
+            f.write(f"# {request.method} {request.full_path.rstrip('?')}\n")
+            f.write(profiler.folded())
+    except OSError as e:
+        logger.error(f"Could not write profile {path}: {e}")
+        return None
+    return profile_id
+
+
+def _profile_requested(token: str) -> bool:
+    # Profiling costs the server a sampling thread and a file per request,
+    # so only holders of the token may ask for it.
+    if request.headers.get(PROFILE_HEADER) != "1":
+        return False
+    return hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(),
+        f"Bearer {token}".encode(),
+    )
+
+
+def init_metrics(
+    app: Flask,
+    profile_dir: Optional[str] = None,
+    profile_token: Optional[str] = None,
+) -> None:
+    # Request latency, status and in-flight metrics. With ``profile_dir``
+    # and ``profile_token`` set, a request carrying "X-Profile: 1" and
+    # "Authorization: Bearer <profile_token>" is sampled and its folded
+    # stacks are written there; the file name is returned in X-Profile-Id.
+    if profile_dir and not profile_token:
+        logger.warning("Profiling is off: it needs a token to be set")
+        profile_dir = None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        if profile_dir and _profile_requested(profile_token):
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+            g.metrics_profiler = profiler
+
+    @app.after_request
+    def record_response_metrics(response: Response) -> Response:
+        g.metrics_status = response.status_code
+        if profile_dir:
+            profile_id = _finish_profile(profile_dir)
+            if profile_id:
+                response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc=None):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        if profile_dir:
+            _finish_profile(profile_dir)
+        REQUESTS_IN_FLIGHT.dec()
+        route = _route()
+        # Streamed bodies are timed up to the point the view returned.
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start, request.method, route
+        )
+        REQUESTS_TOTAL.inc(
+            request.method, route, str(g.pop("metrics_status", 500))
+        )
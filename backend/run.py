@@ -1,15 +1,60 @@
 # type: ignore
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, Response, g, request, session, jsonify, redirect
 from flask_cors import CORS
 from dotenv import load_dotenv
 from loguru import logger
-from file_manager import FileManager, FileExistsError
+from file_manager import (
+    FileManager,
+    create_storage,
+    FileExistsError,
+    FileTooLargeError,
+    VersionConflictError,
+    Quota,
+    QuotaExceededError,
+)
+from flow_patch import PatchError
+from flow_cache import FlowCache
+from flow_history import FlowHistory, HISTORY_DIRNAME
+from search_index import SearchIndex, SEARCH_DIRNAME, DEFAULT_LIMIT
+from guest_workspaces import GuestReaper, is_guest_id
+from change_feed import ChangeFeed, TooManyConnectionsError, stream_events
+from spatial_index import GridCache, MAX_VIEWPORT_NODES, parse_box
+from admission import (
+    ConcurrencyLimiter,
+    OverloadedError,
+    RateLimiter,
+    RateLimitedError,
+    WRITE_METHODS,
+    retry_after_header,
+)
+from archive import ArchiveError
+from json_codec import CodecJSONProvider, get_codec
+from http_responses import (
+    conditional_response,
+    init_compression,
+    make_etag,
+)
 from user_manager import UserManager, OAuthConfigError
-from datetime import timedelta
+from metrics import REGISTRY, CONTENT_TYPE, init_metrics
+from log_config import configure_logging, init_request_logging, summarize
+from werkzeug.exceptions import RequestEntityTooLarge
+from datetime import datetime, timedelta
+import atexit
+import hmac
 import os
 
 load_dotenv()
+configure_logging()
 app = Flask(__name__)
+json_codec = get_codec()
+app.json = CodecJSONProvider(app, json_codec)
+metrics_token = os.environ.get("METRICS_TOKEN")
+init_metrics(
+    app,
+    profile_dir=os.environ.get("METRICS_PROFILE_DIR"),
+    profile_token=os.environ.get("METRICS_PROFILE_TOKEN") or metrics_token,
+)
+init_request_logging(app)
 CORS(
     app,
     resources={
@@ -28,19 +73,245 @@ app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=7)
 
 app.secret_key = os.environ.get("WORKSTATION_SECRET_KEY")
 workspace_root = os.environ.get("WORKSPACE_ROOT")
+max_upload_size = int(os.environ.get("MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+max_import_size = int(os.environ.get("MAX_IMPORT_BYTES", 256 * 1024 * 1024))
+# Bodies are read as they arrive, so this also stops a chunked upload, which
+# has no Content-Length to check up front, once it grows past the limit.
+# Imports raise it for their own request.
+app.config["MAX_CONTENT_LENGTH"] = max_upload_size
 
-file_manager = FileManager(workspace_root)
+storage = create_storage(
+    os.environ.get("STORAGE_BACKEND", "filesystem"),
+    workspace_root,
+    metadata_flush_interval=float(
+        os.environ.get("METADATA_FLUSH_INTERVAL", "2.0")
+    ),
+    sqlite_path=os.environ.get("SQLITE_PATH"),
+    fsync=os.environ.get("STORAGE_FSYNC", "").lower() in ("1", "true", "yes"),
+    coalesce_window=float(os.environ.get("WRITE_COALESCE_WINDOW", "0")),
+)
+flow_cache_bytes = int(os.environ.get("FLOW_CACHE_BYTES", 64 * 1024 * 1024))
+grid_cache_bytes = int(os.environ.get("SPATIAL_CACHE_BYTES", 32 * 1024 * 1024))
+history = None
+if os.environ.get("HISTORY_ENABLED", "1").lower() not in ("0", "false", "no"):
+    history = FlowHistory(
+        os.environ.get("HISTORY_DIR")
+        or os.path.join(workspace_root, HISTORY_DIRNAME),
+        codec=json_codec,
+        keep_versions=int(os.environ.get("HISTORY_KEEP_VERSIONS", "100")),
+        max_age=timedelta(
+            days=float(os.environ.get("HISTORY_MAX_AGE_DAYS", "90"))
+        ),
+        gc_interval=float(os.environ.get("HISTORY_GC_INTERVAL", "3600")),
+        max_queued_bytes=int(
+            os.environ.get("HISTORY_QUEUE_BYTES", 64 * 1024 * 1024)
+        ),
+    )
+search_index = None
+if os.environ.get("SEARCH_ENABLED", "1").lower() not in ("0", "false", "no"):
+    search_index = SearchIndex(
+        os.path.join(workspace_root, SEARCH_DIRNAME),
+        codec=json_codec,
+        flush_interval=float(os.environ.get("SEARCH_FLUSH_INTERVAL", "30")),
+    )
+change_feed = None
+if os.environ.get("EVENTS_ENABLED", "1").lower() not in ("0", "false", "no"):
+    change_feed = ChangeFeed(
+        max_connections=int(os.environ.get("EVENTS_MAX_CONNECTIONS", "16")),
+        max_user_connections=int(
+            os.environ.get("EVENTS_MAX_USER_CONNECTIONS", "4")
+        ),
+        buffer_size=int(os.environ.get("EVENTS_BUFFER_SIZE", "256")),
+        backlog=int(os.environ.get("EVENTS_BACKLOG", "256")),
+    )
+events_heartbeat = float(os.environ.get("EVENTS_HEARTBEAT", "15"))
+events_stream_seconds = float(os.environ.get("EVENTS_STREAM_SECONDS", "300"))
+events_poll_timeout = float(os.environ.get("EVENTS_POLL_TIMEOUT", "25"))
+file_manager = FileManager(
+    workspace_root,
+    max_upload_size=max_upload_size,
+    codec=json_codec,
+    storage=storage,
+    cache=FlowCache(flow_cache_bytes) if flow_cache_bytes > 0 else None,
+    history=history,
+    search_index=search_index,
+    quota=Quota(
+        int(os.environ.get("WORKSPACE_QUOTA_BYTES", "0")),
+        int(os.environ.get("WORKSPACE_QUOTA_FILES", "0")),
+    ),
+    guest_quota=Quota(
+        int(os.environ.get("GUEST_QUOTA_BYTES", 50 * 1024 * 1024)),
+        int(os.environ.get("GUEST_QUOTA_FILES", "200")),
+    ),
+    change_feed=change_feed,
+    max_import_bytes=int(
+        os.environ.get("MAX_IMPORT_EXPANDED_BYTES", 1024 * 1024 * 1024)
+    ),
+    grid_cache=GridCache(grid_cache_bytes) if grid_cache_bytes > 0 else None,
+)
+atexit.register(file_manager.close)
+guest_reaper = GuestReaper(
+    workspace_root,
+    remove=file_manager.delete_workspace,
+    list_users=storage.list_users,
+    ttl=float(os.environ.get("GUEST_TTL_HOURS", "168")) * 3600,
+    max_workspaces=int(os.environ.get("GUEST_MAX_WORKSPACES", "1000")),
+    min_idle=float(os.environ.get("GUEST_MIN_IDLE_MINUTES", "60")) * 60,
+    interval=float(os.environ.get("GUEST_REAPER_INTERVAL", "600")),
+    workers=int(os.environ.get("GUEST_REAPER_THREADS", "2")),
+)
+# Registered last so it runs first: no removal starts while the file
+# manager is closing.
+atexit.register(guest_reaper.close)
+rate_limiter = None
+if os.environ.get("RATE_LIMIT_ENABLED", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+):
+    rate_limiter = RateLimiter(
+        user_rate=float(os.environ.get("RATE_LIMIT_USER_RATE", "20")),
+        user_burst=int(os.environ.get("RATE_LIMIT_USER_BURST", "40")),
+        read_rate=float(os.environ.get("RATE_LIMIT_READ_RATE", "10")),
+        read_burst=int(os.environ.get("RATE_LIMIT_READ_BURST", "30")),
+        write_rate=float(os.environ.get("RATE_LIMIT_WRITE_RATE", "4")),
+        write_burst=int(os.environ.get("RATE_LIMIT_WRITE_BURST", "10")),
+    )
+file_ops_max_concurrent = int(os.environ.get("FILE_OPS_MAX_CONCURRENT", "8"))
+file_ops_limiter = None
+if file_ops_max_concurrent > 0:
+    file_ops_limiter = ConcurrencyLimiter(
+        max_concurrent=file_ops_max_concurrent,
+        max_queue=int(os.environ.get("FILE_OPS_MAX_QUEUE", "16")),
+        queue_timeout=float(os.environ.get("FILE_OPS_QUEUE_TIMEOUT", "2")),
+    )
+# Requests under these paths are rate limited; login, user info and metrics
+# are not.
+RATE_LIMITED_PREFIXES = ("/api/files", "/api/workspace", "/api/search")
+RATE_LIMITED_PATHS = ("/api/events", "/api/events/poll")
+init_compression(
+    app, min_size=int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+)
 try:
     user_manager = UserManager(app, workspace_root)
+    atexit.register(user_manager.close)
 except OAuthConfigError as e:
     logger.error(f"Error initializing UserManager: {e}")
     user_manager = None
 
 
+def get_expected_version(body=None):
+    # The base version comes from If-Match ("3" or 3) or a "version" field.
+    if_match = request.headers.get("If-Match")
+    if if_match:
+        try:
+            return int(if_match.strip().removeprefix("W/").strip('"'))
+        except ValueError:
+            return None
+    if isinstance(body, dict) and isinstance(body.get("version"), int):
+        return body["version"]
+    return None
+
+
+def flow_envelope(filename, content, version):
+    # Splice the stored flow into the envelope instead of decoding it only
+    # to encode it again.
+    return b"".join(
+        [
+            b'{"filename":',
+            json_codec.dumps(filename),
+            b',"content":',
+            content,
+            b',"version":',
+            str(version).encode("ascii"),
+            b"}",
+        ]
+    )
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    logger.error(f"{request.method} {request.path} body over the limit")
+    return jsonify({"error": "Request body too large"}), 413
+
+
 @app.before_request
 def initialize_session():
     if user_manager:
-        user_manager.initialize_session()
+        # The user the request arrived with, before a session without one
+        # is given a fresh guest id.
+        g.session_user_id = session.get("user_id")
+        user_id = user_manager.initialize_session()
+        if is_guest_id(user_id):
+            guest_reaper.touch(user_id)
+
+
+# Reached with POST for the size of the request, but only reads flows.
+READ_ONLY_POSTS = ("/api/files/batch",)
+
+
+def request_kind() -> str:
+    if request.method in WRITE_METHODS and request.path not in READ_ONLY_POSTS:
+        return "write"
+    return "read"
+
+
+def is_expensive_request() -> bool:
+    # Writes rewrite whole flows and the metadata; an export reads every
+    # flow.
+    return request_kind() == "write" or request.path == "/api/workspace/export"
+
+
+@app.before_request
+def admit_request():
+    # Runs after the session is set up and after the request metrics have
+    # started, so rejections are counted by route and status like any other
+    # response.
+    if request.method == "OPTIONS":
+        return None
+    path = request.path
+    if not (
+        path.startswith(RATE_LIMITED_PREFIXES) or path in RATE_LIMITED_PATHS
+    ):
+        return None
+    # A request without a session gets a new guest id every time, so only
+    # a user id the session already carried is a stable key.
+    client = g.get("session_user_id") or request.remote_addr
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    try:
+        if rate_limiter is not None:
+            rate_limiter.check(client, request.method, route, request_kind())
+        if file_ops_limiter is not None and is_expensive_request():
+            file_ops_limiter.acquire()
+            g.file_op_slot = True
+    except RateLimitedError as e:
+        logger.warning(f"Rate limited {client} on {request.method} {route}")
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = retry_after_header(e.retry_after)
+        return response, 429
+    except OverloadedError as e:
+        logger.warning(f"Turned away {request.method} {route}: {e}")
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = retry_after_header(e.retry_after)
+        return response, 503
+    return None
+
+
+@app.after_request
+def hand_over_file_op_slot(response):
+    # A streamed body, such as an export, is still being produced after the
+    # view returns; the slot is held until the server closes the response.
+    if g.pop("file_op_slot", False):
+        response.call_on_close(file_ops_limiter.release)
+    return response
+
+
+@app.teardown_request
+def release_file_op_slot(exc=None):
+    # Only reached with the slot still held when the request failed before
+    # a response was made.
+    if g.pop("file_op_slot", False):
+        file_ops_limiter.release()
 
 
 @app.route("/api/login/github")
@@ -63,7 +334,7 @@ def login_github():
 @app.route("/api/auth/github/callback")
 def github_callback():
     logger.debug("Entering github_callback route")
-    logger.debug(f"Request args: {request.args}")
+    logger.debug(f"Callback parameters: {summarize(request.args.to_dict())}")
     if not user_manager:
         logger.error("User management is not available")
         return jsonify({"error": "User management is not available"}), 503
@@ -131,7 +402,7 @@ def get_user_info():
         logger.error("User management is not available")
         return jsonify({"error": "User management is not available"}), 503
     user_info = user_manager.get_user_info()
-    logger.info(f"Retrieved user info: {user_info}")
+    logger.debug(f"Retrieved user info for {user_info['user_id']}")
     return jsonify(user_info)
 
 
@@ -141,9 +412,40 @@ def list_files():
         logger.error("User management is not available")
         return jsonify({"error": "User management is not available"}), 503
     user_id = user_manager.get_user_id()
-    files = file_manager.list_files(user_id)
-    logger.info(f"Listed files for user {user_id}: {files}")
-    return jsonify(files)
+    args = request.args
+    try:
+        limit = int(args["limit"]) if "limit" in args else None
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    paginated = limit is not None or "cursor" in args
+
+    def build():
+        files, next_cursor = file_manager.list_files_page(
+            user_id,
+            sort=args.get("sort", "name"),
+            descending=args.get("order", "asc") == "desc",
+            cursor=args.get("cursor"),
+            limit=limit,
+            prefix=args.get("prefix"),
+            query=args.get("q"),
+        )
+        logger.debug(f"Listed {len(files)} files for user {user_id}")
+        # Without limit/cursor the response stays a plain list, as before.
+        if not paginated:
+            return jsonify(files)
+        return jsonify({"files": files, "next_cursor": next_cursor})
+
+    etag = make_etag(
+        "list",
+        user_id,
+        request.query_string,
+        *file_manager.listing_stamp(user_id),
+    )
+    try:
+        return conditional_response(etag, build)
+    except ValueError as e:
+        logger.error(f"Invalid listing request from user {user_id}: {e}")
+        return jsonify({"error": str(e)}), 400
 
 
 @app.route("/api/files", methods=["POST"])
@@ -151,6 +453,10 @@ def create_file():
     if not user_manager:
         logger.error("User management is not available")
         return jsonify({"error": "User management is not available"}), 503
+    # Reject oversized uploads before Werkzeug parses (and spools) the body.
+    if request.content_length and request.content_length > max_upload_size:
+        logger.error(f"Upload of {request.content_length} bytes rejected")
+        return jsonify({"error": "File too large"}), 413
     if "file" not in request.files:
         logger.error("No file part in the request")
         return jsonify({"error": "No file part"}), 400
@@ -171,6 +477,12 @@ def create_file():
     except FileExistsError as e:
         logger.error(f"FileExistsError while creating file: {str(e)}")
         return jsonify({"error": str(e)}), 409
+    except FileTooLargeError as e:
+        logger.error(f"FileTooLargeError while creating file: {str(e)}")
+        return jsonify({"error": str(e)}), 413
+    except QuotaExceededError as e:
+        logger.info(f"Quota of user {user_id} reached: {str(e)}")
+        return jsonify({"error": str(e)}), 507
 
 
 @app.route("/api/files/<filename>", methods=["GET"])
@@ -179,10 +491,24 @@ def read_file(filename):
         logger.error("User management is not available")
         return jsonify({"error": "User management is not available"}), 503
     user_id = user_manager.get_user_id()
-    try:
-        content = file_manager.read_file(user_id, filename)
+
+    def build():
+        content, version = file_manager.read_file_bytes(user_id, filename)
         logger.info(f"Read file {filename} for user {user_id}")
-        return jsonify({"filename": filename, "content": content})
+        return Response(
+            flow_envelope(filename, content, version),
+            mimetype="application/json",
+        )
+
+    try:
+        entry = file_manager.stat_file(user_id, filename)
+        etag = make_etag(
+            "flow", filename, entry.version, entry.mtime_ns, entry.size
+        )
+        response = conditional_response(etag, build, entry.mtime_ns / 1e9)
+        if response.status_code == 304:
+            file_manager.update_last_edit_time(user_id, filename)
+        return response
     except FileNotFoundError:
         logger.error(f"File {filename} not found for user {user_id}")
         return jsonify({"error": "File not found"}), 404
@@ -198,17 +524,31 @@ def update_file(filename):
     if not user_manager:
         logger.error("User management is not available")
         return jsonify({"error": "User management is not available"}), 503
-    content = request.json
+    if not request.is_json:
+        return jsonify({"error": "Expected a JSON body"}), 415
     user_id = user_manager.get_user_id()
     try:
-        file_manager.update_file(user_id, filename, content)
+        version = file_manager.update_file_bytes(
+            user_id, filename, request.get_data(), get_expected_version()
+        )
         logger.info(f"Updated file {filename} for user {user_id}")
-        return jsonify({"message": "File updated successfully"})
+        return jsonify(
+            {"message": "File updated successfully", "version": version}
+        )
     except FileNotFoundError:
         logger.error(
             f"File {filename} not found for user {user_id} during update"
         )
         return jsonify({"error": "File not found"}), 404
+    except VersionConflictError as e:
+        logger.info(f"Stale update of {filename} for user {user_id}")
+        return (
+            jsonify({"error": str(e), "version": e.current_version}),
+            409,
+        )
+    except QuotaExceededError as e:
+        logger.info(f"Quota of user {user_id} reached: {str(e)}")
+        return jsonify({"error": str(e)}), 507
     except ValueError as e:
         logger.error(
             f"Invalid JSON content for file {filename} from user {user_id}"
@@ -216,6 +556,56 @@ def update_file(filename):
         return jsonify({"error": str(e)}), 400
 
 
+@app.route("/api/files/<filename>", methods=["PATCH"])
+def patch_file(filename):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        patch = body
+    elif isinstance(body, dict) and ("patch" in body or "diff" in body):
+        patch = body.get("patch", body.get("diff"))
+    else:
+        return jsonify({"error": "Expected a JSON Patch or a flow diff"}), 400
+    expected_version = get_expected_version(body)
+    if expected_version is None:
+        return jsonify({"error": "A base version is required"}), 428
+    user_id = user_manager.get_user_id()
+    try:
+        version = file_manager.patch_file(
+            user_id, filename, patch, expected_version
+        )
+        logger.info(
+            f"Patched file {filename} to version {version} for user {user_id}"
+        )
+        return jsonify(
+            {"message": "File updated successfully", "version": version}
+        )
+    except FileNotFoundError:
+        logger.error(
+            f"File {filename} not found for user {user_id} during patch"
+        )
+        return jsonify({"error": "File not found"}), 404
+    except VersionConflictError as e:
+        logger.info(f"Stale patch of {filename} for user {user_id}")
+        return (
+            jsonify({"error": str(e), "version": e.current_version}),
+            409,
+        )
+    except QuotaExceededError as e:
+        logger.info(f"Quota of user {user_id} reached: {str(e)}")
+        return jsonify({"error": str(e)}), 507
+    except PatchError as e:
+        logger.error(f"Invalid patch for file {filename}: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        logger.error(
+            f"Invalid JSON content in file {filename} for user {user_id}"
+        )
+        return jsonify({"error": str(e)}), 400
+
+
 @app.route("/api/files/<filename>", methods=["DELETE"])
 def delete_file(filename):
     if not user_manager:
@@ -233,6 +623,342 @@ def delete_file(filename):
         return jsonify({"error": "File not found"}), 404
 
 
+def flow_view(filename, kind, read):
+    # A JSON view derived from a flow, revalidated against the flow's stat
+    # and the query string.
+    user_id = user_manager.get_user_id()
+
+    def build():
+        view = read(user_id)
+        logger.info(f"Read {kind} of {filename} for user {user_id}")
+        return jsonify({"filename": filename, **view})
+
+    try:
+        entry = file_manager.stat_file(user_id, filename)
+        etag = make_etag(
+            kind,
+            filename,
+            request.query_string,
+            entry.version,
+            entry.mtime_ns,
+            entry.size,
+        )
+        return conditional_response(etag, build, entry.mtime_ns / 1e9)
+    except FileNotFoundError:
+        logger.error(f"File {filename} not found for user {user_id}")
+        return jsonify({"error": "File not found"}), 404
+    except ValueError as e:
+        logger.error(f"Could not read {kind} of {filename}: {e}")
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/files/<filename>/viewport", methods=["GET"])
+def read_viewport(filename):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    try:
+        box = parse_box(request.args.get("bbox", ""))
+        limit = int(request.args.get("limit", MAX_VIEWPORT_NODES))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return flow_view(
+        filename,
+        "viewport",
+        lambda user_id: file_manager.read_viewport(
+            user_id, filename, box, limit
+        ),
+    )
+
+
+@app.route("/api/files/<filename>/nodes", methods=["GET"])
+def read_subgraph(filename):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    node_ids = request.args.getlist("id")
+    return flow_view(
+        filename,
+        "nodes",
+        lambda user_id: file_manager.read_subgraph(
+            user_id, filename, node_ids
+        ),
+    )
+
+
+@app.route("/api/files/<filename>/outline", methods=["GET"])
+def read_outline(filename):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    return flow_view(
+        filename,
+        "outline",
+        lambda user_id: file_manager.read_outline(user_id, filename),
+    )
+
+
+@app.route("/api/files/<filename>/versions", methods=["GET"])
+def list_versions(filename):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    if file_manager.history is None:
+        return jsonify({"error": "Version history is disabled"}), 404
+    user_id = user_manager.get_user_id()
+    versions = file_manager.list_versions(user_id, filename)
+    if not versions:
+        try:
+            file_manager.stat_file(user_id, filename)
+        except FileNotFoundError:
+            logger.error(f"No history of {filename} for user {user_id}")
+            return jsonify({"error": "File not found"}), 404
+    return jsonify({"filename": filename, "versions": versions})
+
+
+@app.route("/api/files/<filename>/versions/<int:version>", methods=["GET"])
+def read_version(filename, version):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    user_id = user_manager.get_user_id()
+    try:
+        content = file_manager.read_version(user_id, filename, version)
+        logger.info(f"Read version {version} of {filename} for user {user_id}")
+        return Response(
+            flow_envelope(filename, content, version),
+            mimetype="application/json",
+        )
+    except FileNotFoundError as e:
+        logger.error(f"{e} for user {user_id}")
+        return jsonify({"error": "Version not found"}), 404
+    except ValueError as e:
+        logger.error(f"Could not read version {version} of {filename}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route(
+    "/api/files/<filename>/versions/<int:version>/restore", methods=["POST"]
+)
+def restore_version(filename, version):
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    user_id = user_manager.get_user_id()
+    expected_version = get_expected_version(request.get_json(silent=True))
+    try:
+        new_version = file_manager.restore_version(
+            user_id, filename, version, expected_version
+        )
+        logger.info(
+            f"Restored {filename} to version {version} as {new_version} "
+            f"for user {user_id}"
+        )
+        return jsonify(
+            {"message": "File restored successfully", "version": new_version}
+        )
+    except FileNotFoundError as e:
+        logger.error(f"{e} for user {user_id} during restore")
+        return jsonify({"error": "Version not found"}), 404
+    except VersionConflictError as e:
+        logger.info(f"Stale restore of {filename} for user {user_id}")
+        return (
+            jsonify({"error": str(e), "version": e.current_version}),
+            409,
+        )
+    except FileExistsError as e:
+        return jsonify({"error": str(e)}), 409
+    except QuotaExceededError as e:
+        logger.info(f"Quota of user {user_id} reached: {str(e)}")
+        return jsonify({"error": str(e)}), 507
+    except ValueError as e:
+        logger.error(f"Could not restore version {version} of {filename}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/search", methods=["GET"])
+def search():
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    user_id = user_manager.get_user_id()
+    query = request.args.get("q", "")
+    try:
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    try:
+        results, total = file_manager.search(user_id, query, limit)
+        logger.info(f"Search matched {total} flows for user {user_id}")
+        return jsonify({"query": query, "results": results, "total": total})
+    except ValueError as e:
+        logger.error(f"Invalid search from user {user_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/events", methods=["GET"])
+def events():
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    if change_feed is None:
+        return jsonify({"error": "The change feed is disabled"}), 404
+    user_id = user_manager.get_user_id()
+    # EventSource sends Last-Event-ID when it reconnects.
+    after = request.headers.get("Last-Event-ID") or request.args.get("after")
+    try:
+        subscription = change_feed.subscribe(user_id, after)
+    except TooManyConnectionsError as e:
+        logger.warning(f"Change feed refused for user {user_id}: {e}")
+        return (
+            jsonify({"error": str(e)}),
+            429 if e.per_user else 503,
+            {"Retry-After": "5"},
+        )
+    logger.info(f"Opened change feed for user {user_id}")
+    return Response(
+        stream_events(
+            subscription,
+            json_codec.dumps,
+            resumed=after is not None,
+            heartbeat=events_heartbeat,
+            duration=events_stream_seconds,
+        ),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/events/poll", methods=["GET"])
+def poll_events():
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    if change_feed is None:
+        return jsonify({"error": "The change feed is disabled"}), 404
+    user_id = user_manager.get_user_id()
+    try:
+        timeout = float(request.args.get("timeout", events_poll_timeout))
+    except ValueError:
+        return jsonify({"error": "timeout must be a number"}), 400
+    timeout = min(max(timeout, 0), events_poll_timeout)
+    try:
+        changes, reset, last_id = change_feed.poll(
+            user_id, request.args.get("after"), timeout
+        )
+    except TooManyConnectionsError as e:
+        logger.warning(f"Change feed poll refused for user {user_id}: {e}")
+        return (
+            jsonify({"error": str(e)}),
+            429 if e.per_user else 503,
+            {"Retry-After": "5"},
+        )
+    return jsonify({"events": changes, "reset": reset, "last_id": last_id})
+
+
+@app.route("/api/files/batch", methods=["POST"])
+def read_files_batch():
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    body = request.get_json(silent=True)
+    filenames = body.get("files") if isinstance(body, dict) else None
+    if not isinstance(filenames, list) or not all(
+        isinstance(filename, str) for filename in filenames
+    ):
+        return jsonify({"error": "Expected a list of file names"}), 400
+    user_id = user_manager.get_user_id()
+    try:
+        found, missing = file_manager.read_files(user_id, filenames)
+    except ValueError as e:
+        logger.error(f"Invalid batch read from user {user_id}: {e}")
+        return jsonify({"error": str(e)}), 400
+    logger.info(f"Read {len(found)} files in a batch for user {user_id}")
+    body = b"".join(
+        [
+            b'{"files":[',
+            b",".join(flow_envelope(*flow) for flow in found),
+            b'],"missing":',
+            json_codec.dumps(missing),
+            b"}",
+        ]
+    )
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/api/workspace/export", methods=["GET"])
+def export_workspace():
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    user_id = user_manager.get_user_id()
+    # ?file=a&file=b exports a selection; no parameter exports everything.
+    filenames = request.args.getlist("file") or None
+    try:
+        chunks = file_manager.export_workspace(user_id, filenames)
+    except FileNotFoundError as e:
+        logger.error(f"Export for user {user_id} failed: {e}")
+        return jsonify({"error": str(e)}), 404
+    logger.info(f"Exporting workspace of user {user_id}")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return Response(
+        chunks,
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="workspace-{stamp}.zip"'
+            )
+        },
+    )
+
+
+@app.route("/api/workspace/import", methods=["POST"])
+def import_workspace():
+    if not user_manager:
+        logger.error("User management is not available")
+        return jsonify({"error": "User management is not available"}), 503
+    request.max_content_length = max_import_size
+    if request.content_length and request.content_length > max_import_size:
+        logger.error(f"Import of {request.content_length} bytes rejected")
+        return jsonify({"error": "Archive too large"}), 413
+    if "file" not in request.files:
+        logger.error("No file part in the request")
+        return jsonify({"error": "No file part"}), 400
+    user_id = user_manager.get_user_id()
+    overwrite = request.args.get("overwrite", "false").lower() in (
+        "1",
+        "true",
+    )
+    try:
+        result = file_manager.import_workspace(
+            user_id, request.files["file"].stream, overwrite
+        )
+    except ArchiveError as e:
+        logger.error(f"Invalid archive from user {user_id}: {e}")
+        return jsonify({"error": str(e)}), 400
+    except FileTooLargeError as e:
+        logger.error(f"Import for user {user_id} rejected: {e}")
+        return jsonify({"error": str(e)}), 413
+    except QuotaExceededError as e:
+        logger.info(f"Quota of user {user_id} reached: {str(e)}")
+        return jsonify({"error": str(e)}), 507
+    logger.info(
+        f"Imported {len(result['imported'])} files for user {user_id}, "
+        f"skipped {len(result['skipped'])}, rejected {len(result['errors'])}"
+    )
+    return jsonify(result)
+
+
+@app.route("/api/metrics")
+def metrics():
+    if metrics_token and not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(),
+        f"Bearer {metrics_token}".encode(),
+    ):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     logger.info("Starting the Flask application")
     app.run(debug=True)
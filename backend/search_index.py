@@ -0,0 +1,481 @@
+import os
+import re
+import math
+import heapq
+import time
+import tempfile
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from loguru import logger
+from json_codec import JSONCodec, get_codec
+from listing import display_name
+from metrics import timed
+
+
+SEARCH_DIRNAME = ".search"
+INDEX_FORMAT = 1
+DEFAULT_FLUSH_INTERVAL = 30.0
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_SNIPPETS = 3
+SNIPPET_BEFORE = 30
+SNIPPET_AFTER = 60
+# The last query word also matches words it is a prefix of, up to this many.
+MAX_PREFIX_TERMS = 64
+MAX_TERM_LENGTH = 64
+MAX_TEXT_LENGTH = 2000
+TOKEN_RE = re.compile(r"\w+")
+# Node keys that hold layout, ids or editor state rather than content.
+SKIPPED_KEYS = {"id", "position", "positionAbsolute", "icon", "selected"}
+FIELD_WEIGHTS = {"type": 3.0, "name": 3.0, "label": 3.0, "flow": 2.0}
+
+# One indexed string of a flow: (node or edge id, key, text).
+Field = Tuple[str, str, str]
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token
+        for token in TOKEN_RE.findall(text.lower())
+        if len(token) <= MAX_TERM_LENGTH
+    ]
+
+
+def _walk(value: Any, key: str) -> Iterator[Tuple[str, str]]:
+    if isinstance(value, str):
+        if value:
+            yield key, value[:MAX_TEXT_LENGTH]
+    elif isinstance(value, list):
+        for item in value:
+            yield from _walk(item, key)
+    elif isinstance(value, dict):
+        # Editor fields are {"name": ..., "value": ...} pairs; the value is
+        # indexed under the field's name.
+        name = value.get("name")
+        if isinstance(name, str) and "value" in value:
+            yield "field", name
+            yield from _walk(value["value"], name)
+            return
+        for child_key, child in value.items():
+            if child_key in SKIPPED_KEYS or child_key.startswith("on"):
+                continue
+            yield from _walk(child, child_key)
+
+
+def extract_fields(filename: str, document: Any) -> List[Field]:
+    # The searchable strings of a flow: node types, labels and data, edge
+    # labels and types, and the flow's own name.
+    fields: List[Field] = [("", "flow", display_name(filename))]
+    if not isinstance(document, dict):
+        return fields
+    for kind in ("nodes", "edges"):
+        items = document.get(kind)
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_id = str(item.get("id", ""))
+            for key in ("type", "label"):
+                if isinstance(item.get(key), str):
+                    fields.append((item_id, key, item[key]))
+            for key, text in _walk(item.get("data"), "data"):
+                fields.append((item_id, key, text))
+    return fields
+
+
+def snippet(text: str, start: int, end: int) -> str:
+    left = max(0, start - SNIPPET_BEFORE)
+    right = min(len(text), end + SNIPPET_AFTER)
+    return (
+        ("…" if left else "")
+        + text[left:right]
+        + ("…" if right < len(text) else "")
+    )
+
+
+# The inverted index of one user's flows. Every term maps to the flows it
+# occurs in and a weighted count; terms are also kept sorted for prefix
+# lookups. Fields are qualified as well, so "model:gpt" only matches text
+# under a "model" key.
+class WorkspaceIndex:
+    def __init__(self) -> None:
+        self.flows: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.terms: List[str] = []
+        self.stamp: Optional[Tuple] = None
+
+    def _terms(self, fields: List[Field]) -> Dict[str, float]:
+        weights: Dict[str, float] = {}
+        for _, key, text in fields:
+            weight = FIELD_WEIGHTS.get(key, 1.0)
+            qualifier = key.lower() + ":"
+            for token in tokenize(text):
+                for term in (token, qualifier + token):
+                    weights[term] = weights.get(term, 0.0) + weight
+        return weights
+
+    def put(self, filename: str, version: int, fields: List[Field]) -> None:
+        self.remove(filename)
+        self.flows[filename] = {"version": version, "fields": fields}
+        for term, weight in self._terms(fields).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                insort(self.terms, term)
+            postings[filename] = weight
+
+    def remove(self, filename: str) -> None:
+        flow = self.flows.pop(filename, None)
+        if flow is None:
+            return
+        for term in self._terms(flow["fields"]):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(filename, None)
+            if not postings:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+
+    def expand(self, prefix: str) -> List[str]:
+        start = bisect_left(self.terms, prefix)
+        expanded = []
+        for term in self.terms[start : start + MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            expanded.append(term)
+        return expanded
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"format": INDEX_FORMAT, "flows": self.flows}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "WorkspaceIndex":
+        index = cls()
+        if data.get("format") != INDEX_FORMAT:
+            return index
+        for filename, flow in data.get("flows", {}).items():
+            index.put(
+                filename,
+                flow["version"],
+                [tuple(field) for field in flow["fields"]],
+            )
+        return index
+
+
+def parse_query(query: str) -> List[List[str]]:
+    # Each group is the words of one query word; "key:value" words are
+    # qualified with the key.
+    groups = []
+    for word in query.split():
+        key, _, value = word.rpartition(":")
+        tokens = tokenize(value)
+        if key:
+            tokens = [f"{key.lower()}:{token}" for token in tokens]
+        groups.extend([token] for token in tokens)
+    return groups
+
+
+# Search over the contents of every user's flows. FileManager reports each
+# change through ``update``/``remove`` and a background thread folds them
+# in; before answering, ``search`` also reconciles the index with the
+# versions in storage, so flows changed around the file manager (another
+# process, an import run offline) are picked up as well. Indexes are kept
+# in memory and written to <index_root>/<user_id>.json behind the changes.
+class SearchIndex:
+    def __init__(
+        self,
+        index_root: str,
+        codec: Optional[JSONCodec] = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ) -> None:
+        self.index_root = index_root
+        self.codec = codec or get_codec()
+        self.flush_interval = flush_interval
+        # Set by attach(): the storage listing, its stamp, and a loader of
+        # a flow's plain bytes and version.
+        self._list_entries: Optional[Callable] = None
+        self._listing_stamp: Optional[Callable] = None
+        self._load: Optional[Callable[[str, str], Tuple[bytes, int]]] = None
+        self._workspaces: Dict[str, WorkspaceIndex] = {}
+        self._pending: Dict[Tuple[str, str], Optional[Tuple[int, bytes]]] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="search-index", daemon=True
+        )
+        self._worker.start()
+
+    def attach(
+        self,
+        list_entries: Callable,
+        listing_stamp: Callable,
+        load: Callable[[str, str], Tuple[bytes, int]],
+    ) -> None:
+        self._list_entries = list_entries
+        self._listing_stamp = listing_stamp
+        self._load = load
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.index_root, user_id + ".json")
+
+    def _workspace(self, user_id: str) -> WorkspaceIndex:
+        workspace = self._workspaces.get(user_id)
+        if workspace is None:
+            workspace = self._read(user_id)
+            self._workspaces[user_id] = workspace
+        return workspace
+
+    @timed("search_index_load")
+    def _read(self, user_id: str) -> WorkspaceIndex:
+        try:
+            with open(self._path(user_id), "rb") as f:
+                return WorkspaceIndex.from_json(self.codec.loads(f.read()))
+        except FileNotFoundError:
+            return WorkspaceIndex()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Could not load search index of {user_id}: {e}")
+            return WorkspaceIndex()
+
+    def update(
+        self, user_id: str, filename: str, version: int, data: bytes
+    ) -> None:
+        # Queues the plain content of a flow's new version.
+        with self._lock:
+            self._pending[(user_id, filename)] = (version, data)
+        self._wakeup.set()
+
+    def remove(self, user_id: str, filename: str) -> None:
+        with self._lock:
+            self._pending[(user_id, filename)] = None
+        self._wakeup.set()
+
+    def _index(
+        self,
+        workspace: WorkspaceIndex,
+        filename: str,
+        version: int,
+        data: bytes,
+    ) -> None:
+        try:
+            document = self.codec.loads(data)
+        except ValueError:
+            document = None
+        workspace.put(filename, version, extract_fields(filename, document))
+
+    def _apply_pending(self, user_id: Optional[str] = None) -> None:
+        with self._lock:
+            keys = [
+                key
+                for key in self._pending
+                if user_id is None or key[0] == user_id
+            ]
+            for key in keys:
+                change = self._pending.pop(key)
+                workspace = self._workspace(key[0])
+                if change is None:
+                    workspace.remove(key[1])
+                else:
+                    self._index(workspace, key[1], *change)
+                self._dirty.add(key[0])
+
+    @timed("search_reconcile")
+    def _reconcile(self, user_id: str) -> None:
+        # Reindexes flows whose stored version differs from the indexed one
+        # and drops flows that are gone. A no-op while the listing stamp is
+        # unchanged.
+        if self._list_entries is None:
+            return
+        stamp = self._listing_stamp(user_id)
+        with self._lock:
+            workspace = self._workspace(user_id)
+            if workspace.stamp == stamp:
+                return
+            indexed = {
+                filename: flow["version"]
+                for filename, flow in workspace.flows.items()
+            }
+        entries = {
+            entry.filename: entry.version
+            for entry in self._list_entries(user_id)
+        }
+        stale = [
+            filename
+            for filename, version in entries.items()
+            if indexed.get(filename) != version
+        ]
+        loaded = []
+        for filename in stale:
+            try:
+                loaded.append((filename, *self._load(user_id, filename)))
+            except (FileNotFoundError, ValueError):
+                continue
+        with self._lock:
+            for filename in set(workspace.flows) - set(entries):
+                workspace.remove(filename)
+            for filename, data, version in loaded:
+                self._index(workspace, filename, version, data)
+            workspace.stamp = stamp
+            if stale or len(entries) != len(indexed):
+                self._dirty.add(user_id)
+
+    def rebuild(self, user_id: str) -> int:
+        # Drops the user's index and indexes every flow again.
+        with self._lock:
+            self._workspaces[user_id] = WorkspaceIndex()
+            self._dirty.add(user_id)
+        self._reconcile(user_id)
+        return len(self._workspaces[user_id].flows)
+
+    @timed("search")
+    def search(
+        self, user_id: str, query: str, limit: int = DEFAULT_LIMIT
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        # Returns the ``limit`` best flows matching every query word, with
+        # snippets, and how many flows matched in all.
+        self._apply_pending(user_id)
+        self._reconcile(user_id)
+        groups = parse_query(query)
+        if not groups:
+            return [], 0
+        # Snippets look for the words as typed; a prefix finds the words it
+        # expanded to as well.
+        words = {group[0].rpartition(":")[2] for group in groups}
+        with self._lock:
+            workspace = self._workspace(user_id)
+            # The last word is still being typed.
+            groups[-1] = workspace.expand(groups[-1][0]) or groups[-1]
+            total = len(workspace.flows)
+            scores: Optional[Dict[str, float]] = None
+            for group in groups:
+                matched: Dict[str, float] = {}
+                for term in group:
+                    postings = workspace.postings.get(term, {})
+                    idf = math.log(1 + total / (1 + len(postings)))
+                    for filename, weight in postings.items():
+                        matched[filename] = max(
+                            matched.get(filename, 0.0), weight * idf
+                        )
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {
+                        filename: score + matched[filename]
+                        for filename, score in scores.items()
+                        if filename in matched
+                    }
+                if not scores:
+                    return [], 0
+            ranked = heapq.nsmallest(
+                limit, scores.items(), key=lambda item: (-item[1], item[0])
+            )
+            results = [
+                {
+                    "name": display_name(filename),
+                    "score": round(score, 4),
+                    "version": workspace.flows[filename]["version"],
+                    "matches": self._snippets(
+                        workspace.flows[filename]["fields"], words
+                    ),
+                }
+                for filename, score in ranked
+            ]
+        return results, len(scores)
+
+    def _snippets(
+        self, fields: List[Field], words: Set[str]
+    ) -> List[Dict[str, str]]:
+        matches = []
+        for item_id, key, text in fields:
+            lowered = text.lower()
+            for word in words:
+                start = lowered.find(word)
+                if start < 0:
+                    continue
+                matches.append(
+                    {
+                        "id": item_id,
+                        "field": key,
+                        "text": snippet(text, start, start + len(word)),
+                    }
+                )
+                break
+            if len(matches) == MAX_SNIPPETS:
+                break
+        return matches
+
+    def delete_user(self, user_id: str) -> None:
+        with self._flush_lock:
+            with self._lock:
+                for key in [k for k in self._pending if k[0] == user_id]:
+                    del self._pending[key]
+                self._workspaces.pop(user_id, None)
+                self._dirty.discard(user_id)
+            try:
+                os.remove(self._path(user_id))
+            except FileNotFoundError:
+                pass
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                snapshots = {
+                    user_id: self.codec.dumps(
+                        self._workspaces[user_id].to_json()
+                    )
+                    for user_id in dirty
+                    if user_id in self._workspaces
+                }
+            for user_id, data in snapshots.items():
+                try:
+                    self._write(user_id, data)
+                except OSError as e:
+                    logger.error(
+                        f"Could not save search index of {user_id}: {e}"
+                    )
+                    with self._lock:
+                        self._dirty.add(user_id)
+
+    @timed("search_index_save")
+    def _write(self, user_id: str, data: bytes) -> None:
+        os.makedirs(self.index_root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.index_root, prefix=".index-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(user_id))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _run(self) -> None:
+        # Changes are indexed as they come; saves are batched to one per
+        # user every ``flush_interval``.
+        last_flush = time.monotonic()
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._apply_pending()
+            except Exception as e:
+                logger.error(f"Could not update the search index: {e}")
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._worker.join()
+        self._apply_pending()
+        self.flush()
@@ -0,0 +1,102 @@
+import os
+import argparse
+from dotenv import load_dotenv
+from loguru import logger
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Serve the workstation backend through uvicorn (ASGI)"
+    )
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument(
+        "--port", type=int, default=int(os.environ.get("PORT", "5000"))
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WORKERS", "1")),
+        help="worker processes",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.environ.get("WORKSTATION_THREADS", "32")),
+        help="request threads per worker",
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=int(os.environ.get("LIMIT_CONCURRENCY", "0")) or None,
+        help="connections per worker before answering 503",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=float(os.environ.get("GRACEFUL_SHUTDOWN_TIMEOUT", "30")),
+        help="seconds open requests (change feed streams included) get "
+        "to finish on shutdown",
+    )
+    args = parser.parse_args()
+
+    try:
+        import uvicorn  # type: ignore
+    except ImportError:
+        parser.error("ASGI serving needs uvicorn: pip install uvicorn")
+
+    # Each worker process keeps its own in-memory metadata index, which
+    # would overwrite the others' metadata.json.
+    backend = os.environ.get("STORAGE_BACKEND", "filesystem")
+    if args.workers > 1 and backend == "filesystem":
+        logger.warning(
+            "Several workers share the filesystem backend's metadata.json; "
+            "use --threads or STORAGE_BACKEND=sqlite instead"
+        )
+    # Pending coalesced writes are only visible to the worker holding them.
+    if args.workers > 1 and float(
+        os.environ.get("WRITE_COALESCE_WINDOW", "0")
+    ):
+        logger.warning(
+            "Coalesced writes are not seen by other workers until flushed; "
+            "use --threads or unset WRITE_COALESCE_WINDOW instead"
+        )
+    # Change events reach only clients connected to the same worker.
+    events_enabled = os.environ.get("EVENTS_ENABLED", "1").lower() not in (
+        "0",
+        "false",
+        "no",
+    )
+    if args.workers > 1 and events_enabled:
+        logger.warning(
+            "Change feed clients only see changes made through their own "
+            "worker; use --threads or EVENTS_ENABLED=0 instead"
+        )
+    # Every open change feed stream holds one request thread.
+    if (
+        events_enabled
+        and int(os.environ.get("EVENTS_MAX_CONNECTIONS", "16")) >= args.threads
+    ):
+        logger.warning(
+            "EVENTS_MAX_CONNECTIONS leaves no request threads for other "
+            "requests; raise --threads or lower it"
+        )
+
+    os.environ["WORKSTATION_THREADS"] = str(args.threads)
+    logger.info(
+        f"Serving on {args.host}:{args.port} with {args.workers} worker(s) "
+        f"x {args.threads} threads"
+    )
+    uvicorn.run(
+        "asgi:application",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        limit_concurrency=args.limit_concurrency,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        lifespan="on",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from storage import FlowEntry
+from metrics import REGISTRY
+
+
+DEFAULT_CELL_SIZE = 512.0
+# Nodes only carry their size once the editor has rendered them; until then
+# a typical node's footprint is assumed.
+DEFAULT_NODE_WIDTH = 200.0
+DEFAULT_NODE_HEIGHT = 100.0
+# A node covering more cells than this is kept aside and checked on every
+# query instead of being copied into each cell.
+MAX_CELLS_PER_NODE = 64
+MAX_VIEWPORT_NODES = 5000
+MAX_SUBGRAPH_NODES = 1000
+DEFAULT_GRID_CACHE_BYTES = 32 * 1024 * 1024
+
+Box = Tuple[float, float, float, float]
+
+GRID_CACHE_LOOKUPS = REGISTRY.counter(
+    "workstation_spatial_index_lookups_total",
+    "Spatial index cache lookups, by result.",
+    ("result",),
+)
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value) if math.isfinite(value) else None
+
+
+def _point(value: Any) -> Optional[Tuple[float, float]]:
+    if not isinstance(value, dict):
+        return None
+    x, y = _number(value.get("x")), _number(value.get("y"))
+    return None if x is None or y is None else (x, y)
+
+
+def _size(node: Dict[str, Any]) -> Tuple[float, float]:
+    measured = node.get("measured")
+    for source in (node, measured if isinstance(measured, dict) else {}):
+        width, height = _number(source.get("width")), _number(
+            source.get("height")
+        )
+        if width is not None and height is not None:
+            return max(width, 0.0), max(height, 0.0)
+    return DEFAULT_NODE_WIDTH, DEFAULT_NODE_HEIGHT
+
+
+def parse_box(value: str) -> Box:
+    # "x0,y0,x1,y1" in flow coordinates.
+    try:
+        parts = [float(part) for part in value.split(",")]
+    except ValueError:
+        parts = []
+    if len(parts) != 4 or not all(math.isfinite(p) for p in parts):
+        raise ValueError("bbox must be four numbers: x0,y0,x1,y1")
+    x0, y0, x1, y1 = parts
+    if x0 > x1 or y0 > y1:
+        raise ValueError("bbox must have x0 <= x1 and y0 <= y1")
+    return x0, y0, x1, y1
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+# A uniform grid over the bounding boxes of a flow's nodes, with the edges
+# of each node, so that the nodes in a viewport and the edges touching them
+# are found without walking the whole document. Positions of nodes inside
+# a parent (React Flow sub flows) are relative to it and are resolved to
+# absolute ones first.
+class FlowGrid:
+    def __init__(
+        self, document: Any, cell_size: float = DEFAULT_CELL_SIZE
+    ) -> None:
+        if not isinstance(document, dict):
+            document = {}
+        self.cell_size = cell_size
+        self.nodes = [
+            n for n in document.get("nodes") or [] if isinstance(n, dict)
+        ]
+        self.edges = [
+            e for e in document.get("edges") or [] if isinstance(e, dict)
+        ]
+        self.by_id = {
+            str(node.get("id")): index for index, node in enumerate(self.nodes)
+        }
+        self.boxes: List[Optional[Box]] = self._boxes()
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        self.large: List[int] = []
+        for index, box in enumerate(self.boxes):
+            if box is not None:
+                self._insert(index, box)
+        self.edges_by_node: Dict[str, List[int]] = {}
+        for index, edge in enumerate(self.edges):
+            for end in {str(edge.get("source")), str(edge.get("target"))}:
+                self.edges_by_node.setdefault(end, []).append(index)
+        placed = [box for box in self.boxes if box is not None]
+        self.bounds: Optional[Box] = (
+            (
+                min(box[0] for box in placed),
+                min(box[1] for box in placed),
+                max(box[2] for box in placed),
+                max(box[3] for box in placed),
+            )
+            if placed
+            else None
+        )
+
+    def _boxes(self) -> List[Optional[Box]]:
+        absolute: Dict[int, Optional[Tuple[float, float]]] = {}
+
+        def resolve(index: int, seen: Tuple[int, ...]) -> Optional[Tuple]:
+            if index in absolute:
+                return absolute[index]
+            node = self.nodes[index]
+            point = _point(node.get("positionAbsolute"))
+            if point is None:
+                point = _point(node.get("position"))
+                parent = node.get("parentId", node.get("parentNode"))
+                parent_index = self.by_id.get(str(parent))
+                if point is not None and parent is not None:
+                    if parent_index is None or parent_index in seen:
+                        point = None
+                    else:
+                        origin = resolve(parent_index, seen + (index,))
+                        point = (
+                            None
+                            if origin is None
+                            else (origin[0] + point[0], origin[1] + point[1])
+                        )
+            absolute[index] = point
+            return point
+
+        boxes: List[Optional[Box]] = []
+        for index, node in enumerate(self.nodes):
+            point = resolve(index, ())
+            if point is None:
+                boxes.append(None)
+                continue
+            width, height = _size(node)
+            boxes.append(
+                (point[0], point[1], point[0] + width, point[1] + height)
+            )
+        return boxes
+
+    def _cell_range(self, box: Box) -> Tuple[int, int, int, int]:
+        size = self.cell_size
+        return (
+            math.floor(box[0] / size),
+            math.floor(box[1] / size),
+            math.floor(box[2] / size),
+            math.floor(box[3] / size),
+        )
+
+    def _insert(self, index: int, box: Box) -> None:
+        cx0, cy0, cx1, cy1 = self._cell_range(box)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > MAX_CELLS_PER_NODE:
+            self.large.append(index)
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self.cells.setdefault((cx, cy), []).append(index)
+
+    def query(
+        self, box: Box, limit: int = MAX_VIEWPORT_NODES
+    ) -> Tuple[List[int], bool]:
+        # Indexes of the nodes intersecting ``box``, in document order, and
+        # whether there were more than ``limit``.
+        cx0, cy0, cx1, cy1 = self._cell_range(box)
+        candidates = set(self.large)
+        # A huge box is answered from the occupied cells instead of every
+        # cell it covers.
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            for (cx, cy), indexes in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    candidates.update(indexes)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    candidates.update(self.cells.get((cx, cy), ()))
+        found = sorted(
+            i for i in candidates if _intersects(self.boxes[i], box)
+        )
+        return found[:limit], len(found) > limit
+
+    def edges_touching(self, node_indexes: Iterable[int]) -> List[int]:
+        edges = set()
+        for index in node_indexes:
+            node_id = str(self.nodes[index].get("id"))
+            edges.update(self.edges_by_node.get(node_id, ()))
+        return sorted(edges)
+
+    def outline(self) -> Dict[str, Any]:
+        # Counts, bounds and node boxes without node data: enough for a
+        # minimap or to pick the first viewport.
+        types: Dict[str, int] = {}
+        for node in self.nodes:
+            node_type = str(node.get("type", "default"))
+            types[node_type] = types.get(node_type, 0) + 1
+        return {
+            "node_count": len(self.nodes),
+            "edge_count": len(self.edges),
+            "bounds": list(self.bounds) if self.bounds else None,
+            "types": types,
+            "nodes": [
+                [
+                    node.get("id"),
+                    node.get("type"),
+                    round(box[0]),
+                    round(box[1]),
+                    round(box[2] - box[0]),
+                    round(box[3] - box[1]),
+                ]
+                for node, box in zip(self.nodes, self.boxes)
+                if box is not None
+            ],
+        }
+
+
+def _stamp(entry: FlowEntry) -> Tuple[int, int, int]:
+    return entry.version, entry.size, entry.mtime_ns
+
+
+# Built grids of recently viewed flows, least recently used first, bounded
+# by the size of the flows they were built from; an entry is served only
+# while the flow's stat matches the one it was built under.
+class GridCache:
+    def __init__(self, max_bytes: int = DEFAULT_GRID_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(
+        self, user_id: str, filename: str, entry: FlowEntry
+    ) -> Optional[FlowGrid]:
+        key = (user_id, filename)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == _stamp(entry):
+                self._entries.move_to_end(key)
+                GRID_CACHE_LOOKUPS.inc("hit")
+                return cached[2]
+            if cached is not None:
+                self._discard(key)
+        GRID_CACHE_LOOKUPS.inc("miss")
+        return None
+
+    def put(
+        self,
+        user_id: str,
+        filename: str,
+        entry: FlowEntry,
+        grid: FlowGrid,
+        cost: int,
+    ) -> None:
+        key = (user_id, filename)
+        with self._lock:
+            self._discard(key)
+            if cost > self.max_bytes:
+                return
+            self._entries[key] = (_stamp(entry), cost, grid)
+            self._size += cost
+            while self._size > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def invalidate(self, user_id: str, filename: str) -> None:
+        with self._lock:
+            self._discard((user_id, filename))
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._discard(key)
+
+    def _discard(self, key: Tuple[str, str]) -> None:
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self._size -= cached[1]
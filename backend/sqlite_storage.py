@@ -0,0 +1,444 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from loguru import logger
+from storage import (
+    StorageBackend,
+    FlowEntry,
+    FileExistsError,
+    VersionConflictError,
+    FLOW_FILE_EXTENSION,
+    remove_tree,
+)
+from listing import sort_key
+from metadata_index import DEFAULT_FLUSH_INTERVAL
+
+
+COPY_CHUNK_SIZE = 64 * 1024
+# Idle connections kept for reuse; threads beyond this open a connection
+# for the call and close it afterwards.
+DEFAULT_POOL_SIZE = 8
+
+# ``content`` is the last column so that metadata-only queries never have
+# to walk a flow's overflow pages.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flows (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    last_edit TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content BLOB NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS flows_by_last_edit
+    ON flows (user_id, last_edit, name);
+CREATE TABLE IF NOT EXISTS workspaces (
+    user_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+"""
+
+ENTRY_COLUMNS = "name, last_edit, version, size, mtime_ns"
+
+
+# Flows as rows of one SQLite database in WAL mode, so listings and lookups
+# are index queries and every mutation is a transaction. Uploads are still
+# staged under <workspace_root>/<user_id>/ before being copied in. With
+# ``fsync``, every commit is synced (synchronous=FULL) rather than only WAL
+# checkpoints.
+#
+# Connections are checked out of a small pool for each call, so short-lived
+# request threads do not leave one open each. Reads only record the time a
+# flow was opened, which is kept in memory and written in one transaction
+# at most ``touch_interval`` seconds later; it does not change the listing
+# stamp, so listings stay cacheable while flows are being read.
+class SQLiteStorage(StorageBackend):
+    def __init__(
+        self,
+        db_path: str,
+        workspace_root: str,
+        fsync: bool = False,
+        touch_interval: float = DEFAULT_FLUSH_INTERVAL,
+        pool_size: int = DEFAULT_POOL_SIZE,
+    ) -> None:
+        self.db_path = db_path
+        self.workspace_root = workspace_root
+        self.fsync = fsync
+        self.touch_interval = touch_interval
+        self.pool_size = pool_size
+        self._idle: List[sqlite3.Connection] = []
+        self._pool_lock = threading.Lock()
+        self._closed = False
+        self._touches: Dict[Tuple[str, str], str] = {}
+        self._touches_lock = threading.Lock()
+        self._touched = threading.Event()
+        self._stopped = threading.Event()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+        self._flusher = threading.Thread(
+            target=self._run, name="sqlite-touches", daemon=True
+        )
+        self._flusher.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}"
+        )
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        with self._pool_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            # A connection left inside a transaction is not reused.
+            with self._pool_lock:
+                if (
+                    not self._closed
+                    and not conn.in_transaction
+                    and len(self._idle) < self.pool_size
+                ):
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _bump_generation(self, conn: sqlite3.Connection, user_id: str) -> None:
+        conn.execute(
+            "INSERT INTO workspaces (user_id, generation) VALUES (?, 1) "
+            "ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1",
+            (user_id,),
+        )
+
+    def _current_version(
+        self, conn: sqlite3.Connection, user_id: str, filename: str
+    ) -> Optional[int]:
+        row = conn.execute(
+            "SELECT version FROM flows WHERE user_id = ? AND name = ?",
+            (user_id, filename),
+        ).fetchone()
+        return row[0] if row else None
+
+    def list_users(self) -> List[str]:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT DISTINCT user_id FROM flows")
+            return [row[0] for row in rows]
+
+    def list_entries(self, user_id: str) -> List[FlowEntry]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT {ENTRY_COLUMNS} FROM flows WHERE user_id = ?",
+                (user_id,),
+            )
+            return [FlowEntry(*row) for row in rows]
+
+    def list_page(
+        self,
+        user_id: str,
+        sort: str = "name",
+        descending: bool = False,
+        after: Optional[Tuple[str, ...]] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List[FlowEntry], Optional[Tuple[str, ...]]]:
+        # Both orders are walks of an index: the primary key for name, and
+        # flows_by_last_edit for last_edit.
+        columns = ["name"] if sort == "name" else ["last_edit", "name"]
+        direction = "DESC" if descending else "ASC"
+        clauses = ["user_id = ?"]
+        params: List = [user_id]
+        if after is not None:
+            operator = "<" if descending else ">"
+            placeholders = ", ".join("?" * len(columns))
+            clauses.append(
+                f"({', '.join(columns)}) {operator} ({placeholders})"
+            )
+            params.extend(after)
+        if prefix:
+            clauses.append("name >= ? AND name < ?")
+            params.extend([prefix, prefix + "\U0010ffff"])
+        if query:
+            clauses.append(
+                "instr(lower(substr(name, 1, length(name) - ?)), lower(?)) > 0"
+            )
+            params.extend([len(FLOW_FILE_EXTENSION), query])
+        order = ", ".join(f"{column} {direction}" for column in columns)
+        sql = (
+            f"SELECT {ENTRY_COLUMNS} FROM flows "
+            f"WHERE {' AND '.join(clauses)} ORDER BY {order}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        with self._connection() as conn:
+            entries = [FlowEntry(*row) for row in conn.execute(sql, params)]
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            return entries, sort_key(entries[-1], sort)
+        return entries, None
+
+    def listing_stamp(self, user_id: str) -> Tuple:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT generation FROM workspaces WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        return (row[0] if row else 0,)
+
+    def stat(self, user_id: str, filename: str) -> FlowEntry:
+        with self._connection() as conn:
+            row = conn.execute(
+                f"SELECT {ENTRY_COLUMNS} FROM flows "
+                "WHERE user_id = ? AND name = ?",
+                (user_id, filename),
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"File {filename} not found")
+        return FlowEntry(*row)
+
+    def read(self, user_id: str, filename: str) -> Tuple[bytes, int]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT content, version FROM flows "
+                "WHERE user_id = ? AND name = ?",
+                (user_id, filename),
+            ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"File {filename} not found")
+        return bytes(row[0]), row[1]
+
+    def staging_dir(self, user_id: str) -> str:
+        staging_dir = os.path.join(self.workspace_root, user_id)
+        os.makedirs(staging_dir, exist_ok=True)
+        return staging_dir
+
+    def create(self, user_id: str, filename: str, staged_path: str) -> int:
+        try:
+            return self.import_flow(user_id, filename, staged_path)
+        finally:
+            os.remove(staged_path)
+
+    def import_flow(
+        self,
+        user_id: str,
+        filename: str,
+        source_path: str,
+        version: int = 1,
+        last_edit: Optional[str] = None,
+    ) -> int:
+        with self._transaction() as conn:
+            if self._current_version(conn, user_id, filename) is not None:
+                raise FileExistsError(f"File {filename} already exists")
+            self._insert(
+                conn, user_id, filename, source_path, version, last_edit
+            )
+            self._bump_generation(conn, user_id)
+        return version
+
+    def create_many(
+        self, user_id: str, staged: List[Tuple[str, str]]
+    ) -> Tuple[Dict[str, int], List[str]]:
+        created: Dict[str, int] = {}
+        existing: List[str] = []
+        try:
+            with self._transaction() as conn:
+                for filename, staged_path in staged:
+                    if (
+                        self._current_version(conn, user_id, filename)
+                        is not None
+                    ):
+                        existing.append(filename)
+                        continue
+                    self._insert(conn, user_id, filename, staged_path)
+                    created[filename] = 1
+                if created:
+                    self._bump_generation(conn, user_id)
+        finally:
+            for _, staged_path in staged:
+                os.remove(staged_path)
+        return created, existing
+
+    def _insert(
+        self,
+        conn: sqlite3.Connection,
+        user_id: str,
+        filename: str,
+        source_path: str,
+        version: int = 1,
+        last_edit: Optional[str] = None,
+    ) -> None:
+        size = os.path.getsize(source_path)
+        cursor = conn.execute(
+            "INSERT INTO flows (user_id, name, last_edit, version, size, "
+            "mtime_ns, content) VALUES (?, ?, ?, ?, ?, ?, zeroblob(?))",
+            (
+                user_id,
+                filename,
+                last_edit or datetime.now().isoformat(),
+                version,
+                size,
+                time.time_ns(),
+                size,
+            ),
+        )
+        # Copy the staged file in chunks rather than as one bytes object.
+        if size:
+            with conn.blobopen("flows", "content", cursor.lastrowid) as blob:
+                with open(source_path, "rb") as f:
+                    while True:
+                        chunk = f.read(COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        blob.write(chunk)
+
+    def write(
+        self,
+        user_id: str,
+        filename: str,
+        data: bytes,
+        expected_version: Optional[int] = None,
+        version: Optional[int] = None,
+    ) -> int:
+        with self._transaction() as conn:
+            current_version = self._current_version(conn, user_id, filename)
+            if current_version is None:
+                raise FileNotFoundError(f"File {filename} not found")
+            if (
+                expected_version is not None
+                and expected_version != current_version
+            ):
+                raise VersionConflictError(current_version)
+            if version is None:
+                version = current_version + 1
+            conn.execute(
+                "UPDATE flows SET content = ?, size = ?, version = ?, "
+                "last_edit = ?, mtime_ns = ? WHERE user_id = ? AND name = ?",
+                (
+                    data,
+                    len(data),
+                    version,
+                    datetime.now().isoformat(),
+                    time.time_ns(),
+                    user_id,
+                    filename,
+                ),
+            )
+            self._bump_generation(conn, user_id)
+        return version
+
+    def rewrite(
+        self, user_id: str, filename: str, data: bytes, expected: FlowEntry
+    ) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE flows SET content = ?, size = ?, mtime_ns = ? "
+                "WHERE user_id = ? AND name = ? AND version = ? "
+                "AND mtime_ns = ?",
+                (
+                    data,
+                    len(data),
+                    time.time_ns(),
+                    user_id,
+                    filename,
+                    expected.version,
+                    expected.mtime_ns,
+                ),
+            )
+            if cursor.rowcount:
+                self._bump_generation(conn, user_id)
+        return cursor.rowcount > 0
+
+    def delete(self, user_id: str, filename: str) -> None:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM flows WHERE user_id = ? AND name = ?",
+                (user_id, filename),
+            )
+            if cursor.rowcount == 0:
+                raise FileNotFoundError(f"File {filename} not found")
+            self._bump_generation(conn, user_id)
+        with self._touches_lock:
+            self._touches.pop((user_id, filename), None)
+
+    def touch(self, user_id: str, filename: str) -> None:
+        with self._touches_lock:
+            self._touches[(user_id, filename)] = datetime.now().isoformat()
+        self._touched.set()
+
+    def flush_touches(self) -> None:
+        with self._touches_lock:
+            touches, self._touches = self._touches, {}
+        if not touches:
+            return
+        # A write since the touch already moved last_edit past it.
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE flows SET last_edit = ? "
+                "WHERE user_id = ? AND name = ? AND last_edit < ?",
+                [
+                    (last_edit, user_id, filename, last_edit)
+                    for (user_id, filename), last_edit in touches.items()
+                ],
+            )
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._touched.wait()
+            self._stopped.wait(self.touch_interval)
+            self._touched.clear()
+            try:
+                self.flush_touches()
+            except sqlite3.Error as e:
+                logger.error(f"Could not record last-edit times: {e}")
+
+    def delete_user(self, user_id: str) -> None:
+        with self._touches_lock:
+            for key in [key for key in self._touches if key[0] == user_id]:
+                del self._touches[key]
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM flows WHERE user_id = ?", (user_id,))
+            conn.execute(
+                "DELETE FROM workspaces WHERE user_id = ?", (user_id,)
+            )
+        remove_tree(self.workspace_root, user_id)
+
+    def close(self) -> None:
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._touched.set()
+            self._flusher.join()
+            self.flush_touches()
+        with self._pool_lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
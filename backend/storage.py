@@ -0,0 +1,483 @@
+import os
+import uuid
+import shutil
+import tempfile
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from metadata_index import (
+    MetadataIndex,
+    METADATA_FILENAME,
+    DEFAULT_FLUSH_INTERVAL,
+)
+from listing import SortedListing, page_entries
+from metrics import timed
+
+FLOW_FILE_EXTENSION = ".flow.json"
+TRASH_DIRNAME = ".trash"
+
+
+class FileExistsError(Exception):
+    pass
+
+
+class VersionConflictError(Exception):
+    def __init__(self, current_version: int):
+        super().__init__(
+            f"Flow has changed since version was read "
+            f"(current version is {current_version})"
+        )
+        self.current_version = current_version
+
+
+class FlowEntry(NamedTuple):
+    filename: str
+    last_edit: Optional[str]
+    version: int
+    size: int
+    mtime_ns: int
+
+
+def remove_tree(workspace_root: str, user_id: str) -> None:
+    # Renames the tree out of the way first, so it vanishes at once for
+    # every reader, then removes it in a single rmtree.
+    trash = os.path.join(workspace_root, TRASH_DIRNAME)
+    os.makedirs(trash, exist_ok=True)
+    doomed = os.path.join(trash, f"{user_id}-{uuid.uuid4().hex}")
+    try:
+        os.rename(os.path.join(workspace_root, user_id), doomed)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(doomed, ignore_errors=True)
+
+
+# Where FileManager keeps flows. Filenames reaching a backend are already
+# sanitized and carry FLOW_FILE_EXTENSION; content is opaque bytes.
+class StorageBackend:
+    def list_users(self) -> List[str]:
+        raise NotImplementedError
+
+    def list_entries(self, user_id: str) -> List[FlowEntry]:
+        raise NotImplementedError
+
+    def list_page(
+        self,
+        user_id: str,
+        sort: str = "name",
+        descending: bool = False,
+        after: Optional[Tuple[str, ...]] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List[FlowEntry], Optional[Tuple[str, ...]]]:
+        # Returns the page and the sort key to continue after, if any.
+        return page_entries(
+            self.list_entries(user_id),
+            sort,
+            descending,
+            after,
+            limit,
+            prefix,
+            query,
+        )
+
+    def listing_stamp(self, user_id: str) -> Tuple:
+        raise NotImplementedError
+
+    def stat(self, user_id: str, filename: str) -> FlowEntry:
+        raise NotImplementedError
+
+    def read(self, user_id: str, filename: str) -> Tuple[bytes, int]:
+        raise NotImplementedError
+
+    def staging_dir(self, user_id: str) -> str:
+        raise NotImplementedError
+
+    def create(self, user_id: str, filename: str, staged_path: str) -> int:
+        # Takes ownership of ``staged_path``, a file inside staging_dir().
+        raise NotImplementedError
+
+    def create_many(
+        self, user_id: str, staged: List[Tuple[str, str]]
+    ) -> Tuple[Dict[str, int], List[str]]:
+        # Creates each (filename, staged_path) pair, taking ownership of all
+        # staged paths. Returns the new versions and the names that existed.
+        created: Dict[str, int] = {}
+        existing: List[str] = []
+        for filename, staged_path in staged:
+            try:
+                created[filename] = self.create(user_id, filename, staged_path)
+            except FileExistsError:
+                existing.append(filename)
+        return created, existing
+
+    def write(
+        self,
+        user_id: str,
+        filename: str,
+        data: bytes,
+        expected_version: Optional[int] = None,
+        version: Optional[int] = None,
+    ) -> int:
+        # Stores ``data`` as ``version`` if given, as the next version
+        # otherwise, and returns the version stored.
+        raise NotImplementedError
+
+    def rewrite(
+        self, user_id: str, filename: str, data: bytes, expected: FlowEntry
+    ) -> bool:
+        # Replaces the stored bytes with an equivalent encoding, keeping the
+        # version and last-edit time. Returns False, writing nothing, if the
+        # flow changed since ``expected`` was read.
+        raise NotImplementedError
+
+    def delete(self, user_id: str, filename: str) -> None:
+        raise NotImplementedError
+
+    def touch(self, user_id: str, filename: str) -> None:
+        raise NotImplementedError
+
+    def delete_user(self, user_id: str) -> None:
+        # Removes every flow of the user, and the workspace directory.
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+# One <name>.flow.json file per flow under <workspace_root>/<user_id>/, plus
+# a metadata.json sidecar with last-edit times and versions. With ``fsync``,
+# a write is on disk, directory entry included, before it returns.
+class FilesystemStorage(StorageBackend):
+    def __init__(
+        self,
+        workspace_root: str,
+        metadata_flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        fsync: bool = False,
+    ) -> None:
+        self.workspace_root = workspace_root
+        self.fsync = fsync
+        self.metadata = MetadataIndex(
+            workspace_root,
+            metadata_flush_interval,
+            fsync,
+            on_write=self._metadata_written,
+        )
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._listings: Dict[str, SortedListing] = {}
+        self._listings_lock = threading.RLock()
+        # Bumped whenever a cached listing is rebuilt or changed, so that
+        # the listing stamp moves with its content rather than with the
+        # directory mtime, which our own temp and metadata files also move.
+        # The epoch tells these counters apart across restarts.
+        self._epoch = uuid.uuid4().hex[:8]
+        self._generations: Dict[str, int] = {}
+
+    def _workspace(self, user_id: str) -> str:
+        # Only created by the first write, so that reads by users who never
+        # store anything (most guests) leave no directory behind.
+        return os.path.join(self.workspace_root, user_id)
+
+    def _directory_stamp(self, user_id: str) -> int:
+        try:
+            return os.stat(self._workspace(user_id)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _path(self, user_id: str, filename: str) -> str:
+        return os.path.join(self._workspace(user_id), filename)
+
+    def _lock_for(self, user_id: str, filename: str) -> threading.Lock:
+        return self._locks[hash((user_id, filename)) % len(self._locks)]
+
+    def _write_atomic(self, file_path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(file_path), prefix=".write-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if self.fsync:
+            dir_fd = os.open(os.path.dirname(file_path), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def list_users(self) -> List[str]:
+        with os.scandir(self.workspace_root) as entries:
+            return [
+                entry.name
+                for entry in entries
+                if entry.is_dir() and not entry.name.startswith(".")
+            ]
+
+    @timed("scan")
+    def _scan(self, user_id: str) -> List[FlowEntry]:
+        metadata = self.metadata.get_all(user_id)
+        result = []
+        # One scandir pass; DirEntry.stat() is served from the directory
+        # read where the platform allows it and costs one stat otherwise.
+        try:
+            scan = os.scandir(self._workspace(user_id))
+        except FileNotFoundError:
+            return result
+        with scan as entries:
+            for entry in entries:
+                if (
+                    not entry.name.endswith(FLOW_FILE_EXTENSION)
+                    or entry.name == METADATA_FILENAME
+                ):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                meta = metadata.get(entry.name, {})
+                result.append(
+                    FlowEntry(
+                        entry.name,
+                        meta.get("last_edit"),
+                        meta.get("version", 0),
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+                )
+        return result
+
+    def _bump_generation(self, user_id: str) -> None:
+        # Called with the listings lock held.
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def _listing(self, user_id: str) -> SortedListing:
+        # Rebuilt only when the directory changed behind our back: our own
+        # mutations keep it current through _refresh_listing, and record the
+        # directory mtime they leave, as do metadata writes.
+        stamp = self._directory_stamp(user_id)
+        with self._listings_lock:
+            listing = self._listings.get(user_id)
+            if listing is None or listing.stamp != stamp:
+                listing = SortedListing(self._scan(user_id), stamp)
+                self._listings[user_id] = listing
+                self._bump_generation(user_id)
+            return listing
+
+    def _metadata_written(self, user_id: str, before: int) -> None:
+        # A listing that was current before metadata.json was replaced is
+        # still current after it; one that was not is left to be rebuilt.
+        with self._listings_lock:
+            listing = self._listings.get(user_id)
+            if listing is not None and listing.stamp == before:
+                listing.stamp = self._directory_stamp(user_id)
+
+    def _refresh_listing(self, user_id: str, filename: str) -> None:
+        with self._listings_lock:
+            listing = self._listings.get(user_id)
+            if listing is None:
+                return
+            try:
+                entry = self.stat(user_id, filename)
+            except FileNotFoundError:
+                listing.remove(filename)
+            else:
+                listing.put(entry)
+            listing.stamp = self._directory_stamp(user_id)
+            self._bump_generation(user_id)
+
+    def list_entries(self, user_id: str) -> List[FlowEntry]:
+        with self._listings_lock:
+            return list(self._listing(user_id).entries.values())
+
+    def list_page(
+        self,
+        user_id: str,
+        sort: str = "name",
+        descending: bool = False,
+        after: Optional[Tuple[str, ...]] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List[FlowEntry], Optional[Tuple[str, ...]]]:
+        with self._listings_lock:
+            return self._listing(user_id).page(
+                sort, descending, after, limit, prefix, query
+            )
+
+    def listing_stamp(self, user_id: str) -> Tuple:
+        # The listing generation moves whenever the set of flows, their
+        # sizes or mtimes change (checked against the directory first), the
+        # metadata generation on every recorded edit.
+        with self._listings_lock:
+            self._listing(user_id)
+            return (
+                self._epoch,
+                self._generations.get(user_id, 0),
+                self.metadata.generation(user_id),
+            )
+
+    def stat(self, user_id: str, filename: str) -> FlowEntry:
+        try:
+            stat = os.stat(self._path(user_id, filename))
+        except OSError:
+            raise FileNotFoundError(f"File {filename} not found")
+        meta = self.metadata.get(user_id, filename) or {}
+        return FlowEntry(
+            filename,
+            meta.get("last_edit"),
+            meta.get("version", 0),
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def read(self, user_id: str, filename: str) -> Tuple[bytes, int]:
+        file_path = self._path(user_id, filename)
+        with self._lock_for(user_id, filename):
+            try:
+                with open(file_path, "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                raise FileNotFoundError(f"File {filename} not found")
+            return content, self.metadata.get_version(user_id, filename)
+
+    def staging_dir(self, user_id: str) -> str:
+        workspace = self._workspace(user_id)
+        os.makedirs(workspace, exist_ok=True)
+        return workspace
+
+    def create(self, user_id: str, filename: str, staged_path: str) -> int:
+        file_path = self._path(user_id, filename)
+        with self._lock_for(user_id, filename):
+            if os.path.exists(file_path):
+                os.remove(staged_path)
+                raise FileExistsError(f"File {filename} already exists")
+            os.replace(staged_path, file_path)
+            version = self.metadata.bump_version(user_id, filename)
+        self._refresh_listing(user_id, filename)
+        return version
+
+    def create_many(
+        self, user_id: str, staged: List[Tuple[str, str]]
+    ) -> Tuple[Dict[str, int], List[str]]:
+        created: Dict[str, int] = {}
+        existing: List[str] = []
+        for filename, staged_path in staged:
+            file_path = self._path(user_id, filename)
+            with self._lock_for(user_id, filename):
+                if os.path.exists(file_path):
+                    os.remove(staged_path)
+                    existing.append(filename)
+                    continue
+                os.replace(staged_path, file_path)
+                created[filename] = self.metadata.bump_version(
+                    user_id, filename
+                )
+        # One rescan on the next listing instead of a refresh per flow.
+        with self._listings_lock:
+            self._listings.pop(user_id, None)
+        return created, existing
+
+    def write(
+        self,
+        user_id: str,
+        filename: str,
+        data: bytes,
+        expected_version: Optional[int] = None,
+        version: Optional[int] = None,
+    ) -> int:
+        file_path = self._path(user_id, filename)
+        with self._lock_for(user_id, filename):
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(f"File {filename} not found")
+            current_version = self.metadata.get_version(user_id, filename)
+            if (
+                expected_version is not None
+                and expected_version != current_version
+            ):
+                raise VersionConflictError(current_version)
+            self._write_atomic(file_path, data)
+            version = self.metadata.bump_version(
+                user_id, filename, version=version
+            )
+        self._refresh_listing(user_id, filename)
+        return version
+
+    def rewrite(
+        self, user_id: str, filename: str, data: bytes, expected: FlowEntry
+    ) -> bool:
+        file_path = self._path(user_id, filename)
+        with self._lock_for(user_id, filename):
+            try:
+                current = self.stat(user_id, filename)
+            except FileNotFoundError:
+                return False
+            if (current.version, current.mtime_ns) != (
+                expected.version,
+                expected.mtime_ns,
+            ):
+                return False
+            self._write_atomic(file_path, data)
+        self._refresh_listing(user_id, filename)
+        return True
+
+    def delete(self, user_id: str, filename: str) -> None:
+        file_path = self._path(user_id, filename)
+        with self._lock_for(user_id, filename):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"File {filename} not found")
+            self.metadata.remove(user_id, filename)
+        self._refresh_listing(user_id, filename)
+
+    def touch(self, user_id: str, filename: str) -> None:
+        self.metadata.touch(user_id, filename)
+        self._refresh_listing(user_id, filename)
+
+    def delete_user(self, user_id: str) -> None:
+        self.metadata.forget(user_id)
+        with self._listings_lock:
+            self._listings.pop(user_id, None)
+        remove_tree(self.workspace_root, user_id)
+
+    def close(self) -> None:
+        self.metadata.close()
+
+
+def create_storage(
+    backend: str,
+    workspace_root: str,
+    metadata_flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    sqlite_path: Optional[str] = None,
+    fsync: bool = False,
+    coalesce_window: float = 0,
+) -> StorageBackend:
+    # A positive ``coalesce_window`` wraps the backend so that bursts of
+    # writes to one flow reach it as a single write; those writes are worth
+    # making durable, so the window turns ``fsync`` on.
+    fsync = fsync or coalesce_window > 0
+    if backend == "filesystem":
+        storage: StorageBackend = FilesystemStorage(
+            workspace_root, metadata_flush_interval, fsync
+        )
+    elif backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+
+        storage = SQLiteStorage(
+            sqlite_path or os.path.join(workspace_root, "workstation.db"),
+            workspace_root,
+            fsync,
+            metadata_flush_interval,
+        )
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if coalesce_window > 0:
+        from write_coalescing import CoalescingStorage
+
+        storage = CoalescingStorage(storage, coalesce_window)
+    return storage
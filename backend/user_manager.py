@@ -1,9 +1,20 @@
 import os
 from flask import session, Flask, url_for
 from authlib.integrations.flask_client import OAuth  # type: ignore
+from loguru import logger
 from werkzeug.utils import secure_filename
-from typing import Optional
-import requests  # type: ignore
+from typing import Callable, Dict, Optional
+from http_client import (
+    HTTPClient,
+    PooledOAuth2App,
+    TTLCache,
+    client_from_env,
+    metadata_cache_from_env,
+    token_cache_key,
+    DEFAULT_PROFILE_TTL,
+)
+from log_config import summarize
+from guest_workspaces import LEGACY_GUEST_ID, new_guest_id
 
 
 class OAuthConfigError(Exception):
@@ -11,12 +22,20 @@ class OAuthConfigError(Exception):
 
 
 class UserManager:
-    def __init__(self, app: Flask, workspace_root: str) -> None:
+    def __init__(
+        self,
+        app: Flask,
+        workspace_root: str,
+        http_client: Optional[HTTPClient] = None,
+    ) -> None:
         self.app = app
         self.workspace_root = workspace_root
-        self.guest_workspace = os.path.join(workspace_root, "guest")
-        os.makedirs(self.guest_workspace, exist_ok=True)
         self.oauth = OAuth(app)
+        self.http_client = http_client or client_from_env()
+        self.metadata_cache = metadata_cache_from_env(self.http_client)
+        self.profile_cache = TTLCache(
+            float(os.environ.get("OAUTH_PROFILE_TTL", DEFAULT_PROFILE_TTL))
+        )
 
         github_client_id = os.environ.get("GITHUB_CLIENT_ID")
         github_client_secret = os.environ.get("GITHUB_CLIENT_SECRET")
@@ -29,13 +48,23 @@ class UserManager:
             name="github",
             client_id=github_client_id,
             client_secret=github_client_secret,
-            access_token_url="https://github.com/login/oauth/access_token",
+            access_token_url=os.environ.get(
+                "GITHUB_ACCESS_TOKEN_URL",
+                "https://github.com/login/oauth/access_token",
+            ),
             access_token_params=None,
-            authorize_url="https://github.com/login/oauth/authorize",
+            authorize_url=os.environ.get(
+                "GITHUB_AUTHORIZE_URL",
+                "https://github.com/login/oauth/authorize",
+            ),
             authorize_params=None,
-            api_base_url="https://api.github.com/",
+            api_base_url=os.environ.get(
+                "GITHUB_API_BASE_URL", "https://api.github.com/"
+            ),
             client_kwargs={"scope": "user:email"},
+            client_cls=PooledOAuth2App,
         )
+        self.github_proxy.configure(self.http_client)
 
         google_client_id = os.environ.get("GOOGLE_CLIENT_ID")
         google_client_secret = os.environ.get("GOOGLE_CLIENT_SECRET")
@@ -48,14 +77,30 @@ class UserManager:
             name="google",
             client_id=google_client_id,
             client_secret=google_client_secret,
-            server_metadata_url=(
-                "https://accounts.google.com/.well-known/openid-configuration"
+            server_metadata_url=os.environ.get(
+                "GOOGLE_DISCOVERY_URL",
+                "https://accounts.google.com/.well-known/openid-configuration",
             ),
             client_kwargs={
                 "scope": "openid email profile",
                 "prompt": "select_account",
             },
+            client_cls=PooledOAuth2App,
         )
+        self.google_proxy.configure(self.http_client, self.metadata_cache)
+
+    def close(self) -> None:
+        self.http_client.close()
+
+    def fetch_profile(
+        self, provider: str, token: dict, fetch: Callable[[], Dict]
+    ) -> Dict:
+        key = token_cache_key(provider, token["access_token"])
+        profile = self.profile_cache.get(key)
+        if profile is None:
+            profile = fetch()
+            self.profile_cache.set(key, profile)
+        return profile
 
     def create_user_workspace(self, user_id: str) -> str:
         user_workspace = os.path.join(
@@ -65,22 +110,24 @@ class UserManager:
         return user_workspace
 
     def initialize_session(self) -> str:
-        if "user_id" not in session:
+        # Sessions from before per-session guest workspaces all shared
+        # LEGACY_GUEST_ID; they start over in a workspace of their own.
+        user_id = session.get("user_id", LEGACY_GUEST_ID)
+        if user_id == LEGACY_GUEST_ID:
             return self.create_guest_session()
-        return session["user_id"]
+        return user_id
 
     def create_guest_session(self) -> str:
-        session["user_id"] = "guest"
+        # Each guest gets a private workspace, removed by the GuestReaper
+        # once it has been idle long enough.
+        session["user_id"] = new_guest_id()
         session["user_type"] = "guest"
         session["user_name"] = "Guest"
         session["avatar_url"] = None
         return session["user_id"]
 
     def get_user_workspace(self, user_id: str) -> str:
-        if user_id == "guest":
-            return self.guest_workspace
-        else:
-            return os.path.join(self.workspace_root, secure_filename(user_id))
+        return os.path.join(self.workspace_root, secure_filename(user_id))
 
     def login_github(self):
         if not self.github_proxy:
@@ -92,14 +139,18 @@ class UserManager:
         if not self.github_proxy:
             raise OAuthConfigError("Github OAuth not configured")
         token = self.github_proxy.authorize_access_token()
-        resp = self.github_proxy.get("user", token=token)
-        profile = resp.json()
-        print("Profile:", profile)
+
+        def fetch() -> Dict:
+            resp = self.github_proxy.get("user", token=token)
+            resp.raise_for_status()
+            return resp.json()
+
+        profile = self.fetch_profile("github", token, fetch)
+        logger.debug(f"GitHub profile: {summarize(profile)}")
         session["user_id"] = f"github_{profile['id']}"
         session["user_type"] = "github"
-        session["user_name"] = profile.get('login')
+        session["user_name"] = profile.get("login")
         session["avatar_url"] = profile.get("avatar_url")
-        print("Session after:", session)
         self.create_user_workspace(session["user_id"])
         return session["user_id"]
 
@@ -113,11 +164,17 @@ class UserManager:
         if not self.google_proxy:
             raise OAuthConfigError("Google OAuth not configured")
         token = self.google_proxy.authorize_access_token()
-        resp = requests.get(
-            "https://www.googleapis.com/oauth2/v3/userinfo",
-            headers={"Authorization": f'Bearer {token["access_token"]}'},
-        )
-        user_info = resp.json()
+
+        def fetch() -> Dict:
+            userinfo_url = self.google_proxy.load_server_metadata().get(
+                "userinfo_endpoint",
+                "https://www.googleapis.com/oauth2/v3/userinfo",
+            )
+            resp = self.google_proxy.get(userinfo_url, token=token)
+            resp.raise_for_status()
+            return resp.json()
+
+        user_info = self.fetch_profile("google", token, fetch)
 
         session["user_id"] = f"google_{user_info['sub']}"
         session["user_type"] = "google"
@@ -133,21 +190,6 @@ class UserManager:
             return user_id
         return None
 
-    def cleanup_guest_workspace(self, user_id: str) -> None:
-        if user_id.startswith("guest_"):
-            user_workspace = os.path.join(
-                self.workspace_root, secure_filename(user_id)
-            )
-            if os.path.exists(user_workspace):
-                for root, dirs, files in os.walk(
-                    user_workspace, topdown=False
-                ):
-                    for name in files:
-                        os.remove(os.path.join(root, name))
-                    for name in dirs:
-                        os.rmdir(os.path.join(root, name))
-                os.rmdir(user_workspace)
-
     def get_user_info(self) -> dict:
         return {
             "user_id": session.get("user_id"),
@@ -0,0 +1,338 @@
+import time
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from storage import StorageBackend, FlowEntry, VersionConflictError
+from metrics import REGISTRY, timer
+
+
+DEFAULT_COALESCE_WINDOW = 1.0
+
+COALESCED_WRITES = REGISTRY.counter(
+    "workstation_coalesced_writes_total",
+    "Writes absorbed into a pending write instead of reaching storage.",
+)
+PENDING_WRITES = REGISTRY.gauge(
+    "workstation_pending_writes",
+    "Flows with a write waiting to be flushed to storage.",
+)
+LOST_WRITES = REGISTRY.counter(
+    "workstation_lost_writes_total",
+    "Acknowledged writes that could not be flushed to storage, by cause.",
+    ("cause",),
+)
+
+
+# Raised by the next write to a flow whose acknowledged write was lost: the
+# client saved on top of content that never reached storage.
+class LostWriteError(VersionConflictError):
+    def __init__(self, current_version: int):
+        super().__init__(current_version)
+        self.args = (
+            f"Earlier changes to this flow could not be saved (stored "
+            f"version is {current_version})",
+        )
+
+
+class PendingWrite:
+    def __init__(
+        self, data: bytes, version: int, base_version: int, due: float
+    ) -> None:
+        self.data = data
+        self.version = version
+        # The stored version the burst started from; the flush is refused
+        # if storage moved past it behind our back.
+        self.base_version = base_version
+        self.due = due
+        self.last_edit = datetime.now().isoformat()
+        self.mtime_ns = time.time_ns()
+
+    def entry(self, filename: str) -> FlowEntry:
+        return FlowEntry(
+            filename,
+            self.last_edit,
+            self.version,
+            len(self.data),
+            self.mtime_ns,
+        )
+
+
+# Wraps a backend so that rapid saves of one flow are absorbed in memory: a
+# write is acknowledged with its new version at once and the latest bytes
+# reach the backend in a single write ``window`` seconds after the first
+# write of the burst. Reads, stats and listings see pending writes, so the
+# delay only shows from other processes; run one worker per workspace with
+# coalescing on. ``close`` flushes whatever is pending.
+#
+# A flush storage refuses (the flow was deleted or changed elsewhere) loses
+# writes that were already acknowledged. ``on_lost`` is told, and the next
+# write to a flow that was changed elsewhere fails with LostWriteError
+# instead of silently building on content the client never had.
+class CoalescingStorage(StorageBackend):
+    def __init__(
+        self,
+        inner: StorageBackend,
+        window: float = DEFAULT_COALESCE_WINDOW,
+        on_lost: Optional[Callable[[str, str, Optional[int]], None]] = None,
+    ) -> None:
+        self.inner = inner
+        self.window = window
+        self.on_lost = on_lost
+        self._pending: Dict[Tuple[str, str], PendingWrite] = {}
+        # Flows whose pending write was refused, with the stored version.
+        self._lost: Dict[Tuple[str, str], int] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._run, name="write-coalescer", daemon=True
+        )
+        self._flusher.start()
+
+    def _overlay(self, user_id: str, entry: FlowEntry) -> FlowEntry:
+        pending = self._pending.get((user_id, entry.filename))
+        return entry if pending is None else pending.entry(entry.filename)
+
+    def list_users(self) -> List[str]:
+        return self.inner.list_users()
+
+    def list_entries(self, user_id: str) -> List[FlowEntry]:
+        entries = self.inner.list_entries(user_id)
+        with self._lock:
+            return [self._overlay(user_id, entry) for entry in entries]
+
+    def list_page(
+        self,
+        user_id: str,
+        sort: str = "name",
+        descending: bool = False,
+        after: Optional[Tuple[str, ...]] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List[FlowEntry], Optional[Tuple[str, ...]]]:
+        # Pages are ordered by what the backend has; a pending flow moves
+        # to its new last-edit position once it is flushed.
+        entries, last_key = self.inner.list_page(
+            user_id, sort, descending, after, limit, prefix, query
+        )
+        with self._lock:
+            return [self._overlay(user_id, e) for e in entries], last_key
+
+    def listing_stamp(self, user_id: str) -> Tuple:
+        with self._lock:
+            generation = self._generation
+        return self.inner.listing_stamp(user_id) + (generation,)
+
+    def stat(self, user_id: str, filename: str) -> FlowEntry:
+        with self._lock:
+            pending = self._pending.get((user_id, filename))
+            if pending is not None:
+                return pending.entry(filename)
+        return self.inner.stat(user_id, filename)
+
+    def read(self, user_id: str, filename: str) -> Tuple[bytes, int]:
+        with self._lock:
+            pending = self._pending.get((user_id, filename))
+            if pending is not None:
+                return pending.data, pending.version
+        return self.inner.read(user_id, filename)
+
+    def staging_dir(self, user_id: str) -> str:
+        return self.inner.staging_dir(user_id)
+
+    def create(self, user_id: str, filename: str, staged_path: str) -> int:
+        return self.inner.create(user_id, filename, staged_path)
+
+    def create_many(
+        self, user_id: str, staged: List[Tuple[str, str]]
+    ) -> Tuple[Dict[str, int], List[str]]:
+        return self.inner.create_many(user_id, staged)
+
+    def write(
+        self,
+        user_id: str,
+        filename: str,
+        data: bytes,
+        expected_version: Optional[int] = None,
+        version: Optional[int] = None,
+    ) -> int:
+        key = (user_id, filename)
+        with self._lock:
+            lost_version = self._lost.pop(key, None)
+            if lost_version is not None:
+                raise LostWriteError(lost_version)
+            pending = self._pending.get(key)
+            if pending is not None:
+                return self._put(
+                    key, pending, None, data, expected_version, version
+                )
+        # The first write of a burst reads the stored version under the
+        # flush lock, so no flush can move it before the write is queued.
+        with self._flush_lock:
+            stored_version = self.inner.stat(user_id, filename).version
+            with self._lock:
+                return self._put(
+                    key,
+                    self._pending.get(key),
+                    stored_version,
+                    data,
+                    expected_version,
+                    version,
+                )
+
+    def _put(
+        self,
+        key: Tuple[str, str],
+        pending: Optional[PendingWrite],
+        stored_version: Optional[int],
+        data: bytes,
+        expected_version: Optional[int],
+        version: Optional[int],
+    ) -> int:
+        if pending is not None:
+            base_version = pending.base_version
+            current_version = pending.version
+            # A burst is flushed ``window`` after its first write, however
+            # long it goes on.
+            due = pending.due
+            COALESCED_WRITES.inc()
+        else:
+            base_version = current_version = stored_version
+            due = time.monotonic() + self.window
+        if (
+            expected_version is not None
+            and expected_version != current_version
+        ):
+            raise VersionConflictError(current_version)
+        if version is None:
+            version = current_version + 1
+        self._pending[key] = PendingWrite(data, version, base_version, due)
+        self._generation += 1
+        PENDING_WRITES.set(value=len(self._pending))
+        self._wakeup.set()
+        return version
+
+    def rewrite(
+        self, user_id: str, filename: str, data: bytes, expected: FlowEntry
+    ) -> bool:
+        with self._lock:
+            if (user_id, filename) in self._pending:
+                return False
+        return self.inner.rewrite(user_id, filename, data, expected)
+
+    def delete(self, user_id: str, filename: str) -> None:
+        with self._flush_lock:
+            with self._lock:
+                self._lost.pop((user_id, filename), None)
+                if self._pending.pop((user_id, filename), None) is not None:
+                    self._generation += 1
+                    PENDING_WRITES.set(value=len(self._pending))
+            self.inner.delete(user_id, filename)
+
+    def touch(self, user_id: str, filename: str) -> None:
+        self.inner.touch(user_id, filename)
+
+    def delete_user(self, user_id: str) -> None:
+        with self._flush_lock:
+            with self._lock:
+                for key in [key for key in self._pending if key[0] == user_id]:
+                    del self._pending[key]
+                for key in [key for key in self._lost if key[0] == user_id]:
+                    del self._lost[key]
+                self._generation += 1
+                PENDING_WRITES.set(value=len(self._pending))
+            self.inner.delete_user(user_id)
+
+    def _flush_one(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            pending = self._pending.get(key)
+        if pending is None:
+            return
+        user_id, filename = key
+        keep = False
+        lost: Optional[Tuple[str, Optional[int]]] = None
+        try:
+            with timer("coalesced_flush"):
+                self.inner.write(
+                    user_id,
+                    filename,
+                    pending.data,
+                    pending.base_version,
+                    pending.version,
+                )
+        except FileNotFoundError:
+            logger.warning(
+                f"Dropping pending write of {filename} for {user_id}: "
+                f"the flow no longer exists"
+            )
+            lost = ("deleted", None)
+        except VersionConflictError as e:
+            logger.error(
+                f"Dropping pending write of {filename} for {user_id}: "
+                f"stored version moved to {e.current_version} elsewhere"
+            )
+            lost = ("conflict", e.current_version)
+        except Exception as e:
+            logger.error(f"Could not flush {filename} for {user_id}: {e}")
+            keep = True
+        with self._lock:
+            if self._pending.get(key) is pending:
+                if keep:
+                    pending.due = time.monotonic() + self.window
+                else:
+                    del self._pending[key]
+            elif not keep and key in self._pending:
+                # Writes that arrived during the flush build on it, or are
+                # lost with it.
+                if lost is None:
+                    self._pending[key].base_version = pending.version
+                else:
+                    del self._pending[key]
+            if lost is not None and lost[1] is not None:
+                self._lost[key] = lost[1]
+            self._generation += 1
+            PENDING_WRITES.set(value=len(self._pending))
+        if lost is not None:
+            LOST_WRITES.inc(lost[0])
+            if self.on_lost is not None:
+                try:
+                    self.on_lost(user_id, filename, lost[1])
+                except Exception as e:
+                    logger.error(f"Lost write handler failed: {e}")
+
+    def flush(self, due_only: bool = False) -> None:
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                keys = [
+                    key
+                    for key, pending in self._pending.items()
+                    if not due_only or pending.due <= now
+                ]
+            for key in keys:
+                self._flush_one(key)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            with self._lock:
+                if not self._pending:
+                    self._wakeup.clear()
+                    continue
+                delay = min(p.due for p in self._pending.values())
+                delay -= time.monotonic()
+            if delay > 0:
+                self._stopped.wait(delay)
+            self.flush(due_only=True)
+
+    def close(self) -> None:
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._wakeup.set()
+            self._flusher.join()
+            self.flush()
+        self.inner.close()
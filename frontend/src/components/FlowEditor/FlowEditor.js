@@ -27,6 +27,23 @@ const api = axios.create({
   withCredentials: true,
 });
 
+// Build a node/edge diff between the last saved flow and the current one, so a
+// save only sends what changed.
+const diffItems = (previous = [], current = []) => {
+  const previousById = new Map(previous.map((item) => [item.id, JSON.stringify(item)]));
+  const currentIds = new Set(current.map((item) => item.id));
+  return {
+    upsert: current.filter((item) => previousById.get(item.id) !== JSON.stringify(item)),
+    remove: previous.filter((item) => !currentIds.has(item.id)).map((item) => item.id),
+  };
+};
+
+const diffFlow = (previous, current) => ({
+  nodes: diffItems(previous.nodes, current.nodes),
+  edges: diffItems(previous.edges, current.edges),
+  set: { viewport: current.viewport },
+});
+
 // Node components (simplified for brevity)
 const BaseNode = ({ data }) => (
   <div style={{
@@ -182,7 +199,7 @@ const NodePanel = ({ node, onClose, onUpdate }) => {
 // FlowEditor component
 const FlowEditor = () => {
 
-  const { currentProject, projectContent, setProjectContent } = useProject();
+  const { currentProject, projectContent, setProjectContent, projectVersion, setProjectVersion } = useProject();
 
 
   const [nodes, setNodes, onNodesChange] = useNodesState([]);
@@ -290,9 +307,15 @@ const FlowEditor = () => {
       console.log('Saving flow:', flow);
       console.log(JSON.stringify(flow))
       try {
-        const response = await api.put(`/api/files/${currentProject}`, flow);
+        const response = projectContent && projectVersion
+          ? await api.patch(`/api/files/${currentProject}`, {
+              version: projectVersion,
+              diff: diffFlow(projectContent, flow),
+            })
+          : await api.put(`/api/files/${currentProject}`, flow);
 
         if (response.status === 200) {
+          setProjectVersion(response.data.version);
           setProjectContent(flow);
           message.success('Flow saved successfully');
         } else {
@@ -303,6 +326,8 @@ const FlowEditor = () => {
         if (error.response) {
           if (error.response.status === 404) {
             message.error('Failed to save flow: File not found');
+          } else if (error.response.status === 409) {
+            message.error('Failed to save flow: It was changed elsewhere, reopen the project to get the latest version');
           } else if (error.response.status === 400) {
             message.error('Failed to save flow: Invalid content');
           } else {
@@ -315,7 +340,7 @@ const FlowEditor = () => {
         }
       }
     }
-  }, [rfInstance, currentProject]);
+  }, [rfInstance, currentProject, projectContent, projectVersion, setProjectContent, setProjectVersion]);
 
 
   const handleRun = () => {
@@ -13,6 +13,7 @@ export const ProjectProvider = ({ children }) => {
     const { user } = useAuth();
     const [currentProject, setCurrentProject] = useState(null);
     const [projectContent, setProjectContent] = useState(null);
+    const [projectVersion, setProjectVersion] = useState(null);
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
 
@@ -20,6 +21,7 @@ export const ProjectProvider = ({ children }) => {
         if (!user) {
             setCurrentProject(null);
             setProjectContent(null);
+            setProjectVersion(null);
             setError(null);
         }
     }, [user]);
@@ -35,6 +37,7 @@ export const ProjectProvider = ({ children }) => {
             const response = await api.get(`/api/files/${projectName}`);
             setCurrentProject(projectName);
             setProjectContent(response.data.content);
+            setProjectVersion(response.data.version);
         } catch (error) {
             console.error('Error opening project:', error);
             setError('Failed to open project');
@@ -46,6 +49,7 @@ export const ProjectProvider = ({ children }) => {
     const closeProject = useCallback(() => {
         setCurrentProject(null);
         setProjectContent(null);
+        setProjectVersion(null);
         setError(null);
     }, []);
 
@@ -61,7 +65,8 @@ export const ProjectProvider = ({ children }) => {
         setLoading(true);
         setError(null);
         try {
-            await api.put(`/api/files/${currentProject}`, { content: projectContent });
+            const response = await api.put(`/api/files/${currentProject}`, { content: projectContent });
+            setProjectVersion(response.data.version);
         } catch (error) {
             console.error('Error saving project:', error);
             setError('Failed to save project');
@@ -82,6 +87,9 @@ export const ProjectProvider = ({ children }) => {
     const value = {
         currentProject,
         projectContent,
+        projectVersion,
+        setProjectContent,
+        setProjectVersion,
         loading,
         error,
         openProject,
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, Button, Modal, Input, message, Spin, Typography, Space, Layout } from 'antd';
 import { PlusOutlined, DeleteOutlined, FileOutlined } from '@ant-design/icons';
 import { useAuth } from '../../contexts/AuthContext';
@@ -24,11 +24,70 @@ const HomePage = () => {
   const [isModalVisible, setIsModalVisible] = useState(false);
   const [newFileName, setNewFileName] = useState('');
   const [fetchingFiles, setFetchingFiles] = useState(false);
+  // True while the change feed keeps `files` current.
+  const live = useRef(false);
 
   useEffect(() => {
-    if (user) {
-      fetchFiles();
+    if (!user) {
+      return undefined;
     }
+    let stopped = false;
+    let source = null;
+    // The listing does not depend on the change feed, which only keeps it
+    // current and may be refused or disabled.
+    fetchFiles();
+
+    // Long-poll fallback for when the stream cannot be opened.
+    const poll = async () => {
+      let after = null;
+      while (!stopped) {
+        try {
+          const response = await api.get('/api/events/poll', {
+            params: after ? { after } : {},
+          });
+          live.current = true;
+          // The first poll only returns the current position.
+          if (after !== null && response.data.reset) {
+            await fetchFiles();
+          }
+          response.data.events.forEach(applyChange);
+          after = response.data.last_id;
+        } catch (error) {
+          live.current = false;
+          if (error.response && error.response.status === 404) {
+            // The change feed is disabled.
+            return;
+          }
+          const retryAfter = Number(error.response && error.response.headers['retry-after']);
+          await new Promise((resolve) => setTimeout(resolve, Math.max(retryAfter || 0, 5) * 1000));
+        }
+      }
+    };
+
+    if (typeof EventSource === 'undefined') {
+      poll();
+    } else {
+      source = new EventSource(`${API_URL}/api/events`, { withCredentials: true });
+      source.addEventListener('ready', () => {
+        live.current = true;
+      });
+      source.addEventListener('reset', () => fetchFiles());
+      source.addEventListener('change', (event) => applyChange(JSON.parse(event.data)));
+      source.onerror = () => {
+        // A refused stream is not retried by the browser.
+        if (source.readyState === EventSource.CLOSED) {
+          live.current = false;
+          poll();
+        }
+      };
+    }
+    return () => {
+      stopped = true;
+      live.current = false;
+      if (source) {
+        source.close();
+      }
+    };
   }, [user]);
 
   useEffect(() => {
@@ -50,6 +109,27 @@ const HomePage = () => {
     }
   };
 
+  const applyChange = (change) => {
+    if (change.type === 'conflict') {
+      // A save was acknowledged but never reached storage.
+      message.warning(`Recent changes to ${change.name} could not be saved`);
+      fetchFiles();
+      return;
+    }
+    setFiles((current) => {
+      const others = current.filter((file) => file.name !== change.name);
+      if (change.type === 'deleted') {
+        return others;
+      }
+      const existing = current.find((file) => file.name === change.name);
+      if (existing && existing.version >= change.version) {
+        return current;
+      }
+      const file = { name: change.name, last_edit: change.last_edit, version: change.version };
+      return [...others, file].sort((a, b) => (a.name < b.name ? -1 : 1));
+    });
+  };
+
   const handleCreateFile = async () => {
     try {
       await api.post('api/files', 
@@ -62,7 +142,9 @@ const HomePage = () => {
       message.success('File created successfully');
       setIsModalVisible(false);
       setNewFileName('');
-      await fetchFiles();
+      if (!live.current) {
+        await fetchFiles();
+      }
       await handleOpenProject(newFileName);
     } catch (error) {
       console.error('Error creating file:', error);
@@ -74,7 +156,7 @@ const HomePage = () => {
     try {
       await api.delete(`/api/files/${filename}`, { withCredentials: true });
       message.success('File deleted successfully');
-      fetchFiles();
+      applyChange({ type: 'deleted', name: filename });
     } catch (error) {
       console.error('Error deleting file:', error);
       message.error('Failed to delete file');